@@ -0,0 +1,350 @@
+"""
+Statistics of an encounter, calculated after the fight from its samples:
+rolling dps over any window, the best burst, percentiles, the time to kill
+and the dps lost to downtime.
+
+The samples are loaded as columns (arrays) with the running total of the
+damage, so the damage between any two samples is a subtraction. With NumPy
+installed the statistics are calculated on the whole columns at once, the
+start of every window found with a binary search, otherwise with loops in
+pure Python, which are several times slower on long encounters. NumPy also
+loads the columns of a binary log straight from its records, without a
+LogRecord per sample.
+
+Usage:
+    python analytics.py session.gwlog [encounter number]
+"""
+from itertools import compress
+from array import array
+from sessionlog import SessionLog, read_log, MAGIC, RECORD, FLAG_INCOMBAT
+import sys
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+else:
+    # sessionlog.RECORD
+    RECORD_DTYPE = numpy.dtype({
+        'names': ['time', 'health', 'max_health', 'dmg', 'flags'],
+        'formats': ['<f8', '<f4', '<f4', '<f4', 'u1'],
+        'offsets': [0, 8, 12, 16, 20],
+        'itemsize': RECORD.size})
+
+PERCENTILES = (50, 90, 99)
+BURSTS = (5, 10, 30)
+
+
+class Encounter(object):
+    """
+    The samples of an encounter, from LogRecords or Samples
+    """
+    def __init__(self, records):
+        self.times = array('d')
+        self.dmg = array('d')
+        self.health = array('d')
+        self.max_health = array('d')
+        self.incombat = array('B')
+        # totals[n] is the damage of the samples up to n, included
+        self.totals = array('d')
+
+        total = 0.0
+        for record in records:
+            self.times.append(record.time)
+            self.dmg.append(record.dmg)
+            self.health.append(record.health)
+            self.max_health.append(record.max_health)
+            self.incombat.append(bool(record.incombat))
+            total += record.dmg
+            self.totals.append(total)
+
+    @classmethod
+    def from_log(cls, fname, number=None):
+        """
+        Loads encounter number of a binary log, or the whole log if number
+        is None (or the log is a text log)
+        """
+        with open(fname, 'rb') as fobj:
+            binary = fobj.read(len(MAGIC)) == MAGIC
+        if not binary or (number is None and numpy is None):
+            return cls(read_log(fname))
+
+        log = SessionLog(fname)
+        try:
+            start, stop = (0, len(log)) if number is None \
+                          else log.encounters()[number]
+            if numpy is None:
+                return cls(log.records(start, stop))
+            return cls.from_buffer(log.record_buffer(start, stop))
+        finally:
+            log.close()
+
+    @classmethod
+    def from_buffer(cls, data):
+        """
+        Loads the packed sessionlog records in data (a buffer or a string)
+        with NumPy, the columns are copied out of it
+        """
+        records = numpy.frombuffer(data, RECORD_DTYPE)
+        dmg = records['dmg'].astype(numpy.float64)
+
+        encounter = cls([])
+        encounter.times = array('d', records['time'].tostring())
+        encounter.dmg = array('d', dmg.tostring())
+        encounter.health = array(
+            'd', records['health'].astype(numpy.float64).tostring())
+        encounter.max_health = array(
+            'd', records['max_health'].astype(numpy.float64).tostring())
+        encounter.incombat = array(
+            'B', (records['flags'] & FLAG_INCOMBAT).tostring())
+        encounter.totals = array('d', numpy.cumsum(dmg).tostring())
+        return encounter
+
+    def __len__(self):
+        return len(self.times)
+
+    def _columns(self, *names):
+        """
+        Returns numpy arrays sharing the memory of the columns
+        """
+        return [numpy.frombuffer(getattr(self, name),
+                                 numpy.uint8 if name == 'incombat'
+                                 else numpy.float64)
+                for name in names]
+
+    def _starts(self, window):
+        """
+        Returns a numpy array with the index of the sample each window
+        ending at a sample starts at: the last sample at least window
+        seconds older, or the first sample
+        """
+        times, = self._columns('times')
+        starts = numpy.searchsorted(times, times - window, 'right') - 1
+        return numpy.maximum(starts, 0)
+
+    @property
+    def duration(self):
+        return self.times[-1] - self.times[0] if self.times else 0.0
+
+    @property
+    def damage(self):
+        """
+        Damage done after the first sample, which is the reference
+        """
+        return self.totals[-1] - self.totals[0] if self.totals else 0.0
+
+    def dps(self):
+        """
+        Average dps over the whole encounter
+        """
+        return int(self.damage / self.duration) if self.duration > 0 else 0
+
+    def rolling_dps(self, window):
+        """
+        Returns an array with the dps of every sample averaged over the
+        last window seconds, like the meter calculates it. Until window
+        seconds have passed it's averaged since the first sample.
+        """
+        _check_window(window)
+        if numpy is not None and len(self):
+            times, totals = self._columns('times', 'totals')
+            starts = self._starts(window)
+            elapsed = times - times[starts]
+            moving = elapsed > 0
+            rolling = numpy.zeros(len(times))
+            rolling[moving] = (totals[moving] - totals[starts[moving]]) / \
+                              elapsed[moving]
+            return array('d', rolling.tostring())
+
+        times, totals = self.times, self.totals
+        rolling = array('d', [0.0]) * len(times)
+        start = 0
+        for index in xrange(1, len(times)):
+            now = times[index]
+            while now - times[start + 1] >= window:
+                start += 1
+            elapsed = now - times[start]
+            if elapsed > 0:
+                rolling[index] = (totals[index] - totals[start]) / elapsed
+        return rolling
+
+    def best_burst(self, seconds):
+        """
+        Returns (start time, dps) of the seconds long stretch with the
+        highest dps, None if the encounter is shorter than seconds
+        """
+        _check_window(seconds)
+        if numpy is not None and len(self):
+            times, totals = self._columns('times', 'totals')
+            starts = self._starts(seconds)
+            elapsed = times - times[starts]
+            # the stretches ending at the samples that last at least seconds
+            ends = numpy.flatnonzero(elapsed >= seconds)
+            if not len(ends):
+                return None
+            dps = (totals[ends] - totals[starts[ends]]) / elapsed[ends]
+            # the first of the best, like the loop
+            best = dps.argmax()
+            return times[starts[ends[best]]] - times[0], int(dps[best])
+
+        times, totals = self.times, self.totals
+        best, best_start = None, None
+        start = 0
+        for index in xrange(1, len(times)):
+            now = times[index]
+            # shortest stretch ending at index that lasts at least seconds
+            while now - times[start + 1] >= seconds:
+                start += 1
+            elapsed = now - times[start]
+            if elapsed >= seconds:
+                dps = (totals[index] - totals[start]) / elapsed
+                if best is None or dps > best:
+                    best, best_start = dps, times[start]
+
+        if best is None:
+            return None
+        return best_start - times[0], int(best)
+
+    def percentiles(self, window=1, percents=PERCENTILES):
+        """
+        Returns the percentiles (nearest rank) of the window seconds dps of
+        the samples in combat
+        """
+        if numpy is not None and len(self):
+            incombat, = self._columns('incombat')
+            rolling = numpy.frombuffer(self.rolling_dps(window))
+            values = numpy.sort(rolling[incombat.astype(bool)])
+        else:
+            values = sorted(compress(self.rolling_dps(window),
+                                     self.incombat))
+        if not len(values):
+            return [0] * len(percents)
+        return [int(values[min(len(values) - 1,
+                               int(len(values) * percent / 100.0))])
+                for percent in percents]
+
+    def time_to_kill(self):
+        """
+        Returns the seconds from the first damage until the target's health
+        reached 0, None if it didn't die
+        """
+        if numpy is not None and len(self):
+            dmg, health, max_health = self._columns('dmg', 'health',
+                                                    'max_health')
+            damaged = numpy.flatnonzero(dmg > 0)
+            if not len(damaged):
+                return None
+            first = damaged[0]
+            died = numpy.flatnonzero((health[first + 1:] <= 0) &
+                                     (max_health[first + 1:] > 0))
+            if not len(died):
+                return None
+            # damage is done between the previous sample and this one
+            return self.times[first + 1 + died[0]] - \
+                   self.times[max(first - 1, 0)]
+
+        dmg, health, max_health = self.dmg, self.health, self.max_health
+        first = None
+        for index in xrange(len(dmg)):
+            if first is None:
+                if dmg[index] > 0:
+                    # damage is done between the previous sample and this one
+                    first = self.times[max(index - 1, 0)]
+            elif health[index] <= 0 and max_health[index] > 0:
+                return self.times[index] - first
+        return None
+
+    def downtime(self):
+        """
+        Returns (seconds, dps lost): the time in combat without damage done,
+        and how much higher the dps would be without it
+        """
+        if numpy is not None and len(self):
+            times, dmg, incombat = self._columns('times', 'dmg', 'incombat')
+            elapsed = numpy.diff(times)
+            incombat = incombat[1:].astype(bool)
+            hit = dmg[1:] > 0
+            active = float(elapsed[incombat & hit].sum())
+            idle = float(elapsed[incombat & ~hit].sum())
+            if not active:
+                return idle, 0
+            damage = float(dmg[1:][incombat].sum())
+            return idle, int(damage / active - damage / (active + idle))
+
+        times, dmg, incombat = self.times, self.dmg, self.incombat
+        active = idle = 0.0
+        for index in xrange(1, len(times)):
+            if incombat[index]:
+                elapsed = times[index] - times[index - 1]
+                if dmg[index] > 0:
+                    active += elapsed
+                else:
+                    idle += elapsed
+
+        if not active:
+            return idle, 0
+        damage = sum(compress(dmg[1:], incombat[1:]))
+        return idle, int(damage / active - damage / (active + idle))
+
+    def summary(self, windows=(1, 5), bursts=BURSTS):
+        """
+        Returns all the statistics as a dict
+        """
+        idle, lost = self.downtime()
+        return {'samples': len(self),
+                'duration': self.duration,
+                'damage': self.damage,
+                'dps': self.dps(),
+                'percentiles': dict((window, self.percentiles(window))
+                                    for window in windows),
+                'bursts': dict((seconds, self.best_burst(seconds))
+                               for seconds in bursts),
+                'time_to_kill': self.time_to_kill(),
+                'downtime': idle,
+                'downtime_dps_lost': lost}
+
+
+def _check_window(window):
+    if window <= 0:
+        raise ValueError('the window must be longer than 0s, not %r' % window)
+
+
+def report(encounter):
+    """
+    Prints the summary of the encounter
+    """
+    summary = encounter.summary()
+    print '%s samples, %.1fs, %d damage, %s dps' % (
+          summary['samples'], summary['duration'], summary['damage'],
+          summary['dps'])
+    for window, values in sorted(summary['percentiles'].items()):
+        print '  %ss dps percentiles %s: %s' % (
+              window, '/'.join(['p%s' % percent for percent in PERCENTILES]),
+              '/'.join([str(value) for value in values]))
+    for seconds, burst in sorted(summary['bursts'].items()):
+        if burst:
+            print '  best %ss burst: %s dps at %.1fs' % (seconds, burst[1],
+                                                          burst[0])
+    if summary['time_to_kill'] is not None:
+        print '  time to kill: %.2fs' % summary['time_to_kill']
+    print '  downtime: %.1fs, %s dps lost' % (summary['downtime'],
+                                               summary['downtime_dps_lost'])
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        print __doc__
+    elif len(sys.argv) == 3:
+        report(Encounter.from_log(sys.argv[1], int(sys.argv[2])))
+    else:
+        with open(sys.argv[1], 'rb') as fobj:
+            binary = fobj.read(len(MAGIC)) == MAGIC
+        if not binary:
+            report(Encounter.from_log(sys.argv[1]))
+        else:
+            log = SessionLog(sys.argv[1])
+            count = len(log.encounters())
+            log.close()
+            for number in xrange(count):
+                print 'encounter %s:' % number
+                report(Encounter.from_log(sys.argv[1], number))
@@ -7,8 +7,12 @@ from ctypes import *
 import struct
 import os
 
-kernel32 = windll.kernel32
-psapi = WinDLL('Psapi.dll')
+try:
+    kernel32 = windll.kernel32
+    psapi = WinDLL('Psapi.dll')
+except NameError:
+    # not windows, only backends other than the Win32Backend can be used
+    kernel32 = psapi = None
 
 PROCESS_ALL_ACCESS = 0x1F0FFF
 
@@ -60,41 +64,155 @@ def _struct_type(cdatatype):
     """
     return STRUCT_CTYPE_CODE_AND_SIZE[cdatatype][0]
 
+# compiled struct objects, one per datatype, so reads don't rebuild them
+_STRUCTS = dict((datatype, struct.Struct('@' + code))
+                for datatype, (code, size) in STRUCT_CTYPE_CODE_AND_SIZE.items())
+
 def _convert(buf, datatype = 'int'):
     """
     Attempt to conver the buffer to standard endian for the lenght type specified
     """
-    rtn_str = struct.Struct('@' + _struct_type(datatype))
-    return rtn_str.unpack_from(buf)[0]
+    return _STRUCTS[datatype].unpack_from(buf)[0]
 
-class Proc(object):
+
+class ReadBatch(object):
+    """
+    A precompiled list of (offset, type) reads.
+
+    Reads that are close to each other are coalesced into a single span, so
+    read() costs one ReadProcessMemory per span instead of one per value.
+    The buffers and the struct used to decode each span are allocated once,
+    when the batch is created.
+
+    The offsets are relative to the base passed to read(), which allows the
+    same batch to be used for different targets, i.e. the current and max
+    health pair at (addr, addr + 0x4).
+    """
+    # largest hole between two reads that is still read as one span
+    MAX_GAP = 0x1000
+    # largest span read with one call
+    MAX_SPAN = 0x2000
+
+    def __init__(self, proc, requests):
+        self._proc = proc
+        self._size = len(requests)
+        self._count = c_ulong()
+        self._spans = []
+
+        order = sorted(range(self._size), key=lambda index: requests[index][0])
+
+        span, end = [], None
+        for index in order:
+            offset, rtntype = requests[index]
+            length = STRUCT_CTYPE_CODE_AND_SIZE[rtntype][1]
+            if span and (offset - end > self.MAX_GAP or
+                         offset + length - span[0][1] > self.MAX_SPAN):
+                self._add_span(span)
+                span = []
+            span.append((index, offset, rtntype, length))
+            end = max(end, offset + length) if len(span) > 1 \
+                  else offset + length
+
+        if span:
+            self._add_span(span)
+
+    def _add_span(self, span):
+        """
+        Compiles the span into a (start, length, buffer, struct, indexes,
+        requests) tuple
+        """
+        start = span[0][1]
+        fmt = '='
+        pos = start
+        indexes = []
+        for index, offset, rtntype, length in span:
+            if offset < pos:
+                # overlapping reads, decode it separately
+                self._add_span([(index, offset, rtntype, length)])
+                continue
+            if offset > pos:
+                fmt += '%dx' % (offset - pos)
+            fmt += _struct_type(rtntype)
+            pos = offset + length
+            indexes.append((index, offset, rtntype))
+
+        length = pos - start
+        self._spans.append((start, length, create_string_buffer(length),
+                            struct.Struct(fmt), indexes))
+
+    def read(self, base=0):
+        """
+        Reads all the values relative to base.
+
+        Returns a tuple with the values in the same order as the requests.
+        Values that failed to read are False, same as Proc.read_memory.
+        """
+        values = [False] * self._size
+        proc = self._proc
+        pcount = byref(self._count)
+
+        for start, length, buf, decoder, indexes in self._spans:
+            if proc.read_raw(base + start, buf, length, pcount):
+                for index, value in zip(indexes, decoder.unpack_from(buf)):
+                    values[index[0]] = value
+            elif len(indexes) > 1:
+                # the span could cross into unreadable memory, fall back to
+                # reading the values one by one
+                for index, offset, rtntype in indexes:
+                    values[index] = proc.read_memory(base + offset, rtntype)
+            else:
+                proc.read_failures += 1
+
+        return tuple(values)
+
+class MemoryBackend(object):
+    """
+    Interface to the memory of a process used by Proc
+    """
+    def read(self, address, buf, length, pcount):
+        """
+        Reads length bytes at address into buf. pcount is a byref(c_ulong)
+        that receives the number of bytes read.
+
+        Returns True on success
+        """
+        raise NotImplementedError
+
+    def get_image_name(self):
+        """
+        Returns the image name of the process
+        """
+        raise NotImplementedError
+
+    def find_base_addr(self, module_name):
+        """
+        Returns the base address of module_name, None if not found
+        """
+        raise NotImplementedError
+
+    def get_image_size(self, base):
+        """
+        Returns the size of the image of the module loaded at base
+        """
+        raise NotImplementedError
+
+
+class Win32Backend(MemoryBackend):
+    """
+    Reads the memory of a windows process with ReadProcessMemory
+    """
     def __init__(self, pid):
         self.hproc = None
         self.pid = pid
         self.open_process()
-        self.base_addr = self.find_base_addr(self.get_image_name())
 
     def open_process(self):
         self.hproc = kernel32.OpenProcess(PROCESS_ALL_ACCESS, False, self.pid)
         return self.hproc
 
-    def read_memory(self, address, rtntype='int'):
-        """
-        Reads the process memory and returns it in little endian
-        """
-        length = STRUCT_CTYPE_CODE_AND_SIZE[rtntype][1]
-
-        buf = create_string_buffer(length)
-        count = c_ulong()
-
-        rv = kernel32.ReadProcessMemory(self.hproc, address,
-                                        buf, length, byref(count))
-
-        if not rv:
-            # failed to read
-            return False
-        else:
-            return _convert(buf, rtntype)
+    def read(self, address, buf, length, pcount):
+        return bool(kernel32.ReadProcessMemory(self.hproc, address,
+                                               buf, length, pcount))
 
     def get_image_name(self):
         """
@@ -130,55 +248,176 @@ class Proc(object):
                                        modname, sizeof(modname))
             print modname.value
 
-    def _get_base(self, hmodule):
+    def get_image_size(self, base):
         """
-        Returns the lpBaseOfDll for the specified hmodule
+        Returns the SizeOfImage of the module loaded at base, the hmodule of
+        a module is its base address
         """
         info = MODULEINFO()
-        psapi.GetModuleInformation(self.hproc, hmodule,
-                                   byref(info),sizeof(info))
-        return info.lpBaseOfDll
+        psapi.GetModuleInformation(self.hproc, c_void_p(base),
+                                   byref(info), sizeof(info))
+        return info.SizeOfImage
+
+    def find_base_addr(self, module_name):
+        """
+        Attempts to find the base address for the specified module_name.
+
+        The hmodule of a module is its base address, and the image of the
+        process is the first module enumerated, so finding the image's base
+        only takes one EnumProcessModules and one GetModuleBaseNameA
+        """
+        module_name = module_name.lower()
+        modname = c_buffer(MAX_PATH)
+
+        for module in self.enum_modules():
+            psapi.GetModuleBaseNameA(self.hproc, c_void_p(module),
+                                     modname, sizeof(modname))
+            if module_name in modname.value.lower():
+                return module
+
+
+class Proc(object):
+    """
+    Reads the memory of a process through a MemoryBackend, by default the
+    Win32Backend of the process pid
+
+    read_failures is the number of values that couldn't be read, by
+    read_memory or a ReadBatch
+    """
+    def __init__(self, pid=None, backend=None):
+        self.pid = pid
+        self.backend = backend or Win32Backend(pid)
+        self.read_failures = 0
+        self.base_addr = self.find_base_addr(self.get_image_name())
+
+    def read_memory(self, address, rtntype='int'):
+        """
+        Reads the process memory and returns it in little endian
+        """
+        length = STRUCT_CTYPE_CODE_AND_SIZE[rtntype][1]
+
+        buf = create_string_buffer(length)
+        count = c_ulong()
+
+        if not self.read_raw(address, buf, length, byref(count)):
+            # failed to read
+            self.read_failures += 1
+            return False
+        else:
+            return _convert(buf, rtntype)
+
+    def read_raw(self, address, buf, length, pcount):
+        """
+        Reads length bytes at address into buf. pcount is a byref(c_ulong)
+        that receives the number of bytes read.
+
+        Returns True on success
+        """
+        return self.backend.read(address, buf, length, pcount)
+
+    def batch(self, requests):
+        """
+        Returns a ReadBatch for the list of (offset, type) requests.
+        Keep the returned object around and call read(base) on every tick.
+        """
+        return ReadBatch(self, requests)
+
+    def read_batch(self, requests):
+        """
+        Reads a list of (address, type) requests at once.
+
+        Returns a tuple of the decoded values, in the same order as the
+        requests. Use Proc.batch for reads that are repeated.
+        """
+        return ReadBatch(self, requests).read()
+
+    def get_image_name(self):
+        """
+        Returns the image name of the process
+        """
+        return self.backend.get_image_name()
 
     def find_base_addr(self, module_name):
         """
         Attempts to find the base address for the specified module_name
         """
-        modules = self.enum_modules()
+        return self.backend.find_base_addr(module_name)
 
-        for module in modules:
-            modname = c_buffer(280)
-            psapi.GetModuleFileNameExA(self.hproc, module,
-                                       modname, sizeof(modname))
-            if module_name.lower() in modname.value.lower():
-                return self._get_base(module)
+    def get_image_size(self, base=None):
+        """
+        Returns the size of the image of the module loaded at base, by
+        default the process' module
+        """
+        return self.backend.get_image_size(self.base_addr if base is None
+                                           else base)
 
     def pointer_trail(self, base, offsets, size=4, rtntype='int'):
         """
         Goes throug the pointer trails to find the value pointed by the
-        last pointer
+        last pointer. If rtntype is None, only the address is resolved and
+        the value is not read.
+
+        Every link is read on every call, one read per offset: any of them
+        can change between two calls (i.e. the objects in the middle of the
+        trail when another target is selected), and they are in different
+        objects so they can't be read at once.
 
-        Returns None if failed to read the trail (Null pointer found)
+        Returns a PointerTrail, addr and value are None if failed to read
+        the trail (Null pointer found)
         """
-        starting = base
-        pointed = self.read_memory(starting, 'int')
-        ptrail = type('ptrail', (), {'addr': None, 'value': None})
+        ptrail = PointerTrail()
 
-        isvalid = lambda pointer: pointer > 0
+        addr = _trail_addr(self.walk_trail(base, offsets), offsets)
 
-        if not isvalid(pointed):
+        if addr is None:
             return ptrail
 
+        ptrail.addr = addr
+        if rtntype is not None:
+            ptrail.value = self.read_memory(ptrail.addr, rtntype)
+
+        return ptrail
+
+    def walk_trail(self, base, offsets):
+        """
+        Reads the pointers of the trail, stops at the first null pointer.
+
+        Returns the list of pointers read, the last one may be invalid
+        """
+        links = [self.read_memory(base, 'int')]
+
         for offset in offsets[:-1]:
-            addr = pointed + offset
-            pointed = self.read_memory(addr, 'int')
-            if not isvalid(pointed):
-                return ptrail
+            if not _isvalid(links[-1]):
+                break
+            links.append(self.read_memory(links[-1] + offset, 'int'))
 
-        addr = pointed + offsets[-1]
-        if not isvalid(addr):
-            return ptrail
+        return links
 
-        ptrail.addr = addr
-        ptrail.value = self.read_memory(ptrail.addr, rtntype)
 
-        return ptrail
\ No newline at end of file
+def _isvalid(pointer):
+    """
+    Returns True if the pointer could point to something
+    """
+    return pointer > 0
+
+def _trail_addr(links, offsets):
+    """
+    Returns the address pointed by a fully resolved trail, or None if one
+    of the links in the trail is a null pointer
+    """
+    if len(links) == len(offsets) and _isvalid(links[-1]):
+        addr = links[-1] + offsets[-1]
+        if _isvalid(addr):
+            return addr
+    return None
+
+
+class PointerTrail(object):
+    """
+    Result of Proc.pointer_trail
+    """
+    __slots__ = ('addr', 'value')
+
+    def __init__(self, addr=None, value=None):
+        self.addr = addr
+        self.value = value
@@ -0,0 +1,220 @@
+"""
+Benchmarks of the sampling and dps hot paths, run against the simulated
+game process (simproc) so they are deterministic and don't need the game.
+
+Every call is timed on its own and the latency percentiles are printed.
+The results can be saved as json and compared to a previous run to spot
+regressions between versions.
+
+--startup N launches N new interpreters and times the import of the meter,
+attaching to the (simulated) game and the first sample separately.
+
+Usage:
+    python bench.py [--runs short,long,verylong] [--startup N]
+                    [--output results.json] [--compare previous.json]
+"""
+from simproc import SimulatedProcess, Scenario, fight, IMAGE_BASE
+from gw2dps import DamageMeter
+from dps import CombatTracker
+from sampler import clock
+import subprocess
+import argparse
+import platform
+import json
+import sys
+import os
+
+MS = 250
+
+# name, seconds in combat
+RUNS = (('short', 60),
+        ('long', 30*60),
+        ('verylong', 3*60*60))
+
+PERCENTILES = (50, 90, 99, 100)
+
+# run in a new interpreter by startup(), prints the times as json
+STARTUP = """
+import time
+started = time.time()
+import gw2dps
+imported = time.time()
+
+from simproc import SimulatedProcess
+from sampler import Sampler
+import json
+sim = SimulatedProcess()
+
+attaching = time.time()
+meter = gw2dps.DamageMeter(ms=%(ms)s, backend=sim, clock=sim.clock)
+attached = time.time()
+Sampler(meter, ms=%(ms)s).sample()
+sampled = time.time()
+
+print json.dumps({'import': imported - started,
+                  'attach': attached - attaching,
+                  'first sample': sampled - attached})
+"""
+
+
+def percentiles(values, percents=PERCENTILES):
+    """
+    Returns the list of percentiles (nearest rank) of the values
+    """
+    values = sorted(values)
+    return [values[min(len(values) - 1, int(len(values) * percent / 100.0))]
+            for percent in percents]
+
+
+def make_display():
+    """
+    Returns a DamageDisplay on a hidden Tk root, or None if Tk can't be used
+    (i.e. no display)
+    """
+    try:
+        import Tkinter as tk
+        root = tk.Tk()
+    except Exception:
+        return None
+
+    from ui.elements import DamageDisplay
+    root.withdraw()
+    return DamageDisplay(root, 'Instant:', MS, {},
+                         font=('times', 15, 'bold'), bg='#222222')
+
+
+def bench_run(duration, ms=MS):
+    """
+    Runs a fight of duration seconds in combat, timing each of the calls on
+    every tick. Returns a dict of name: list of seconds
+    """
+    sim = SimulatedProcess()
+    meter = DamageMeter(ms=ms, backend=sim, clock=sim.clock)
+    proc = meter._proc
+    scenario = Scenario(sim, fight(duration))
+    base, offsets = meter._possible_targets[1]
+
+    tracker = CombatTracker()
+    display = make_display()
+
+    timings = dict((name, []) for name in
+                   ['Proc.read_memory', 'Proc.pointer_trail',
+                    'DamageMeter.selected_target',
+                    'DamageMeter.target_health_values',
+                    'DamageMeter.calculate_dps', 'CombatTracker.add'])
+    if display:
+        timings['DamageDisplay.display_dps'] = []
+
+    def timed(name, func, *args, **kwargs):
+        started = clock()
+        rtn = func(*args, **kwargs)
+        timings[name].append(clock() - started)
+        return rtn
+
+    period = ms/1000.0
+    while scenario.advance(period):
+        timed('Proc.read_memory', proc.read_memory,
+              sim.target or IMAGE_BASE, 'float')
+        timed('Proc.pointer_trail', proc.pointer_trail, base, offsets,
+              rtntype='float')
+        timed('DamageMeter.selected_target', meter.selected_target)
+
+        dmg, health, max_health, stamp = \
+                timed('DamageMeter.target_health_values',
+                      meter.target_health_values)
+        inst, sustained = timed('DamageMeter.calculate_dps',
+                                meter.calculate_dps, dmg, stamp, (1, 5))
+        incombat = sim.incombat
+        timed('CombatTracker.add', tracker.add, inst, incombat, stamp)
+        if display:
+            timed('DamageDisplay.display_dps', display.display_dps,
+                  inst, incombat, True, stamp)
+
+    return timings
+
+
+def startup(launches=10, ms=MS):
+    """
+    Times the startup in launches new interpreters. Returns a dict of
+    name: list of seconds
+    """
+    timings = {}
+    for _ in xrange(launches):
+        output = subprocess.check_output(
+                [sys.executable, '-c', STARTUP % {'ms': ms}],
+                cwd=os.path.dirname(os.path.abspath(__file__)))
+        for name, seconds in json.loads(output).items():
+            timings.setdefault('startup %s' % name, []).append(seconds)
+    return timings
+
+
+def statistics(times):
+    """
+    Returns the number of calls and the percentiles in microseconds
+    """
+    return dict([('calls', len(times))] +
+                [('p%s' % percent, value * 1e6)
+                 for percent, value in zip(PERCENTILES, percentiles(times))])
+
+
+def run(runs=None, launches=None):
+    """
+    Runs the benchmarks, returns a dict of 'name run': statistics
+
+    launches - number of launches timed by startup, none by default
+    """
+    results = {}
+    for run_name, duration in RUNS:
+        if runs and run_name not in runs:
+            continue
+        for name, times in sorted(bench_run(duration).items()):
+            results['%s %s' % (name, run_name)] = statistics(times)
+
+    if launches:
+        for name, times in startup(launches).items():
+            results[name] = statistics(times)
+    return results
+
+
+def report(results, previous=None):
+    """
+    Prints the results in microseconds. If there are previous results, the
+    ratio of the p50s is printed as well
+    """
+    columns = ['p%s' % percent for percent in PERCENTILES]
+    print '%-45s %8s' % ('call run', 'calls') + \
+          ''.join(['%10s' % column for column in columns]) + \
+          ('%10s' % 'p50 x' if previous else '')
+
+    for key in sorted(results):
+        stats = results[key]
+        line = '%-45s %8s' % (key, stats['calls']) + \
+               ''.join(['%10.2f' % stats[column] for column in columns])
+        if previous and key in previous:
+            line += '%10.2f' % (stats['p50'] / previous[key]['p50'])
+        print line
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='gw2dps benchmarks')
+    parser.add_argument('--runs', help='comma separated: ' +
+                        ','.join([name for name, _ in RUNS]))
+    parser.add_argument('--startup', type=int, metavar='N',
+                        help='time the startup in N new interpreters')
+    parser.add_argument('--output', help='save the results as json')
+    parser.add_argument('--compare', help='results of a previous run')
+    args = parser.parse_args()
+
+    results = run(args.runs.split(',') if args.runs else None, args.startup)
+
+    previous = None
+    if args.compare:
+        with open(args.compare) as fobj:
+            previous = json.load(fobj)['results']
+    report(results, previous)
+
+    if args.output:
+        with open(args.output, 'w') as fobj:
+            json.dump({'python': sys.version,
+                       'platform': platform.platform(),
+                       'results': results}, fobj, indent=1, sort_keys=True)
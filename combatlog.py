@@ -0,0 +1,123 @@
+"""
+Combat log. The samples are written to file in batches from a background
+thread, so logging costs the UI thread nothing more than a deque append.
+"""
+from collections import deque
+import threading
+import time
+import os
+
+
+class TextLogFormat(object):
+    """
+    One line per sample:
+        time health max_health dmg incombat
+    time is in seconds from the sampler's monotonic clock
+    """
+    extension = '.txt'
+    mode = 'w'
+
+    def header(self, sample=None):
+        started = time.strftime('%Y-%m-%d %H:%M:%S')
+        clock = '%.3f' % sample.time if sample else ''
+        return '# gw2dps session started %s, clock %s\n' \
+               '# time health max_health dmg incombat\n' % (started, clock)
+
+    def records(self, samples):
+        return ''.join(['%.3f %.1f %.1f %.1f %d\n' %
+                        (sample.time, sample.health, sample.max_health,
+                         sample.dmg, sample.incombat)
+                        for sample in samples])
+
+    def footer(self):
+        return ''
+
+
+class CombatLogWriter(threading.Thread):
+    """
+    Thread writing the samples to fname.
+
+    The samples are written when batch_size samples are waiting, or
+    flush_secs after the last write, whichever comes first. The file is
+    kept open for the whole session.
+    """
+    def __init__(self, fname, logformat=None,
+                 batch_size=256, flush_secs=5.0, poll_secs=0.25):
+        threading.Thread.__init__(self, name='gw2dps combat log')
+        self.daemon = True
+
+        self.fname = fname
+        self._format = logformat or TextLogFormat()
+        self._batch_size = batch_size
+        self._flush_secs = flush_secs
+        self._poll_secs = poll_secs
+
+        self._samples = deque()
+        self._running = True
+        self._header = False
+        self.written = 0
+
+    def log(self, sample):
+        """
+        Queue a sample to be written, can be called from any thread
+        """
+        self._samples.append(sample)
+
+    def _take(self):
+        """
+        Returns the queued samples
+        """
+        samples = []
+        popleft = self._samples.popleft
+        while True:
+            try:
+                samples.append(popleft())
+            except IndexError:
+                return samples
+
+    def _write(self, fobj):
+        samples = self._take()
+        if not self._header:
+            fobj.write(self._format.header(samples[0] if samples else None))
+            self._header = True
+        if samples:
+            fobj.write(self._format.records(samples))
+            fobj.flush()
+            self.written += len(samples)
+
+    def run(self):
+        with open(self.fname, self._format.mode) as fobj:
+            last_flush = time.time()
+            while self._running:
+                time.sleep(self._poll_secs)
+                if len(self._samples) >= self._batch_size or \
+                   time.time() - last_flush >= self._flush_secs:
+                    self._write(fobj)
+                    last_flush = time.time()
+
+            self._write(fobj)
+            fobj.write(self._format.footer())
+
+    def close(self):
+        """
+        Write the remaining samples and close the file
+        """
+        self._running = False
+        if self.is_alive():
+            self.join()
+
+
+def session_filename(log_dir, logformat=None, prefix='dps'):
+    """
+    Returns the name of the log file of a new session. The names only have
+    a one second resolution, a session started in the same second as
+    another one gets a -2, -3... suffix instead of overwriting it
+    """
+    extension = (logformat or TextLogFormat()).extension
+    name = os.path.join(log_dir, '%s-%s' % (prefix,
+                                            time.strftime('%Y%m%d-%H%M%S')))
+    fname, number = name + extension, 1
+    while os.path.exists(fname):
+        number += 1
+        fname = '%s-%d%s' % (name, number, extension)
+    return fname
@@ -0,0 +1,362 @@
+"""
+DPS calculations used by the meter. Kept apart from the UI and from the
+process memory reading so the same code can be used anywhere.
+"""
+from array import array
+
+# window size for the dps averaged over the whole encounter
+ENCOUNTER = None
+
+
+class DPSEngine(object):
+    """
+    Calculates the dps over any number of windows from a single store of
+    timestamped dmg samples.
+
+    The samples are stored as running totals in a ring buffer (prefix sums),
+    the damage done since sample n is total[now] - total[n]. Each window keeps
+    the index of the sample it starts at, which only moves forward, so adding
+    a sample and calculating the dps of a window are both O(1) no matter how
+    long the window is or how many windows there are.
+
+    The dps is the damage divided by the time that actually elapsed between
+    the samples, not by the window size, so late or early samples don't
+    skew it.
+
+    ms - expected sample period in milliseconds, used to size the buffer
+
+    windows - window sizes in seconds. ENCOUNTER is the average since the
+              last call to start_encounter
+
+    capacity - number of samples kept, by default enough for the longest
+               window at twice the expected sample rate
+    """
+    def __init__(self, ms=250, windows=(1, 5), capacity=None):
+        self._ms = ms
+        self.windows = tuple(windows)
+
+        longest = max([window for window in self.windows
+                       if window is not ENCOUNTER] or [1])
+        self._size = capacity or int(longest * 1000/ms * 2) + 2
+        self.reset()
+
+    def reset(self):
+        """
+        Clear all the samples
+        """
+        self._totals = array('d', [0.0]) * self._size
+        self._times = array('d', [0.0]) * self._size
+        self._count = 0
+        self._total = 0.0
+        self._starts = {}
+        self._encounter = None
+
+    def start_encounter(self):
+        """
+        Start averaging the ENCOUNTER window from the latest sample
+        """
+        if self._count:
+            self._encounter = (self._times[self._count % self._size],
+                               self._total)
+
+    def add_sample(self, dmg, stamp):
+        """
+        Add the damage taken by the target since the previous sample.
+
+        stamp - time of the sample in seconds, from a monotonic clock
+        """
+        self._total += dmg
+        self._count += 1
+        index = self._count % self._size
+        self._totals[index] = self._total
+        self._times[index] = stamp
+
+    def dps(self, window=1):
+        """
+        Returns the dps averaged over the last window seconds. The dps is 0
+        until the samples span the whole window.
+        """
+        count, size = self._count, self._size
+        if count < 2:
+            return 0
+
+        now = self._times[count % size]
+
+        if window is ENCOUNTER:
+            if self._encounter is None:
+                return 0
+            start_time, start_total = self._encounter
+            elapsed = now - start_time
+            if elapsed <= 0:
+                return 0
+            return int((self._total - start_total) / elapsed)
+
+        # the first sample is only the reference for the next one
+        oldest = max(1, count - size + 1)
+        start = max(self._starts.get(window, oldest), oldest)
+
+        # move the start to the last sample that is at least window seconds
+        # old
+        times = self._times
+        while start < count and now - times[(start + 1) % size] >= window:
+            start += 1
+        self._starts[window] = start
+
+        elapsed = now - times[start % size]
+        if elapsed < window and oldest == 1:
+            # not enough samples yet
+            return 0
+        elif elapsed <= 0:
+            return 0
+
+        return int((self._total - self._totals[start % size]) / elapsed)
+
+
+class P2Quantile(object):
+    """
+    Estimates a quantile (0 < p < 1) of a stream of weighted values in
+    constant memory with the P-square algorithm (Jain and Chlamtac): five
+    markers are moved towards the ideal positions of the min, p/2, p,
+    (1+p)/2 and max quantiles, their heights adjusted with a parabolic
+    formula. The positions are sums of weights, so a value of weight w
+    counts as w values of weight 1, and costs the same as one. Exact until
+    5 values were added.
+    """
+    def __init__(self, p):
+        self.p = p
+        # (value, weight) of the first values
+        self._values = []
+        self._heights = []
+        self._positions = []
+        self._desired = []
+        self._increments = [0, p/2.0, p, (1 + p)/2.0, 1]
+
+    def add(self, value, weight=1.0):
+        if weight <= 0:
+            return
+        heights = self._heights
+        if not heights:
+            values = self._values
+            values.append((value, weight))
+            if len(values) == 5:
+                values.sort()
+                total = 0.0
+                for value, weight in values:
+                    total += weight
+                    heights.append(value)
+                    self._positions.append(total)
+                first = self._positions[0]
+                self._desired = [first + (total - first) * increment
+                                 for increment in self._increments]
+            return
+
+        # cell of the value, updating the min and max
+        if value < heights[0]:
+            heights[0] = value
+            cell = 0
+        elif value >= heights[4]:
+            heights[4] = value
+            cell = 3
+        else:
+            cell = 0
+            while value >= heights[cell + 1]:
+                cell += 1
+
+        positions, desired = self._positions, self._desired
+        for index in xrange(cell + 1, 5):
+            positions[index] += weight
+        for index in xrange(5):
+            desired[index] += weight * self._increments[index]
+
+        # adjust the middle markers, by whole steps that keep them apart
+        for index in xrange(1, 4):
+            delta = desired[index] - positions[index]
+            above = positions[index + 1] - positions[index]
+            below = positions[index - 1] - positions[index]
+            if delta >= 1 and above > 1:
+                step = max(1, int(min(delta, above - 1)))
+            elif delta <= -1 and below < -1:
+                step = min(-1, int(max(delta, below + 1)))
+            else:
+                continue
+            height = self._parabolic(index, step)
+            if not heights[index - 1] < height < heights[index + 1]:
+                height = self._linear(index, step)
+            heights[index] = height
+            positions[index] += step
+
+    def _parabolic(self, i, step):
+        heights, positions = self._heights, self._positions
+        return heights[i] + step / float(positions[i + 1] - positions[i - 1]) * (
+               (positions[i] - positions[i - 1] + step) *
+               (heights[i + 1] - heights[i]) /
+               float(positions[i + 1] - positions[i]) +
+               (positions[i + 1] - positions[i] - step) *
+               (heights[i] - heights[i - 1]) /
+               float(positions[i] - positions[i - 1]))
+
+    def _linear(self, i, step):
+        heights, positions = self._heights, self._positions
+        side = 1 if step > 0 else -1
+        return heights[i] + step * (heights[i + side] - heights[i]) / \
+               float(positions[i + side] - positions[i])
+
+    def value(self):
+        """
+        Returns the estimated quantile, 0 if no value was added
+        """
+        if self._heights:
+            return self._heights[2]
+        if not self._values:
+            return 0
+        # exact, weighted nearest rank
+        values = sorted(self._values)
+        rank = sum([weight for _, weight in values]) * self.p
+        for value, weight in values:
+            rank -= weight
+            if rank < 0:
+                return value
+        return values[-1][0]
+
+
+class StreamStats(object):
+    """
+    Count, weighted mean and variance (West's weighted Welford), max and
+    quantiles of a stream of values, in constant memory and O(1) per value.
+
+    Each value has a weight, i.e. the seconds since the previous sample when
+    the samples aren't evenly spaced, so the mean is the time average. The
+    quantile estimators are fed every value once with its weight in units of
+    resolution, so they are time weighted as well, and adding a value costs
+    the same whatever its weight. weight is the sum of the weights, and
+    total the sum of the weighted values.
+
+    trim_zeros - the zeros at the end of the stream aren't part of the
+                 statistics, i.e. the zeros while waiting to leave combat
+                 after the target died. The zeros are held back and only
+                 added when a non zero value follows them
+    """
+    QUANTILES = (0.5, 0.95, 0.99)
+
+    def __init__(self, trim_zeros=True, quantiles=QUANTILES, resolution=1.0):
+        self._trim_zeros = trim_zeros
+        self._resolution = resolution
+        self.count = 0
+        self.weight = 0.0
+        self.total = 0.0
+        self.mean = 0.0
+        self._m2 = 0.0
+        self.max = 0
+        self.zeros = 0
+        self._zeros_weight = 0.0
+        self._quantiles = [P2Quantile(q) for q in quantiles]
+
+    def add(self, value, weight=1.0):
+        if self._trim_zeros and value == 0:
+            self.zeros += 1
+            self._zeros_weight += weight
+            return
+
+        if self.zeros:
+            # the held back zeros are added at once, with their total weight
+            self.count += self.zeros - 1
+            self._add(0, self._zeros_weight)
+            self.zeros, self._zeros_weight = 0, 0.0
+        self._add(value, weight)
+
+    def _add(self, value, weight):
+        self.count += 1
+        if value > self.max:
+            self.max = value
+        if weight <= 0:
+            return
+
+        self.weight += weight
+        self.total += value * weight
+        delta = value - self.mean
+        self.mean += delta * weight / self.weight
+        self._m2 += weight * delta * (value - self.mean)
+
+        for quantile in self._quantiles:
+            quantile.add(value, weight / self._resolution)
+
+    @property
+    def variance(self):
+        return self._m2 / self.weight if self.weight else 0.0
+
+    @property
+    def stdev(self):
+        return self.variance ** 0.5
+
+    def quantiles(self):
+        """
+        Returns the estimated quantiles
+        """
+        return [quantile.value() for quantile in self._quantiles]
+
+
+class CombatTracker(object):
+    """
+    Keeps track of the max dps, and of the statistics (StreamStats) of the
+    dps of the last time the character was in combat. The zeros at the end
+    of the combat (waiting to leave combat after the target died) are not
+    part of them. The memory used is the same however long the combat.
+
+    The samples are weighted by the time since the previous one, so the
+    averages stay right when the sampling rate changes (see
+    sampler.AdaptiveSchedule). Without stamps every sample weighs the same.
+
+    resolution - seconds of combat the quantile markers move by at least
+    """
+    def __init__(self, resolution=0.05):
+        self._resolution = resolution
+        self._incombat = None
+        self._stamp = None
+        self.prev_incombat = None
+        self.prev_incombat_avg = 0
+        self.max = 0
+
+    def reset(self):
+        """
+        Reset the max and prev incombat avg
+        """
+        self.max, self.prev_incombat_avg = 0, 0
+        self.prev_incombat = None
+
+    def add(self, dps, incombat_indicator, stamp=None):
+        """
+        Add a dps value.
+
+        incomabt_indicator - True if in combat false otherwises
+
+        stamp - time of the sample, in seconds
+
+        Returns a tuple of (new max, new average), True if the max changed and
+        if the combat just ended and a new average was calculated.
+        """
+        newmax, newavg = False, False
+
+        if self.max < dps:
+            self.max = dps
+            newmax = True
+
+        if stamp is None:
+            weight, resolution = 1.0, 1.0
+        else:
+            # the dps of a sample covers the time since the previous one
+            weight = stamp - self._stamp if self._stamp is not None else 0.0
+            resolution = self._resolution
+            self._stamp = stamp
+
+        if incombat_indicator:
+            if self._incombat is None:
+                self._incombat = StreamStats(resolution=resolution)
+            self._incombat.add(dps, weight)
+        elif self._incombat is not None:
+            # out of combat, the statistics of the combat are final
+            stats, self._incombat = self._incombat, None
+            self.prev_incombat = stats
+            self.prev_incombat_avg = int(round(stats.mean))
+            newavg = True
+
+        return newmax, newavg
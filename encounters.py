@@ -0,0 +1,438 @@
+"""
+Splits the samples into encounters and keeps them in a SQLite database, so
+the fights can be compared across sessions.
+
+An encounter starts when entering combat and ends when leaving combat,
+when another target is selected or when the target dies. The summary of
+every encounter is stored in the encounters table, indexed by start time,
+target max health (which identifies the boss) and duration, and its
+samples in the samples table, packed as sessionlog records. The samples
+are stored in chunks as the fight goes on and only the running summary is
+kept, so the memory used is the same however long the fight.
+
+Usage:
+    python encounters.py list [database]
+    python encounters.py best MAX_HEALTH [count] [database]
+    python encounters.py import session.gwlog [database]
+"""
+from collections import deque
+from sessionlog import BinaryLogFormat, SessionLog, LogRecord, RECORD, \
+                       FLAG_INCOMBAT, read_log, MAGIC
+from sampler import Sample, READ_FAILED
+from dps import DPSEngine
+import threading
+import time
+import sys
+import os
+
+DATABASE = os.path.join(os.path.split(__file__)[0], 'encounters.db')
+
+# why an encounter ended
+COMBAT, TARGET, DEATH = 'combat', 'target', 'death'
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS encounters (
+    id INTEGER PRIMARY KEY,
+    started REAL NOT NULL,
+    duration REAL NOT NULL,
+    max_health REAL NOT NULL,
+    damage REAL NOT NULL,
+    dps INTEGER NOT NULL,
+    max_instant INTEGER NOT NULL,
+    killed INTEGER NOT NULL,
+    ended TEXT,
+    samples INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS samples (
+    encounter INTEGER NOT NULL REFERENCES encounters (id),
+    chunk INTEGER NOT NULL,
+    records BLOB NOT NULL,
+    PRIMARY KEY (encounter, chunk)
+);
+CREATE INDEX IF NOT EXISTS encounters_started ON encounters (started);
+CREATE INDEX IF NOT EXISTS encounters_boss
+    ON encounters (max_health, killed, duration);
+CREATE INDEX IF NOT EXISTS encounters_duration ON encounters (duration);
+"""
+
+COLUMNS = ('id', 'started', 'duration', 'max_health', 'damage', 'dps',
+           'max_instant', 'killed', 'ended', 'samples')
+
+
+class Summary(object):
+    """
+    Running summary of the samples of an encounter
+    """
+    def __init__(self, sample):
+        self.first = self.last = sample.time
+        # the first sample is the reference, its damage was done before
+        self.damage = 0.0
+        self.max_health = sample.max_health
+        self.max_instant = getattr(sample, 'instant', 0)
+        self.health = sample.health
+        self.count = 1
+
+    def add(self, sample):
+        self.last = sample.time
+        self.damage += sample.dmg
+        self.max_health = max(self.max_health, sample.max_health)
+        self.max_instant = max(self.max_instant,
+                               getattr(sample, 'instant', 0))
+        self.health = sample.health
+        self.count += 1
+
+    def row(self, ended, started):
+        """
+        Returns the row of the encounters table (without the id)
+
+        started - wall time of the first sample
+        """
+        duration = self.last - self.first
+        return (started, duration, self.max_health, self.damage,
+                int(self.damage / duration) if duration > 0 else 0,
+                self.max_instant, int(ended == DEATH), ended, self.count)
+
+
+class Segmenter(object):
+    """
+    Splits a stream of samples into encounters, numbered from 1. Only the
+    Summary of the current encounter is kept, its samples are passed on in
+    batches of batch_size as they come:
+
+        on_batch(number, samples, summary, ended)
+
+    summary and ended are None until the encounter ends, then on_batch is
+    called with the rest of its samples, its Summary and why it ended
+    (COMBAT, TARGET or DEATH). ended is None if no damage was done, the
+    samples passed on can be dropped.
+
+    Samples without a target attribute (i.e. LogRecords) are only split on
+    combat and death. Samples whose health couldn't be read are skipped.
+    """
+    def __init__(self, on_batch, batch_size=256):
+        self._on_batch = on_batch
+        self._batch_size = batch_size
+        self._number = 0
+        self._summary = None
+        self._samples = []
+        self._target = None
+        # the target died, wait for another target or the end of the combat
+        self._dead = False
+
+    def add(self, sample):
+        if sample.health == READ_FAILED:
+            return
+
+        target = getattr(sample, 'target', None)
+        if not sample.incombat:
+            self._end(COMBAT)
+            self._dead = False
+            return
+
+        if target and self._target and target != self._target:
+            self._end(TARGET)
+            self._dead = False
+
+        if self._dead:
+            return
+
+        summary = self._summary
+        if summary is None:
+            self._number += 1
+            summary = self._summary = Summary(sample)
+            died = False
+        else:
+            # the meter reads the health of a dead target as 0 (-1 is no
+            # target)
+            died = sample.health == 0 and summary.health > 0
+            summary.add(sample)
+
+        self._samples.append(sample)
+        if target:
+            self._target = target
+
+        if died:
+            self._end(DEATH)
+            self._dead = True
+        elif len(self._samples) >= self._batch_size:
+            samples, self._samples = self._samples, []
+            self._on_batch(self._number, samples, None, None)
+
+    def _end(self, reason):
+        summary, self._summary = self._summary, None
+        samples, self._samples = self._samples, []
+        if summary is not None:
+            self._on_batch(self._number, samples, summary,
+                           reason if summary.damage else None)
+        if reason != DEATH:
+            self._target = None
+
+    def flush(self):
+        """
+        End the current encounter
+        """
+        self._end(COMBAT)
+
+
+class EncounterStore(object):
+    """
+    The database of the encounters. Must be used from a single thread
+
+    recover - delete the encounters left without an end when the meter was
+              killed while recording them. Pass False to only read while a
+              meter is recording
+    """
+    def __init__(self, fname=DATABASE, recover=True):
+        # imported here so it's loaded by the EncounterRecorder's thread,
+        # not at startup
+        import sqlite3
+        self._db = sqlite3.connect(fname)
+        self._db.executescript(SCHEMA)
+        if recover:
+            self._recover()
+        # number of the encounters being recorded: [id, chunks written]
+        self._recording = {}
+
+    def _recover(self):
+        with self._db:
+            self._db.execute('DELETE FROM samples WHERE encounter IN '
+                             '(SELECT id FROM encounters WHERE ended IS NULL)')
+            self._db.execute('DELETE FROM encounters WHERE ended IS NULL')
+
+    def add(self, batches, offset=0.0):
+        """
+        Stores a list of the (number, samples, summary, ended) batches of a
+        Segmenter in one transaction. The row of an encounter is added with
+        its first batch, and has no ended until it ends.
+
+        offset - wall time of the sample time 0
+        """
+        with self._db:
+            for number, samples, summary, ended in batches:
+                recording = self._recording.get(number)
+                if recording is None:
+                    if summary is not None and ended is None:
+                        # no damage done, nothing to store
+                        continue
+                    cursor = self._db.execute(
+                            'INSERT INTO encounters (%s) '
+                            'VALUES (?, 0, 0, 0, 0, 0, 0, NULL, 0)' %
+                            ', '.join(COLUMNS[1:]),
+                            (offset + samples[0].time,))
+                    recording = self._recording[number] = [cursor.lastrowid,
+                                                           0]
+                encounter, chunk = recording
+
+                if samples:
+                    self._db.execute('INSERT INTO samples VALUES (?, ?, ?)',
+                                     (encounter, chunk, buffer(
+                                      BinaryLogFormat().records(samples))))
+                    recording[1] += 1
+
+                if summary is not None:
+                    del self._recording[number]
+                    if ended is None:
+                        self._db.execute('DELETE FROM samples '
+                                         'WHERE encounter = ?', (encounter,))
+                        self._db.execute('DELETE FROM encounters '
+                                         'WHERE id = ?', (encounter,))
+                    else:
+                        self._db.execute(
+                                'UPDATE encounters SET %s WHERE id = ?' %
+                                ', '.join(['%s = ?' % column
+                                           for column in COLUMNS[1:]]),
+                                summary.row(ended, offset + summary.first) +
+                                (encounter,))
+
+    def _select(self, where='', args=(), order='started', limit=None):
+        # the encounters still being recorded have no ended
+        query = 'SELECT %s FROM encounters WHERE ended IS NOT NULL %s ' \
+                'ORDER BY %s' % (', '.join(COLUMNS), where, order)
+        if limit:
+            query += ' LIMIT %d' % limit
+        return [dict(zip(COLUMNS, row))
+                for row in self._db.execute(query, args)]
+
+    def encounters(self, since=None, until=None):
+        """
+        Returns the summaries (dicts) of the encounters started between the
+        wall times since and until
+        """
+        return self._select('AND started >= ? AND started < ?',
+                            (since or 0, until or float('inf')))
+
+    def best_kills(self, max_health, count=10):
+        """
+        Returns the summaries of the count fastest kills of the boss with
+        max_health
+        """
+        return self._select('AND max_health = ? AND killed = 1',
+                            (max_health,), 'duration', count)
+
+    def samples(self, encounter):
+        """
+        Returns the LogRecords of the encounter with id encounter
+        """
+        data = ''.join([str(row[0]) for row in self._db.execute(
+                        'SELECT records FROM samples WHERE encounter = ? '
+                        'ORDER BY chunk', (encounter,))])
+        return [LogRecord(stamp, dmg, health, max_health,
+                          bool(flags & FLAG_INCOMBAT))
+                for stamp, health, max_health, dmg, flags in
+                [RECORD.unpack_from(data, pos)
+                 for pos in xrange(0, len(data), RECORD.size)]]
+
+    def close(self):
+        self._db.close()
+
+
+class EncounterRecorder(threading.Thread):
+    """
+    Thread splitting the samples into encounters and storing them in the
+    database fname. Like the CombatLogWriter, the database is written in
+    batches: when batch_size batches of samples are waiting, or flush_secs
+    after the last write.
+
+    clock - clock of the sample times, used to convert them to wall time
+    """
+    def __init__(self, fname=DATABASE, clock=time.time,
+                 batch_size=8, flush_secs=30.0, poll_secs=0.25):
+        threading.Thread.__init__(self, name='gw2dps encounters')
+        self.daemon = True
+
+        self.fname = fname
+        self._clock = clock
+        self._batch_size = batch_size
+        self._flush_secs = flush_secs
+        self._poll_secs = poll_secs
+
+        self._samples = deque()
+        self._pending = []
+        self._segmenter = Segmenter(self._batch)
+        self._running = True
+        self.written = 0
+
+    def log(self, sample):
+        """
+        Queue a sample, can be called from any thread
+        """
+        self._samples.append(sample)
+
+    def _batch(self, *batch):
+        self._pending.append(batch)
+
+    def _segment(self):
+        popleft = self._samples.popleft
+        while True:
+            try:
+                self._segmenter.add(popleft())
+            except IndexError:
+                return
+
+    def _write(self, store):
+        self.written += add_batches(store, self._pending,
+                                    time.time() - self._clock())
+
+    def run(self):
+        store = EncounterStore(self.fname)
+        try:
+            last_flush = time.time()
+            while self._running:
+                time.sleep(self._poll_secs)
+                self._segment()
+                if len(self._pending) >= self._batch_size or \
+                   time.time() - last_flush >= self._flush_secs:
+                    self._write(store)
+                    last_flush = time.time()
+
+            self._segment()
+            self._segmenter.flush()
+            self._write(store)
+        finally:
+            store.close()
+
+    def close(self):
+        """
+        End the current encounter and write the remaining ones
+        """
+        self._running = False
+        if self.is_alive():
+            self.join()
+
+
+def add_batches(store, batches, offset):
+    """
+    Stores the batches of a Segmenter and empties the list. Returns the
+    number of encounters that ended
+    """
+    if not batches:
+        return 0
+    store.add(batches, offset)
+    ended = len([batch for batch in batches if batch[3]])
+    del batches[:]
+    return ended
+
+
+def with_instant(records):
+    """
+    Yields the records as Samples, with the instant and sustained dps
+    calculated like the meter does, as they aren't logged
+    """
+    engine = DPSEngine(ms=50, windows=(1, 5))
+    for record in records:
+        engine.add_sample(record.dmg, record.time)
+        yield Sample(record.time, record.dmg, record.health,
+                     record.max_health, record.incombat, engine.dps(1),
+                     engine.dps(5), None)
+
+
+def import_log(fname, store, batch_size=64):
+    """
+    Splits a log into encounters and stores them. Returns the number of
+    encounters stored
+    """
+    with open(fname, 'rb') as fobj:
+        binary = fobj.read(len(MAGIC)) == MAGIC
+    offset = os.path.getmtime(fname)
+    if binary:
+        log = SessionLog(fname)
+        offset = log.started - log.clock
+        log.close()
+
+    batches, stored = [], 0
+    segmenter = Segmenter(lambda *batch: batches.append(batch))
+    for sample in with_instant(read_log(fname)):
+        segmenter.add(sample)
+        if len(batches) >= batch_size:
+            stored += add_batches(store, batches, offset)
+    segmenter.flush()
+    return stored + add_batches(store, batches, offset)
+
+
+def print_encounters(rows):
+    print '%6s %-19s %9s %12s %8s %8s %s' % ('id', 'started', 'duration',
+                                             'max health', 'dps', 'max',
+                                             'ended')
+    for row in rows:
+        print '%6s %-19s %9.1f %12d %8s %8s %s' % (
+              row['id'], time.strftime('%Y-%m-%d %H:%M:%S',
+                                       time.localtime(row['started'])),
+              row['duration'], row['max_health'], row['dps'],
+              row['max_instant'], row['ended'])
+
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    if args and args[0] == 'list' and len(args) <= 2:
+        store = EncounterStore(*args[1:], recover=False)
+        print_encounters(store.encounters())
+    elif args and args[0] == 'best' and 2 <= len(args) <= 4:
+        store = EncounterStore(*args[3:], recover=False)
+        print_encounters(store.best_kills(float(args[1]),
+                                          int(args[2]) if len(args) > 2
+                                          else 10))
+    elif args and args[0] == 'import' and 2 <= len(args) <= 3:
+        store = EncounterStore(*args[2:])
+        print '%s encounters stored' % import_log(args[1], store)
+    else:
+        print __doc__
@@ -2,19 +2,22 @@
 A DPS Meter for Guild Wars 2. The meter reads the selected target's health
 and calculates the dps done.
 """
-from ConfigParser import ConfigParser
 from ui.elements import HealthBar, DPSDisplay, Timer
 from ui.elements import DisplayEnableCheckbox, Logger, parsegeometry
-from ctypes import windll
+from dps import DPSEngine, ENCOUNTER
+from sampler import Sampler, AdaptiveSchedule, clock, READ_FAILED
+from tickstats import TickStats
+from samplebus import SampleBus, SAMPLE
 import Tkinter as tk
+import threading
 import aproc
 import os
 import sys
-import pickle
-import win32api, win32gui, win32con
 
 _DIR = os.path.split(__file__)[0]
 _POSPKL = os.path.join(_DIR, 'pos.pkl')
+# addresses found with the SIGNATURES, by fingerprint of the game's build
+_OFFSETSPKL = os.path.join(_DIR, 'offsets.pkl')
 
 TARGET_HEALTH_BASE = 0x013F2AB4
 TARGET_HEALTH_OFFSET = [0x34, 0x150, 0x8]
@@ -37,30 +40,112 @@ CONFIG_DCT = { 'TARGET_HEALTH' : ['BASE', 'OFFSET',
                                   'WBOSS_BASE', 'WBOSS_OFFSET'],
                'INCOMBAT': ['ADDR1', 'ADDR2', 'VALUE']}
 
+# Signatures of the code using the addresses, to find them after a patch
+# changed them. Set in the [SIGNATURES] section of memory.txt as
+#   NAME = pattern, offset, abs|rip
+# without abs|rip the address is the one of the match plus offset
+# i.e. TARGET_HEALTH_BASE = 8B 0D ?? ?? ?? ?? 85 C9, 2, abs
+# The addresses found overwrite the ones above, see sigscan.py
+SIGNATURE_NAMES = ['TARGET_HEALTH_BASE', 'TARGET_HEALTH_OBJ_BASE',
+                   'TARGET_HEALTH_WBOSS_BASE',
+                   'INCOMBAT_ADDR1', 'INCOMBAT_ADDR2']
+SIGNATURES = {}
+
+# windows, in seconds, the dps is averaged over.
+DPS_WINDOWS = (1, 5, 10, 30, 60, ENCOUNTER)
+
+# log the samples in the binary session format (sessionlog.py) instead of
+# text
+LOG_BINARY = False
+
+# maximum number of times a second the displays are drawn
+MAX_FPS = 20
+
+# sample period in ms in combat with a target, in combat or with a target,
+# and afk
+POLL_MS = (50, 250, 1000)
+
 BACKGROUND ='#222222'
 
+# database the encounters are stored in (see encounters.py), None to not
+# store them
+ENCOUNTER_DB = os.path.join(_DIR, 'encounters.db')
+
+# number of targets tracked at once, and the windows of their dps
+TARGET_SLOTS = 16
+TARGET_WINDOWS = (1, 5)
+
+# party server the samples are streamed to (see party.py), i.e.
+# ('127.0.0.1', 7381), None to not stream them. The meter is named
+# PARTY_NAME on the server, by default host-pid
+PARTY_SERVER = None
+PARTY_PROTOCOL = 'udp'
+PARTY_NAME = None
+
+# port of 127.0.0.1 the metrics of the meter are served on, as OpenMetrics
+# text (see metrics.py), i.e. 9381. None to not serve them
+METRICS_PORT = None
+
+
+def synchronized(func):
+    """
+    Decorator that calls the method while holding self.lock, must decorate
+    a class method
+    """
+    def synchronized_dec(self, *args, **kwargs):
+        with self.lock:
+            return func(self, *args, **kwargs)
+    return synchronized_dec
+
+
+def find_game(message_box=True):
+    """
+    Returns the pid of Guild Wars 2. If it is not running, the error is shown
+    in a message box (or on stderr) and the app exits
+    """
+    hwnd = aproc.FindWindow('ArenaNet_Dx_Window_Class', 'Guild Wars 2')
+
+    if hwnd:
+        return aproc.GetWindowThreadProcessId(hwnd)
+
+    err = "Please start Guild Wars 2, and wait for " + \
+          "the Character Select Screen to load before " + \
+          "starting the DPS Meter"
+
+    if message_box:
+        from ctypes import windll
+        windll.user32.MessageBoxA(None, err, 'DPS Meter Error', 0)
+    else:
+        sys.stderr.write(err + '\n')
+    sys.exit(-1)
+
 
 class DamageMeter:
     """
     DamageMeter class used for getting the dmg done onto target, and calculate
     the dps based on the sample period in milliseconds (ms)
-    The get_dmg needs to be called periodically at the specified sample period
-    for the calculations to be accurate
-    """
-    def __init__(self, ms=500):
-        hwnd = aproc.FindWindow('ArenaNet_Dx_Window_Class', 'Guild Wars 2')
+    The target_health_values needs to be called periodically at roughly the
+    specified sample period, the samples are timestamped so the dps stays
+    accurate when the period jitters
 
-        if hwnd:
-            pid = aproc.GetWindowThreadProcessId(hwnd)
-        else:
-            err = "Please start Guild Wars 2, and wait for " + \
-                  "the Character Select Screen to load before " + \
-                  "starting the DPS Meter"
+    The meter is sampled from the Sampler thread, methods that are also
+    called from the UI thread are synchronized with the lock
+    """
+    def __init__(self, ms=500, windows=DPS_WINDOWS, message_box=True,
+                 backend=None, clock=clock):
+        """
+        backend - aproc.MemoryBackend to read the memory with. By default
+                  the Win32Backend of the running Guild Wars 2 process
 
-            windll.user32.MessageBoxA(None, err, 'DPS Meter Error', 0)
-            sys.exit(-1)
+        clock - function returning the time used to stamp the samples
+        """
+        if backend is None:
+            backend = aproc.Win32Backend(find_game(message_box))
 
-        self._proc = aproc.Proc(pid)
+        self._proc = aproc.Proc(backend=backend)
+        if SIGNATURES:
+            locate_addresses(self._proc)
+        self._clock = clock
         self.gw2base = self._proc.base_addr
 
         self._possible_targets = [ (self.gw2base + TARGET_HEALTH_BASE,
@@ -70,59 +155,106 @@ class DamageMeter:
                                    (self.gw2base + TARGET_HEALTH_OBJ_BASE,
                                     TARGET_HEALTH_OBJ_OFFSET)]
         self._ms = ms
+        self.lock = threading.RLock()
 
-        self._sample_size_1s = int(1000/self._ms)
+        self._dps = DPSEngine(ms, windows)
         self._health_base = self.gw2base + TARGET_HEALTH_BASE
         self._prev_health = 0
         self._ptargetaddr = None
 
+        # index in _possible_targets of the last target found, it's tried
+        # first on the next call of selected_target
+        self._target_chain = None
+        self._chain_target = None
+        self.prediction_hits = 0
+        self.prediction_misses = 0
+
+        # current and max health are next to each other, read them at once
+        self._health_pair = self._proc.batch([(0x0, 'float'),
+                                              (0x4, 'float')])
+        self._incombat_flags = self._proc.batch([(INCOMBAT_ADDR1, 'int'),
+                                                 (INCOMBAT_ADDR2, 'int')])
+
+        # every target locked recently, and the watched ones. Only read
+        # once something uses it, see track_targets
+        self.targets = None
+
+    @synchronized
     def get_health_value_pairs(self, target_addr):
         """
         Read the current health and max health at the specified addrs
         """
         if target_addr:
-            chealth = self._proc.read_memory(target_addr, rtntype='float')
-            mhealth = self._proc.read_memory(target_addr + 0x4, rtntype='float')
-            return chealth, mhealth
+            return self._health_pair.read(target_addr)
 
     def incombat(self):
         """
         Returns True if we are in combat, False otherwise
         """
         # value one is 0 when in combat, 1 when not in combat
-        value1 = self._proc.read_memory(INCOMBAT_ADDR1)
-        # this is a 4byte value equal to IN_COMBAT_VALUE when in combat
-        value2 = self._proc.read_memory(INCOMBAT_ADDR2)
+        # value two is a 4byte value equal to IN_COMBAT_VALUE when in combat
+        value1, value2 = self._incombat_flags.read()
         return value1 == 0 or value2 == INCOMBAT_VALUE
 
+    @synchronized
     def selected_target(self):
         """
         Returns a tuple of (health address, current health, max health) of the
         selected targed. If no tharget is selected returns a tuple of
         (None, None, -1)
+
+        The target type (chain) the previous target was found on is tried
+        first, all the target types are only probed if that fails or the
+        target changed.
         """
+        if self._target_chain is not None:
+            addr, offset = self._possible_targets[self._target_chain]
+            taddr, chealth, mhealth, valid = self._probe_target(addr, offset)
+            if valid and taddr == self._chain_target:
+                self.prediction_hits += 1
+                return taddr, chealth, mhealth
+            self.prediction_misses += 1
+
         mhealth = -1
+        self._target_chain = None
 
         # go throught all the possible target types, and return the valid addrs
-        for addr, offset in self._possible_targets:
-            ptrail = self._proc.pointer_trail(addr,
-                                              offset,
-                                              rtntype='float')
-            if ptrail.addr and int(ptrail.value):
-                mhealth = self._proc.read_memory(ptrail.addr + 0x4, 'float')
-                if mhealth > 0 and mhealth >= int(ptrail.value):
-                    break
+        for index, (addr, offset) in enumerate(self._possible_targets):
+            taddr, chealth, mhealth, valid = self._probe_target(addr, offset,
+                                                                mhealth)
+            if valid:
+                self._target_chain = index
+                self._chain_target = taddr
+                break
 
-        return ptrail.addr, ptrail.value, mhealth
+        return taddr, chealth, mhealth
+
+    def _probe_target(self, addr, offset, mhealth=-1):
+        """
+        Follows a target pointer trail. Returns a tuple of
+        (health address, current health, max health, valid)
+        """
+        taddr = self._proc.pointer_trail(addr, offset, rtntype=None).addr
+        chealth = None
+        if taddr:
+            chealth, health_max = self.get_health_value_pairs(taddr)
+            if int(chealth):
+                mhealth = health_max
+                valid = mhealth > 0 and mhealth >= int(chealth)
+                return taddr, chealth, mhealth, valid
+
+        return taddr, chealth, mhealth, False
 
     def get_health(self):
         """
         Returns the health of the target. Health can also be -1 to indicate
-        no target is selected.
+        no target is selected, or READ_FAILED if it couldn't be read.
         """
         taddr, thealth, mhealth = self.selected_target()
 
         health = thealth if thealth else 0
+        if thealth is False:
+            health = READ_FAILED
 
         self._target_change = False
         if taddr is None:
@@ -130,26 +262,54 @@ class DamageMeter:
             # No target return -1
             health = -1
             if self._ptargetaddr:
-                if not self._proc.read_memory(self._ptargetaddr, rtntype='int'):
+                value = self._proc.read_memory(self._ptargetaddr,
+                                               rtntype='int')
+                if value is False:
+                    health = READ_FAILED
+                elif not value:
                     health = 0
         else:
-            if taddr != self._ptargetaddr:
+            if taddr != self._ptargetaddr and health != READ_FAILED:
                 # Target Change
                 self._target_change = True
 
-        self._ptargetaddr = taddr
+        if health != READ_FAILED:
+            # the target is kept until its health can be read again
+            self._ptargetaddr = taddr
         return health, mhealth
 
+    @property
+    def proc(self):
+        """
+        The aproc.Proc the memory is read with
+        """
+        return self._proc
+
+    @property
+    def target(self):
+        """
+        Address of the health of the target selected on the last sample,
+        None if no target is selected
+        """
+        return self._ptargetaddr
+
     def target_health_values(self, normalize=False):
         """
         Get the damage done on the target. Damage is
         calculated based on health[n] - health[n-1].
 
-        This method needs to be called periodically at the specified sample
-        period (ms) for everything to work properly
+        Returns a tuple of (dmg, health, max health, time). The time the
+        sample was taken is in seconds from a monotonic clock, the dps is
+        calculated using the actual time between the samples.
         """
         health, max_health = self.get_health()
+        stamp = self._clock()
+        if self.targets is not None:
+            self._update_targets(stamp)
         dmg = 0
+        if health == READ_FAILED:
+            # the damage is counted by the next sample read
+            return 0, health, max_health, stamp
         if health != -1 and not self._target_change:
             # There is a target selected and this is the same target on the
             # previous iteration. Calculate the dmg
@@ -159,61 +319,142 @@ class DamageMeter:
             dmg = (dmg / max_health)*10000
 
         self._prev_health = health
-        return dmg if dmg > 0 else 0, health, max_health
+        return dmg if dmg > 0 else 0, health, max_health, stamp
 
-    def calculate_dps(self, sample_lst, dmg, sample_window_size=1):
+    @synchronized
+    def _update_targets(self, stamp):
         """
-        Calculate the dps.
-        By deafult it returns the dps averaged over 1s (sample_window_size=1)
-        this is defined as the Instant dps.
+        Track the selected target and read the health of all the tracked
+        targets
+        """
+        if self._ptargetaddr:
+            self.targets.lock(self._ptargetaddr, stamp)
+        self.targets.update(stamp)
+
+    @synchronized
+    def track_targets(self, windows=TARGET_WINDOWS):
+        """
+        Start tracking the targets locked and watched (see targets.py).
+        Their health is read on every sample from then on, so it's only
+        done once the report or the watch list is used.
+
+        windows - windows in seconds of the dps of the targets
 
-        sample_lst -
-            a list used to store the dmg samples. Number of samples it
-            would store is based on sample_window_size and the sample period.
-            For sample period of 250ms, and sample_window_size, sample_lst will
-            have at most 4 values (4 * 250ms= 1 seconds). When list is filled,
-            the first sample will be removed and a new one will be appended.
+        Returns the TargetTable
+        """
+        if self.targets is None:
+            from targets import TargetTable
+            self.targets = TargetTable(self._proc, self._ms, windows,
+                                       TARGET_SLOTS)
+        return self.targets
+
+    @synchronized
+    def watch(self, target_addr):
+        """
+        Track the target at target_addr (the address of its health) even
+        when it isn't selected, until unwatch is called
+        """
+        return self.track_targets().watch(target_addr)
+
+    @synchronized
+    def unwatch(self, target_addr):
+        if self.targets is not None:
+            self.targets.unwatch(target_addr, self._clock())
+
+    @synchronized
+    def watched(self):
+        """
+        Returns a tuple of (addr, health, max health) of the watched targets
+        read on the last sample, see TargetTable.watched
+        """
+        if self.targets is None:
+            return ()
+        return self.targets.watched()
+
+    @synchronized
+    def target_report(self, window=5):
+        """
+        Returns the dps done to all the targets over window seconds, and a
+        list of (addr, health, max health, dps) of the tracked targets. The
+        targets are tracked from the first call on
+        """
+        targets = self.track_targets()
+        return targets.dps(window), targets.report(window)
+
+    def calculate_dps(self, dmg, stamp, windows=None):
+        """
+        Calculate the dps.
+        Returns a list with the dps for each of the windows (in seconds).
+        By deafult it returns the dps of all the windows the DamageMeter was
+        created with. The dps averaged over 1s is defined as the Instant dps,
+        and over 5s as the Sustained dps.
 
         dmg -
             Damage taked by target.
 
-        sample_window_size -
-            Number of seconds to average the dps.
+        stamp -
+            Time the dmg was sampled, as returned by target_health_values
+
+        windows -
+            Number of seconds to average the dps for each value returned.
+            ENCOUNTER averages since the last start_encounter call.
 
         This method needs to be called everytime a dmg is calculated
         """
-        sample_lst.append(dmg)
-        dps = 0
-        if len(sample_lst) >= sample_window_size * self._sample_size_1s:
-            dps = sum(sample_lst)/sample_window_size
-            del sample_lst[0]
-        return int(dps)
+        self._dps.add_sample(dmg, stamp)
+        return [self._dps.dps(window)
+                for window in (windows or self._dps.windows)]
+
+    def dps(self, window=1):
+        """
+        Returns the dps averaged over the window (in seconds) without adding
+        a sample
+        """
+        return self._dps.dps(window)
+
+    def start_encounter(self):
+        """
+        Start averaging the ENCOUNTER dps window
+        """
+        self._dps.start_encounter()
 
 
 class Main(tk.Tk):
     def __init__(self, config_file, *args, **kwargs):
         tk.Tk.__init__(self, *args, **kwargs)
-        self._ms = 250
-        self._sustained_dps = []
-        self._instant_dps = []
-        self._second = int(1000/self._ms)
-        self._tick = 0
+        # the sampling period changes with the combat and target state, the
+        # meter's buffers are sized for the fastest
+        self._ms = POLL_MS[0]
+        # the displays are drawn at most MAX_FPS times a second, whatever
+        # the sampling rate. The samples taken in between are only used for
+        # the calculations (max, averages)
+        self._frame_ms = int(1000/MAX_FPS)
 
         self._dmg = DamageMeter(ms=self._ms)
+        self._sampler = Sampler(self._dmg, ms=self._ms,
+                                schedule=AdaptiveSchedule(*POLL_MS))
+        self._ui_stats = TickStats(self._frame_ms/1000.0, phases=('render',))
+        self._scheduled = None
+        # the samples are read once, by the sampler, and published to the
+        # displays, the log and the encounters
+        self.bus = SampleBus()
 
         self.dps_display = DisplayEnableCheckbox(self, "Display DPS",
                                                  DPSDisplay, bg=BACKGROUND,
-                                                 config=config_file)
+                                                 config=config_file,
+                                                 stats=self._tick_stats,
+                                                 bus=self.bus)
         self.dps_display.grid(row=0, column=0)
 
         self.health_bar = DisplayEnableCheckbox(self, "Display Taget Health",
                                                 HealthBar, bg=BACKGROUND,
-                                                config=config_file)
+                                                config=config_file,
+                                                bus=self.bus)
         self.health_bar.grid(row=1, column=0)
 
         self.timer = DisplayEnableCheckbox(self, "Timer", Timer,
-                                           self._dmg, bg=BACKGROUND,
-                                           config=config_file)
+                                           bg=BACKGROUND, config=config_file,
+                                           bus=self.bus, meter=self._dmg)
         self.timer.grid(row=2, column=0)
 
         self.toplevel_wins = {   'Main'        : self,
@@ -222,20 +463,38 @@ class Main(tk.Tk):
                                  'Timer'       : self.timer}
 
         self.logger = Logger(self, "Log to file",
-                             os.path.join(_DIR, 'dps.txt'))
+                             os.path.join(_DIR, 'logs'), binary=LOG_BINARY,
+                             bus=self.bus)
         self.logger.grid(row=3, column=0)
 
+        self._encounters = None
+        if ENCOUNTER_DB:
+            from encounters import EncounterRecorder
+            self._encounters = EncounterRecorder(ENCOUNTER_DB, clock=clock)
+            self._encounters.start()
+            self.bus.subscribe(SAMPLE, lambda event:
+                               self._encounters.log(event.sample))
+
+        self._party = None
+        if PARTY_SERVER:
+            from party import PartyClient
+            self._party = PartyClient(PARTY_SERVER, PARTY_NAME,
+                                      PARTY_PROTOCOL, clock=clock)
+            self._party.start()
+            self.bus.subscribe(SAMPLE, lambda event:
+                               self._party.log(event.sample))
+
+        self._metrics = None
+        if METRICS_PORT:
+            from metrics import Metrics, MetricsServer
+            self._metrics = MetricsServer(Metrics(self._sampler, self._dmg,
+                                                  self._tick_stats),
+                                          port=METRICS_PORT)
+            self._metrics.start()
+
         self.load_data()
         self.protocol('WM_DELETE_WINDOW', self._onclose)
-
-    def log_tofile(self, inst):
-        """
-        Everysecond log the inst damage to the file
-        """
-        self._tick += 1
-        if self._tick >= self._second:
-            self.logger.log(inst)
-            self._tick = 0
+        self._sampler.start()
 
     def click_control(self, control):
         """
@@ -244,6 +503,7 @@ class Main(tk.Tk):
         control = True to enable click
         control = False to disable click
         """
+        import win32gui, win32con
         cal_nval = lambda val: val & (~ win32con.WS_EX_TRANSPARENT) if control\
                               else val | win32con.WS_EX_TRANSPARENT
 
@@ -263,24 +523,48 @@ class Main(tk.Tk):
         Poll to see if the ALT key is pressed, if it is, allow control, else
         control is disabled
         """
+        import win32api, win32con
         state = win32api.GetAsyncKeyState(win32con.VK_MENU)
         self.click_control(state != 0)
         self.after(100, self.check_control_loop)
 
     def run(self):
-        dps, chealth, mhealth = self._dmg.target_health_values()
-        inst = self._dmg.calculate_dps(self._instant_dps, dps)
-        sustained = self._dmg.calculate_dps(self._sustained_dps, dps,
-                                            sample_window_size=5)
+        """
+        Display the samples taken by the sampler thread since the last run
+        """
+        started = clock()
+        self._ui_stats.tick(self._scheduled or started, started)
+
+        self.display(self._sampler.queue.drain())
 
-        incombat = self._dmg.incombat()
-        self.dps_display.update_data(inst, sustained, incombat)
-        self.health_bar.update_data(chealth, mhealth)
+        render = clock() - started
+        self._ui_stats.record('render', render)
+        self._sampler.stats.record('render', render)
+
+        self._scheduled = clock() + self._frame_ms/1000.0
+        self.after(self._frame_ms, self.run)
+
+    def _tick_stats(self):
+        """
+        Returns a dict of name: TickStats of the sampling and display loops
+        """
+        return {'sampler': self._sampler.stats,
+                'ui': self._ui_stats}
 
-        if incombat:
-            self.log_tofile(inst)
+    def tick_stats(self):
+        """
+        Returns the latency histograms and missed deadline counts of the
+        sampling and display loops as a dict
+        """
+        return dict((name, stats.snapshot())
+                    for name, stats in self._tick_stats().items())
 
-        self.after(self._ms, self.run)
+    def display(self, samples):
+        """
+        Publish the samples to the displays, the log and the encounters,
+        only the last sample is drawn
+        """
+        self.bus.publish(samples)
 
     def get_position(self):
         """
@@ -298,11 +582,20 @@ class Main(tk.Tk):
         """
         Pickle the positions when closing the app
         """
+        import cPickle as pickle
         dat = {name: obj.get_position()
                for name, obj in self.toplevel_wins.iteritems()}
 
         with open(_POSPKL, 'wb') as fpkl:
             pickle.dump(dat, fpkl)
+        self._sampler.stop()
+        self.logger.close()
+        if self._encounters:
+            self._encounters.close()
+        if self._party:
+            self._party.close()
+        if self._metrics:
+            self._metrics.close()
         self.quit()
 
     def load_data(self):
@@ -310,6 +603,7 @@ class Main(tk.Tk):
         Load the pickle if it exists
         """
         if os.path.isfile(_POSPKL):
+            import cPickle as pickle
             with open(_POSPKL, 'rb') as fpkl:
                 dat = pickle.load(fpkl)
                 for name, obj in self.toplevel_wins.iteritems():
@@ -317,6 +611,116 @@ class Main(tk.Tk):
                         obj.set_position(*dat[name])
 
 
+def load_memory_config(fname):
+    """
+    Ability to change the memory addresses, and offesets without chaning
+    in the file. This is useful then packaged as an exe. If there is a
+    memory.txt file in the working directory of the script, it will be loaded
+    and the global variables overwritten
+    """
+    if os.path.exists(fname):
+        from ConfigParser import ConfigParser
+        config = ConfigParser()
+        config.read(fname)
+
+        for prefix, suffixes in CONFIG_DCT.iteritems():
+            for suffix in suffixes:
+                if config.has_option(prefix, suffix):
+                    val = config.get(prefix, suffix)
+                    if 'OFFSET' in suffix:
+                        val = [int(i, 0) for i in filter(None, val.split(','))]
+                    else:
+                        val = int(val, 0)
+                    globals()[prefix + '_' + suffix] = val
+
+        if config.has_section('SIGNATURES'):
+            from sigscan import Signature
+            for name, val in config.items('SIGNATURES'):
+                name = name.upper()
+                if name not in SIGNATURE_NAMES:
+                    continue
+                fields = [i.strip() for i in val.split(',')]
+                pattern, offset, resolve = (fields + ['0', None])[:3]
+                SIGNATURES[name] = Signature(pattern, int(offset, 0),
+                                             resolve or None)
+
+
+def find_addresses(proc):
+    """
+    Scan the game's image for the SIGNATURES and overwrite the addresses of
+    the ones found. The bases are relative to the image base, the in combat
+    addresses are absolute.
+
+    Returns the list of names that were not found
+    """
+    from sigscan import scan
+    found = scan(proc, SIGNATURES)
+    for name, address in found.iteritems():
+        if name.endswith('_BASE'):
+            address -= proc.base_addr
+        globals()[name] = address
+    return sorted(set(SIGNATURES) - set(found))
+
+
+def check_addresses(proc, addresses):
+    """
+    Quick sanity check of the addresses (a dict of SIGNATURE_NAMES: value):
+    the bases must be in the game's image and hold a pointer, or null, and
+    the in combat flags must be readable
+    """
+    size = proc.get_image_size()
+    for name, value in addresses.iteritems():
+        if name.endswith('_BASE'):
+            if not 0 <= value < size:
+                return False
+            pointer = proc.read_memory(proc.base_addr + value, 'int')
+            if pointer is False or pointer < 0:
+                return False
+        elif proc.read_memory(value, 'int') is False:
+            return False
+    return True
+
+
+def locate_addresses(proc, fname=_OFFSETSPKL):
+    """
+    Use the addresses cached for this build of the game (and these
+    SIGNATURES) if they pass check_addresses, otherwise scan for the
+    SIGNATURES and cache the addresses found.
+
+    Only the addresses found are cached, if a signature wasn't found the
+    next launch scans again.
+
+    Returns True if the cached addresses were used
+    """
+    import cPickle as pickle
+    from sigscan import fingerprint
+    key = (fingerprint(proc),
+           tuple(sorted((name, repr(signature))
+                        for name, signature in SIGNATURES.items())))
+    cache = {}
+    if os.path.isfile(fname):
+        try:
+            with open(fname, 'rb') as fpkl:
+                cache = pickle.load(fpkl)
+        except Exception:
+            cache = {}
+
+    cached = cache.get(key)
+    if cached and set(SIGNATURES) <= set(cached) and \
+       check_addresses(proc, cached):
+        globals().update(cached)
+        return True
+
+    missing = find_addresses(proc)
+    addresses = dict((name, globals()[name]) for name in SIGNATURES
+                     if name not in missing)
+    if addresses and check_addresses(proc, addresses):
+        cache[key] = addresses
+        with open(fname, 'wb') as fpkl:
+            pickle.dump(cache, fpkl)
+    return False
+
+
 CONFIGDATA =\
 """# gw2dps UI configuration file
 # DON'T change the names in the square brackets []
@@ -386,23 +790,7 @@ alpha=0.6
 """
 
 if __name__ == '__main__':
-    # ability to change the memory addresses, and offesets without chaning
-    # in the file. This is useful then packaged as an exe. If there is a
-    # memory.txt file in the working directory of the script, it will be loaded
-    # and the global variables overwritten
-    if os.path.exists('./memory.txt'):
-        config = ConfigParser()
-        config.read('./memory.txt')
-
-        for prefix, suffixes in CONFIG_DCT.iteritems():
-            for suffix in suffixes:
-                if config.has_option(prefix, suffix):
-                    val = config.get(prefix, suffix)
-                    if 'OFFSET' in suffix:
-                        val = [int(i, 0) for i in filter(None, val.split(','))]
-                    else:
-                        val = int(val, 0)
-                    globals()[prefix + '_' + suffix] = val
+    load_memory_config('./memory.txt')
 
     # check if the config file exists, if not, create it from the default
     # value
@@ -417,4 +805,4 @@ if __name__ == '__main__':
     app.wm_title("DPS Display by balkanpy")
     app.run()
     app.check_control_loop()
-    app.mainloop()
\ No newline at end of file
+    app.mainloop()
@@ -0,0 +1,236 @@
+"""
+Runs the DPS meter without any Tk window, and writes every sample to stdout
+or to a file. Useful for stream overlays and logging pipelines.
+
+Usage:
+    python headless.py [options]
+
+Options:
+    --ms MS             sample period in milliseconds (default 250)
+    --format FORMAT     json (newline delimited json, default) or binary
+                        (sessionlog records)
+    --output FILE       write to FILE instead of stdout
+    --count N           stop after N samples
+    --stats             print the latency statistics of the sampling loop
+                        as json on stderr when done
+    --party HOST:PORT   stream the samples to a party server (see party.py)
+    --tcp               stream them over tcp instead of udp
+    --metrics PORT      serve the metrics of the meter as OpenMetrics text on
+                        http://127.0.0.1:PORT/metrics (see metrics.py)
+    --targets WINDOW    track every target locked (see targets.py), and
+                        print the dps done to them over WINDOW seconds as
+                        json on stderr every second
+    --benchmark N       time the startup and N samples of the headless and
+                        the Tk paths, then exit
+"""
+import time
+# taken before the imports so the benchmark includes them
+_STARTED = time.time()
+
+from gw2dps import DamageMeter, load_memory_config
+from sampler import Sampler, clock
+import argparse
+import json
+import sys
+import os
+
+
+class JSONFormat(object):
+    """
+    One json object per sample and line
+    """
+    mode = 'w'
+
+    def header(self, sample=None):
+        return ''
+
+    def records(self, samples):
+        return ''.join([json.dumps(sample._asdict(),
+                                   separators=(',', ':')) + '\n'
+                        for sample in samples])
+
+    def footer(self):
+        return ''
+
+
+def binary_format():
+    # imported only when it's used, like party.py and metrics.py
+    from sessionlog import BinaryLogFormat
+    return BinaryLogFormat()
+
+
+# callables returning the formats
+FORMATS = {'json': JSONFormat,
+           'binary': binary_format}
+
+
+def open_output(fname, logformat):
+    """
+    Returns the file object to write to, stdout if fname is None
+    """
+    if fname:
+        return open(fname, logformat.mode)
+
+    if 'b' in logformat.mode and sys.platform == 'win32':
+        import msvcrt
+        msvcrt.setmode(sys.stdout.fileno(), os.O_BINARY)
+    return sys.stdout
+
+
+def target_report(meter, window):
+    """
+    Returns the json line of the meter's target report
+    """
+    total, rows = meter.target_report(window)
+    return json.dumps({'dps': total,
+                       'targets': [dict(zip(('addr', 'health', 'max_health',
+                                             'dps'), row))
+                                   for row in rows]},
+                      separators=(',', ':')) + '\n'
+
+
+def run(ms=250, logformat=None, output=None, count=None, stats=False,
+        party=None, metrics_port=None, targets=None):
+    """
+    Samples the meter every ms and writes the samples as they come. Returns
+    the number of samples written
+
+    stats - print the sampler's TickStats as json on stderr when done
+
+    party - PartyClient the samples are streamed to as well
+
+    metrics_port - serve the metrics on this port of 127.0.0.1
+
+    targets - window in seconds of the dps of the targets report printed on
+              stderr every second, None to not track the targets
+    """
+    logformat = logformat or JSONFormat()
+    meter = DamageMeter(ms=ms, message_box=False)
+    sampler = Sampler(meter, ms=ms)
+    fobj = open_output(output, logformat)
+
+    server = None
+    if metrics_port:
+        from metrics import Metrics, MetricsServer
+        server = MetricsServer(Metrics(sampler, meter), port=metrics_port)
+        server.start()
+
+    if targets:
+        meter.track_targets((targets,))
+    reported = clock()
+
+    written = 0
+    sampler.start()
+    if party:
+        party.start()
+    try:
+        fobj.write(logformat.header())
+        while count is None or written < count:
+            time.sleep(ms/1000.0)
+            samples = sampler.queue.drain()
+            if count is not None:
+                samples = samples[:count - written]
+            if samples:
+                fobj.write(logformat.records(samples))
+                fobj.flush()
+                written += len(samples)
+                if party:
+                    for sample in samples:
+                        party.log(sample)
+            if targets and clock() - reported >= 1:
+                reported = clock()
+                sys.stderr.write(target_report(meter, targets))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        sampler.stop()
+        if party:
+            party.close()
+        if server:
+            server.close()
+        fobj.write(logformat.footer())
+        if fobj is not sys.stdout:
+            fobj.close()
+        if stats:
+            json.dump(sampler.stats.snapshot(), sys.stderr, indent=1)
+
+    return written
+
+
+def benchmark(samples=1000, ms=250):
+    """
+    Times the startup and the cost of a sample of the headless path, and of
+    the Tk path (Main with the DPS and health windows open, but withdrawn).
+    The samples are taken back to back, not every ms.
+    """
+    from gw2dps import Main
+
+    results = []
+
+    started = time.time()
+    meter = DamageMeter(ms=ms, message_box=False)
+    sampler = Sampler(meter, ms=ms)
+    logformat = JSONFormat()
+    attached = time.time()
+
+    for _ in xrange(samples):
+        logformat.records([sampler.sample()])
+    results.append(('headless', attached - _STARTED, attached - started,
+                    (time.time() - attached)/samples))
+
+    started = time.time()
+    app = Main(os.path.join(os.path.split(__file__)[0], 'config.txt'))
+    app._sampler.stop()
+    app.withdraw()
+    for checkbox in [app.dps_display, app.health_bar]:
+        checkbox.ck.ckvalue.set(True)
+        checkbox.checkbox_callback()
+        checkbox.withdraw()
+    app.update()
+    created = time.time()
+
+    sampler = Sampler(app._dmg, ms=ms)
+    for _ in xrange(samples):
+        app.display([sampler.sample()])
+        app.update_idletasks()
+    results.append(('tk', None, created - started,
+                    (time.time() - created)/samples))
+    app.destroy()
+
+    print '%-10s %12s %12s %14s' % ('path', 'startup(s)', 'create(s)',
+                                    'per sample(ms)')
+    for name, startup, create, per_sample in results:
+        print '%-10s %12s %12.3f %14.3f' % (
+              name, '%.3f' % startup if startup is not None else '-',
+              create, per_sample*1000)
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Headless gw2dps meter')
+    parser.add_argument('--ms', type=int, default=250)
+    parser.add_argument('--format', choices=sorted(FORMATS), default='json')
+    parser.add_argument('--output')
+    parser.add_argument('--count', type=int)
+    parser.add_argument('--stats', action='store_true')
+    parser.add_argument('--benchmark', type=int, metavar='N')
+    parser.add_argument('--party', metavar='HOST:PORT')
+    parser.add_argument('--tcp', action='store_true')
+    parser.add_argument('--metrics', type=int, metavar='PORT')
+    parser.add_argument('--targets', type=float, metavar='WINDOW')
+    args = parser.parse_args()
+
+    load_memory_config('./memory.txt')
+
+    if args.benchmark:
+        benchmark(args.benchmark, args.ms)
+    else:
+        party = None
+        if args.party:
+            from party import PartyClient
+            host, port = args.party.rsplit(':', 1)
+            party = PartyClient((host, int(port)),
+                                protocol='tcp' if args.tcp else 'udp',
+                                clock=clock)
+        run(args.ms, FORMATS[args.format](), args.output, args.count,
+            args.stats, party, args.metrics, args.targets)
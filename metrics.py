@@ -0,0 +1,179 @@
+"""
+Serves the health of the running meter as OpenMetrics text over http, so
+long running meters can be scraped (i.e. by Prometheus) instead of watched:
+
+    curl http://127.0.0.1:9381/metrics
+
+The values are the counters the sampler thread keeps anyway, they are read
+without any lock from the http thread, so a scrape never makes the sampler
+wait. The sampler only holds the GIL for the few microseconds it takes to
+format them.
+"""
+from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+import threading
+
+HOST = '127.0.0.1'
+PORT = 9381
+
+CONTENT_TYPE = 'application/openmetrics-text; version=1.0.0; charset=utf-8'
+
+
+def _labels(labels):
+    if not labels:
+        return ''
+    return '{%s}' % ','.join(['%s="%s"' % (name, value)
+                              for name, value in labels])
+
+
+def _value(value):
+    if value is None:
+        return 'NaN'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Exposition(object):
+    """
+    Builds the OpenMetrics text, one metric family at a time
+    """
+    def __init__(self):
+        self._lines = []
+
+    def family(self, name, kind, help):
+        self._lines.append('# TYPE %s %s' % (name, kind))
+        self._lines.append('# HELP %s %s' % (name, help))
+
+    def sample(self, name, value, labels=()):
+        self._lines.append('%s%s %s' % (name, _labels(labels),
+                                        _value(value)))
+
+    def histogram(self, name, histogram, labels=()):
+        """
+        Adds the samples of a tickstats.LatencyHistogram
+        """
+        # copied at once, the sampler keeps recording while this runs
+        counts = list(histogram.counts)
+        total = histogram.total
+        cumulative = 0
+        for bound, count in zip(list(histogram.bounds) + ['+Inf'], counts):
+            cumulative += count
+            self.sample(name + '_bucket', cumulative,
+                        tuple(labels) + (('le', bound if bound == '+Inf'
+                                          else repr(float(bound))),))
+        # the count is the sum of the buckets, so it matches +Inf
+        self.sample(name + '_count', cumulative, labels)
+        self.sample(name + '_sum', total, labels)
+
+    def text(self):
+        return '\n'.join(self._lines + ['# EOF']) + '\n'
+
+
+class Metrics(object):
+    """
+    Collects the metrics of a meter sampled by sampler
+
+    stats - callable returning a dict of name: TickStats of the loops, by
+            default the sampler's
+    """
+    def __init__(self, sampler, meter, stats=None):
+        self._sampler = sampler
+        self._meter = meter
+        self._stats = stats or (lambda: {'sampler': sampler.stats})
+
+    def collect(self):
+        """
+        Returns the OpenMetrics text
+        """
+        out = Exposition()
+        sampler, meter, proc = self._sampler, self._meter, self._meter.proc
+
+        out.family('gw2dps_samples', 'counter', 'Samples taken.')
+        out.sample('gw2dps_samples_total', sampler.stats.ticks)
+        out.family('gw2dps_samples_dropped', 'counter',
+                   'Samples dropped because the display fell behind.')
+        out.sample('gw2dps_samples_dropped_total', sampler.queue.dropped)
+
+        out.family('gw2dps_read_failures', 'counter',
+                   'Values that could not be read from the game.')
+        out.sample('gw2dps_read_failures_total', proc.read_failures)
+        out.family('gw2dps_target_prediction_hits', 'counter',
+                   'Targets found on the target type of the previous one.')
+        out.sample('gw2dps_target_prediction_hits_total',
+                   meter.prediction_hits)
+        out.family('gw2dps_target_prediction_misses', 'counter',
+                   'Targets searched on every target type.')
+        out.sample('gw2dps_target_prediction_misses_total',
+                   meter.prediction_misses)
+
+        stats = sorted(self._stats().items())
+        out.family('gw2dps_ticks_missed', 'counter',
+                   'Ticks that started more than half a period late.')
+        for loop, tickstats in stats:
+            out.sample('gw2dps_ticks_missed_total', tickstats.missed,
+                       (('loop', loop),))
+        out.family('gw2dps_tick_phase_seconds', 'histogram',
+                   'Time taken by each phase of the ticks.')
+        for loop, tickstats in stats:
+            for phase, histogram in sorted(tickstats.phases.items()):
+                out.histogram('gw2dps_tick_phase_seconds', histogram,
+                              (('loop', loop), ('phase', phase)))
+        out.family('gw2dps_tick_interval_seconds', 'histogram',
+                   'Time between the starts of two ticks.')
+        for loop, tickstats in stats:
+            out.histogram('gw2dps_tick_interval_seconds', tickstats.intervals,
+                          (('loop', loop),))
+        out.family('gw2dps_tick_lateness_seconds', 'histogram',
+                   'How late the ticks started.')
+        for loop, tickstats in stats:
+            out.histogram('gw2dps_tick_lateness_seconds', tickstats.lateness,
+                          (('loop', loop),))
+
+        sample = sampler.last
+        if sample is not None:
+            out.family('gw2dps_dps', 'gauge', 'DPS of the last sample.')
+            out.sample('gw2dps_dps', sample.instant, (('window', 'instant'),))
+            out.sample('gw2dps_dps', sample.sustained,
+                       (('window', 'sustained'),))
+            out.family('gw2dps_incombat', 'gauge',
+                       '1 if the character is in combat.')
+            out.sample('gw2dps_incombat', int(bool(sample.incombat)))
+            out.family('gw2dps_target_health', 'gauge',
+                       'Health of the selected target, -1 without one, -2 if '
+                       'it could not be read.')
+            out.sample('gw2dps_target_health', sample.health)
+        return out.text()
+
+
+class _Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split('?')[0] != '/metrics':
+            self.send_error(404)
+            return
+        body = self.server.metrics.collect()
+        self.send_response(200)
+        self.send_header('Content-Type', CONTENT_TYPE)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class MetricsServer(threading.Thread):
+    """
+    Thread serving the Metrics on http://host:port/metrics
+    """
+    def __init__(self, metrics, host=HOST, port=PORT):
+        threading.Thread.__init__(self, name='gw2dps metrics')
+        self.daemon = True
+        self._httpd = HTTPServer((host, port), _Handler)
+        self._httpd.metrics = metrics
+        self.address = self._httpd.server_address
+
+    def run(self):
+        self._httpd.serve_forever(poll_interval=0.5)
+
+    def close(self):
+        if self.is_alive():
+            self._httpd.shutdown()
+        self._httpd.server_close()
@@ -0,0 +1,595 @@
+"""
+Combines the meters of a party. Every meter streams its samples to a
+PartyServer as compact binary frames, over UDP or TCP, and the server
+merges them into the dps of each meter and the dps done to each target by
+the whole party.
+
+The games don't share the addresses of the targets, so a target is
+identified by its max health (like the bosses in encounters.py), and the
+frames of the meters are merged on their wall time.
+
+The server's report is served as json on PORT + 1.
+
+Usage:
+    python party.py server [--host HOST] [--port PORT]
+    python party.py report [--host HOST] [--port PORT]
+    python party.py simulate [--meters N] [--seconds S] [--tcp]
+                             [--host HOST] [--port PORT]
+
+simulate streams N simulated meters (see simproc.py) attacking the same
+target, to try the server on localhost.
+"""
+from collections import namedtuple, deque
+import threading
+import socket
+import select
+import struct
+import errno
+import json
+import time
+import sys
+import os
+
+HOST = '127.0.0.1'
+PORT = 7381
+
+MAGIC = 'GP'
+VERSION = 1
+
+# magic, version, flags, meter name, sequence number, wall time, dmg,
+# health, max health, instant dps, sustained dps
+FRAME = struct.Struct('<2sBB16sIdfffii')
+
+FLAG_INCOMBAT = 0x1
+FLAG_TARGET = 0x2
+
+# frames per datagram, kept under the usual MTU
+DATAGRAM_FRAMES = 24
+
+# target is the max health of the target, None without a target
+Frame = namedtuple('Frame', ['meter', 'seq', 'time', 'dmg', 'health',
+                             'max_health', 'incombat', 'instant', 'sustained',
+                             'target'])
+
+
+def pack_frame(meter, seq, wall, sample):
+    """
+    Returns the frame of sample, taken at the wall time wall
+    """
+    flags = FLAG_INCOMBAT if sample.incombat else 0
+    if getattr(sample, 'target', None) and sample.max_health > 0:
+        flags |= FLAG_TARGET
+    return FRAME.pack(MAGIC, VERSION, flags, meter, seq & 0xFFFFFFFF, wall,
+                      sample.dmg, sample.health, sample.max_health,
+                      int(sample.instant), int(sample.sustained))
+
+
+def unpack_frames(data):
+    """
+    Returns the list of Frames in data, and the number of bytes used. Raises
+    ValueError if a frame isn't valid
+    """
+    frames = []
+    end = len(data) - len(data) % FRAME.size
+    unpack = FRAME.unpack_from
+    for offset in xrange(0, end, FRAME.size):
+        (magic, version, flags, meter, seq, wall, dmg, health, max_health,
+         instant, sustained) = unpack(data, offset)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError('invalid frame')
+        frames.append(Frame(meter.rstrip('\0'), seq, wall, dmg, health,
+                            max_health, bool(flags & FLAG_INCOMBAT),
+                            instant, sustained,
+                            max_health if flags & FLAG_TARGET else None))
+    return frames, end
+
+
+def default_name():
+    """
+    Returns the name of this meter: host-pid
+    """
+    return ('%s-%s' % (socket.gethostname()[:9], os.getpid()))[:16]
+
+
+class PartyClient(threading.Thread):
+    """
+    Thread streaming the samples to the party server at address, a
+    (host, port) tuple. Like the CombatLogWriter, the UI thread only appends
+    the samples to a deque, and they are sent every poll_secs.
+
+    The party dps is live, so the samples are never kept for later: when
+    the server can't be reached they are dropped, and a TCP connection is
+    retried every reconnect_secs.
+
+    protocol - 'udp' or 'tcp'
+
+    clock - clock of the sample times. They are converted to wall time with
+            the offset between the clocks when the client is created, so
+            the times stay as evenly spaced as the samples
+    """
+    def __init__(self, address, name=None, protocol='udp', clock=time.time,
+                 poll_secs=0.05, reconnect_secs=2.0, queue_size=256):
+        threading.Thread.__init__(self, name='gw2dps party')
+        self.daemon = True
+
+        if protocol not in ('udp', 'tcp'):
+            raise ValueError('protocol must be udp or tcp')
+        self.address = address
+        # not name, that's the thread's
+        self.meter_name = (name or default_name())[:16]
+        self.protocol = protocol
+        self._offset = time.time() - clock()
+        self._poll_secs = poll_secs
+        self._reconnect_secs = reconnect_secs
+
+        self._samples = deque(maxlen=queue_size)
+        self._running = True
+        self._sock = None
+        self._connect_after = 0
+        self._seq = 0
+        self.sent = 0
+        self.dropped = 0
+
+    def log(self, sample):
+        """
+        Queue a sample, can be called from any thread
+        """
+        self._samples.append(sample)
+
+    def _drain(self):
+        samples = []
+        popleft = self._samples.popleft
+        while True:
+            try:
+                samples.append(popleft())
+            except IndexError:
+                return samples
+
+    def _pack(self, samples):
+        frames = []
+        for sample in samples:
+            self._seq += 1
+            frames.append(pack_frame(self.meter_name, self._seq,
+                                     self._offset + sample.time, sample))
+        return frames
+
+    def _connect(self):
+        if self.protocol == 'udp':
+            self._sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            return True
+
+        if time.time() < self._connect_after:
+            return False
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        sock.settimeout(self._reconnect_secs)
+        try:
+            sock.connect(self.address)
+        except socket.error:
+            sock.close()
+            self._connect_after = time.time() + self._reconnect_secs
+            return False
+        self._sock = sock
+        return True
+
+    def send(self, samples):
+        """
+        Sends the samples now. Returns the number of samples sent
+        """
+        if not samples:
+            return 0
+        frames = self._pack(samples)
+        if self._sock is None and not self._connect():
+            self.dropped += len(frames)
+            return 0
+
+        try:
+            if self.protocol == 'udp':
+                for start in xrange(0, len(frames), DATAGRAM_FRAMES):
+                    self._sock.sendto(
+                        ''.join(frames[start:start + DATAGRAM_FRAMES]),
+                        self.address)
+            else:
+                self._sock.sendall(''.join(frames))
+        except socket.error:
+            # i.e. the server isn't running, or closed the connection
+            self._close_socket()
+            self._connect_after = time.time() + self._reconnect_secs
+            self.dropped += len(frames)
+            return 0
+
+        self.sent += len(frames)
+        return len(frames)
+
+    def _close_socket(self):
+        if self._sock is not None:
+            self._sock.close()
+            self._sock = None
+
+    def run(self):
+        try:
+            while self._running:
+                time.sleep(self._poll_secs)
+                self.send(self._drain())
+            self.send(self._drain())
+        finally:
+            self._close_socket()
+
+    def close(self):
+        """
+        Send the remaining samples and stop the thread
+        """
+        self._running = False
+        if self.is_alive():
+            self.join()
+        else:
+            # only send was used
+            self._close_socket()
+
+
+class PartyTotals(object):
+    """
+    The frames of all the meters merged. Every meter's last frame is kept,
+    and for each target the damage done by the meters over the longest of
+    windows, as (time, meter, dmg) in the order received.
+
+    The dps of a target is averaged up to its latest frame, not the
+    server's clock, so the clocks of the meters only have to agree with
+    each other. Meters and targets without frames for timeout seconds are
+    forgotten.
+    """
+    def __init__(self, windows=(1, 5), timeout=10.0):
+        self.windows = tuple(windows)
+        self._span = max(self.windows)
+        self._timeout = timeout
+
+        # name: [last frame, frames, lost]
+        self._meters = {}
+        # max health: deque of (time, meter, dmg)
+        self._damage = {}
+        # max health: (first time, latest time)
+        self._seen = {}
+        self.frames = 0
+        self.stale = 0
+
+    def add(self, frame):
+        """
+        Merge a frame. Returns False if it's older than the last frame of
+        its meter (i.e. reordered udp datagrams)
+        """
+        meter = self._meters.get(frame.meter)
+        if meter is None:
+            meter = self._meters[frame.meter] = [frame, 0, 0]
+        elif frame.time <= meter[0].time:
+            self.stale += 1
+            return False
+        else:
+            # the sequence starts over when the meter restarts
+            if frame.seq > meter[0].seq:
+                meter[2] += frame.seq - meter[0].seq - 1
+            meter[0] = frame
+        meter[1] += 1
+        self.frames += 1
+
+        target = frame.target
+        if target is None:
+            return True
+
+        # the meters lag each other a little, so the times are only mostly
+        # in order. The frames older than the longest window are never part
+        # of the dps (i.e. a meter with a skewed clock, or a tcp backlog)
+        first, latest = self._seen.get(target, (frame.time, frame.time))
+        latest = max(latest, frame.time)
+        horizon = latest - self._span
+        if frame.time >= horizon:
+            # a late frame starts the target's time earlier
+            first = min(first, frame.time)
+        self._seen[target] = (first, latest)
+
+        if frame.dmg > 0 and frame.time >= horizon:
+            damage = self._damage.get(target)
+            if damage is None:
+                damage = self._damage[target] = deque()
+            damage.append((frame.time, frame.meter, frame.dmg))
+
+            # late entries are trimmed with the ones before them, the dps
+            # filters on time anyway
+            while damage and damage[0][0] < horizon:
+                damage.popleft()
+        return True
+
+    def expire(self, now):
+        """
+        Forget the meters and targets without frames since now - timeout
+        """
+        horizon = now - self._timeout
+        for name, meter in self._meters.items():
+            if meter[0].time < horizon:
+                del self._meters[name]
+        for target, (first, latest) in self._seen.items():
+            if latest < horizon:
+                del self._seen[target]
+                self._damage.pop(target, None)
+
+    def target_dps(self, target, window):
+        """
+        Returns (dps of the party, dict of meter: dps) done to target over
+        the last window seconds of its frames
+        """
+        first, latest = self._seen.get(target, (0, 0))
+        elapsed = min(window, latest - first)
+        if elapsed <= 0:
+            return 0, {}
+
+        total, meters = 0.0, {}
+        start = latest - window
+        for stamp, meter, dmg in self._damage.get(target, ()):
+            if stamp > start:
+                total += dmg
+                meters[meter] = meters.get(meter, 0.0) + dmg
+        return int(total / elapsed), dict((meter, int(dmg / elapsed))
+                                          for meter, dmg in meters.items())
+
+    def report(self):
+        """
+        Returns the dps of the meters and of the targets as a dict
+        """
+        meters = {}
+        for name, (frame, frames, lost) in self._meters.items():
+            meters[name] = {'time': frame.time,
+                            'instant': frame.instant,
+                            'sustained': frame.sustained,
+                            'incombat': frame.incombat,
+                            'target': frame.target,
+                            'health': frame.health,
+                            'frames': frames,
+                            'lost': lost}
+
+        targets = {}
+        for target in self._seen:
+            health = [meter[0].health for meter in self._meters.values()
+                      if meter[0].target == target]
+            values = dict(('dps %ss' % window,
+                           self.target_dps(target, window)[0])
+                          for window in self.windows)
+            values['health'] = min(health) if health else None
+            values['meters'] = self.target_dps(target, self._span)[1]
+            targets['%d' % target] = values
+        return {'meters': meters, 'targets': targets,
+                'frames': self.frames, 'stale': self.stale}
+
+
+class PartyServer(threading.Thread):
+    """
+    Thread receiving the frames of the meters on port, udp and tcp, and
+    serving the report as json to the connections on report_port.
+
+    A single thread select()s all the sockets, so dozens of meters cost a
+    few wakeups per frame period and one struct unpack per frame.
+    """
+    def __init__(self, host=HOST, port=PORT, report_port=None,
+                 windows=(1, 5), timeout=10.0, poll_secs=0.5):
+        threading.Thread.__init__(self, name='gw2dps party server')
+        self.daemon = True
+
+        self.totals = PartyTotals(windows, timeout)
+        self._lock = threading.Lock()
+        self._poll_secs = poll_secs
+        self._running = True
+
+        self._udp = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._udp.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 1 << 20)
+        self._udp.bind((host, port))
+        self._udp.setblocking(0)
+        # the port actually bound, when port is 0
+        port = self._udp.getsockname()[1]
+
+        self._listener = self._listen(host, port)
+        self._reporter = self._listen(host, report_port or port + 1)
+        self.address = (host, port)
+        self.report_address = self._reporter.getsockname()
+        # connection: data received after the last complete frame
+        self._connections = {}
+
+    @staticmethod
+    def _listen(host, port):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        if sys.platform != 'win32':
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.bind((host, port))
+        sock.listen(16)
+        sock.setblocking(0)
+        return sock
+
+    def report(self):
+        """
+        Returns PartyTotals.report, can be called from any thread
+        """
+        with self._lock:
+            return self.totals.report()
+
+    def _merge(self, frames):
+        with self._lock:
+            add = self.totals.add
+            for frame in frames:
+                add(frame)
+
+    def _receive_datagrams(self):
+        while True:
+            try:
+                data = self._udp.recv(65536)
+            except socket.error as err:
+                if err.args[0] in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    return
+                # i.e. WSAECONNRESET on windows, after a client went away
+                continue
+            try:
+                self._merge(unpack_frames(data)[0])
+            except ValueError:
+                pass
+
+    def _receive_stream(self, conn):
+        try:
+            data = conn.recv(65536)
+        except socket.error:
+            data = ''
+        if not data:
+            self._drop(conn)
+            return
+
+        data = self._connections[conn] + data
+        try:
+            frames, used = unpack_frames(data)
+        except ValueError:
+            # out of sync, the client reconnects
+            self._drop(conn)
+            return
+        self._connections[conn] = data[used:]
+        self._merge(frames)
+
+    def _drop(self, conn):
+        del self._connections[conn]
+        conn.close()
+
+    def _serve_report(self):
+        try:
+            conn = self._reporter.accept()[0]
+        except socket.error:
+            return
+        try:
+            conn.settimeout(1.0)
+            conn.sendall(json.dumps(self.report(), sort_keys=True) + '\n')
+        except socket.error:
+            pass
+        finally:
+            conn.close()
+
+    def run(self):
+        last_expire = time.time()
+        try:
+            while self._running:
+                sockets = [self._udp, self._listener, self._reporter] + \
+                          self._connections.keys()
+                readable = select.select(sockets, [], [], self._poll_secs)[0]
+                for sock in readable:
+                    if sock is self._udp:
+                        self._receive_datagrams()
+                    elif sock is self._listener:
+                        try:
+                            conn = self._listener.accept()[0]
+                        except socket.error:
+                            continue
+                        conn.setblocking(0)
+                        self._connections[conn] = ''
+                    elif sock is self._reporter:
+                        self._serve_report()
+                    else:
+                        self._receive_stream(sock)
+
+                if time.time() - last_expire >= 1.0:
+                    last_expire = time.time()
+                    with self._lock:
+                        self.totals.expire(last_expire)
+        finally:
+            for sock in [self._udp, self._listener, self._reporter] + \
+                        self._connections.keys():
+                sock.close()
+            self._connections = {}
+
+    def close(self):
+        self._running = False
+        if self.is_alive():
+            self.join()
+
+
+def fetch_report(address):
+    """
+    Returns the report of the server whose report port is at address
+    """
+    sock = socket.create_connection(address, timeout=5.0)
+    try:
+        chunks = []
+        while True:
+            chunk = sock.recv(65536)
+            if not chunk:
+                break
+            chunks.append(chunk)
+    finally:
+        sock.close()
+    return json.loads(''.join(chunks))
+
+
+def print_report(report):
+    for name, meter in sorted(report['meters'].items()):
+        print '%-16s %8s %8s %s %s' % (name, meter['instant'],
+                                       meter['sustained'],
+                                       'combat' if meter['incombat'] else '',
+                                       meter['target'] or '')
+    for target, values in sorted(report['targets'].items()):
+        print 'target %s: %s' % (target, ', '.join(
+              ['%s %s' % (key, value) for key, value in sorted(values.items())
+               if key.startswith('dps')]))
+
+
+def simulate(address, meters=8, seconds=30.0, protocol='udp', ms=50,
+             prefix='sim'):
+    """
+    Streams meters simulated meters, all attacking the same target at
+    different dps, to the server at address for seconds. The meter number n
+    is named prefix-n and does 1000 * (n + 1) dps
+    """
+    from simproc import SimulatedProcess, Scenario
+    from gw2dps import DamageMeter
+    from sampler import Sampler
+
+    clients = []
+    for number in xrange(meters):
+        sim = SimulatedProcess()
+        sampler = Sampler(DamageMeter(ms=ms, backend=sim, clock=sim.clock),
+                          ms)
+        scenario = Scenario(sim, [(0, 'target', 'wboss', 50000000),
+                                  (0, 'combat', True),
+                                  (0, 'drain', 1000 * (number + 1))])
+        client = PartyClient(address, '%s-%s' % (prefix, number), protocol,
+                             clock=sim.clock)
+        clients.append((scenario, sampler, client))
+
+    period = ms/1000.0
+    started = time.time()
+    for tick in xrange(int(seconds / period)):
+        for scenario, sampler, client in clients:
+            scenario.advance(period)
+            client.send([sampler.sample()])
+        time.sleep(max(0, started + (tick + 1) * period - time.time()))
+
+    return sum([client.sent for _, _, client in clients])
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description='gw2dps party server')
+    parser.add_argument('command', choices=['server', 'report', 'simulate'])
+    parser.add_argument('--host', default=HOST)
+    parser.add_argument('--port', type=int, default=PORT)
+    parser.add_argument('--meters', type=int, default=8)
+    parser.add_argument('--seconds', type=float, default=30.0)
+    parser.add_argument('--tcp', action='store_true')
+    args = parser.parse_args()
+
+    if args.command == 'server':
+        server = PartyServer(args.host, args.port)
+        server.start()
+        try:
+            while True:
+                time.sleep(1)
+                print_report(server.report())
+                print
+        except KeyboardInterrupt:
+            server.close()
+    elif args.command == 'report':
+        print json.dumps(fetch_report((args.host, args.port + 1)), indent=1,
+                         sort_keys=True)
+    else:
+        print '%s frames sent' % simulate((args.host, args.port), args.meters,
+                                          args.seconds,
+                                          'tcp' if args.tcp else 'udp')
@@ -0,0 +1,115 @@
+"""
+Replays recorded sessions through the meter's dps calculations, without Tk
+and without the game. The samples go through the same Sampler.sample,
+DamageMeter.calculate_dps and CombatTracker (the in combat averages and max
+of the DamageDisplay) as the live meter, as fast as they can be read.
+
+Usage:
+    python replay.py session.gwlog [more logs]
+"""
+from gw2dps import DamageMeter, DPS_WINDOWS
+from dps import DPSEngine, CombatTracker, ENCOUNTER
+from sampler import Sampler
+from sessionlog import read_log
+import time
+import sys
+
+
+class RecordedMeter(DamageMeter):
+    """
+    DamageMeter that returns the recorded samples instead of reading the
+    game's memory. target_health_values raises StopIteration when there are
+    no more records.
+    """
+    def __init__(self, records, ms=250, windows=DPS_WINDOWS):
+        self._ms = ms
+        self._dps = DPSEngine(ms, windows)
+        self._records = iter(records)
+        self._record = None
+        self._ptargetaddr = None
+        self.targets = None
+
+    def target_health_values(self, normalize=False):
+        self._record = record = next(self._records)
+        self._ptargetaddr = getattr(record, 'target', None)
+        return record.dmg, record.health, record.max_health, record.time
+
+    def incombat(self):
+        return self._record.incombat
+
+
+class ReplayResult(object):
+    """
+    Summary of a replay
+    """
+    def __init__(self):
+        self.samples = 0
+        # recorded time, and the time it took to replay it
+        self.duration = 0.0
+        self.elapsed = 0.0
+        self.max_instant = 0
+        self.max_sustained = 0
+        # (time, instant avg, sustained avg, encounter dps) of every combat
+        self.combats = []
+
+    def __str__(self):
+        lines = ['%s samples, %.1fs recorded, replayed in %.3fs' %
+                 (self.samples, self.duration, self.elapsed),
+                 'max instant %s, max sustained %s' %
+                 (self.max_instant, self.max_sustained)]
+        for stamp, instant, sustained, encounter in self.combats:
+            lines.append('combat ended at %.1fs: instant avg %s, '
+                         'sustained avg %s, encounter %s' %
+                         (stamp, instant, sustained, encounter))
+        return '\n'.join(lines)
+
+
+def replay(records, ms=250, windows=DPS_WINDOWS, on_sample=None):
+    """
+    Replays the records (LogRecords or Samples) and returns a ReplayResult.
+
+    on_sample - called with every Sample calculated, i.e. to compare the
+                dps values between two versions
+    """
+    meter = RecordedMeter(records, ms, windows)
+    sampler = Sampler(meter, ms)
+    instant, sustained = CombatTracker(), CombatTracker()
+    result = ReplayResult()
+
+    first = None
+    started = time.time()
+    while True:
+        try:
+            sample = sampler.sample()
+        except StopIteration:
+            break
+
+        if first is None:
+            first = sample.time
+        result.samples += 1
+
+        instant.add(sample.instant, sample.incombat, sample.time)
+        newmax, newavg = sustained.add(sample.sustained, sample.incombat,
+                                       sample.time)
+        if newavg:
+            result.combats.append((sample.time - first,
+                                   instant.prev_incombat_avg,
+                                   sustained.prev_incombat_avg,
+                                   meter.dps(ENCOUNTER)))
+        if on_sample:
+            on_sample(sample)
+
+    result.elapsed = time.time() - started
+    if first is not None:
+        result.duration = sample.time - first
+    result.max_instant, result.max_sustained = instant.max, sustained.max
+    return result
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        print __doc__
+
+    for fname in sys.argv[1:]:
+        print fname
+        print replay(read_log(fname))
@@ -0,0 +1,94 @@
+"""
+Publish/subscribe of the samples taken by the Sampler, so the samples are
+read once and every part of the UI gets them, instead of each one reading
+the memory on its own schedule.
+
+    bus = SampleBus()
+    bus.subscribe(TARGET_DIED, callback)
+    bus.publish(sampler.queue.drain())
+
+The callbacks are called with an Event, on the thread publishing.
+"""
+from collections import namedtuple
+from sampler import READ_FAILED
+
+SAMPLE = 'sample'
+TARGET_CHANGED = 'target-changed'
+COMBAT_ENTER = 'combat-enter'
+COMBAT_EXIT = 'combat-exit'
+TARGET_DIED = 'target-died'
+
+EVENTS = (SAMPLE, TARGET_CHANGED, COMBAT_ENTER, COMBAT_EXIT, TARGET_DIED)
+
+# previous - the sample before, None for the first one. The target that died
+#            is previous.target, the meter drops it once its health is 0.
+#            Samples whose health couldn't be read are skipped
+# last - True for the last sample published at once, i.e. the one to draw
+Event = namedtuple('Event', ['kind', 'sample', 'previous', 'last'])
+
+
+def sample_events(sample, previous):
+    """
+    Returns the kinds of the events of sample, other than SAMPLE
+    """
+    if previous is None or sample.health == READ_FAILED:
+        return []
+
+    events = []
+    if sample.incombat and not previous.incombat:
+        events.append(COMBAT_ENTER)
+    elif previous.incombat and not sample.incombat:
+        events.append(COMBAT_EXIT)
+
+    target = getattr(sample, 'target', None)
+    if target and target != getattr(previous, 'target', None):
+        events.append(TARGET_CHANGED)
+    # the meter reads the health of a dead target as 0 (-1 is no target)
+    if sample.health == 0 and previous.health > 0:
+        events.append(TARGET_DIED)
+    return events
+
+
+class SampleBus(object):
+    """
+    Dispatches the samples to the callbacks subscribed to their events.
+    Every sample is published as a SAMPLE event, followed by its
+    TARGET_CHANGED, COMBAT_ENTER, COMBAT_EXIT and TARGET_DIED events
+    """
+    def __init__(self):
+        self._subscribers = dict((kind, []) for kind in EVENTS)
+        self._previous = None
+
+    def subscribe(self, kind, callback):
+        """
+        Call callback(event) for every event of kind
+        """
+        if kind not in self._subscribers:
+            raise ValueError('unknown event %r' % kind)
+        self._subscribers[kind].append(callback)
+
+    def unsubscribe(self, callback):
+        """
+        Remove callback from all the events it's subscribed to
+        """
+        for callbacks in self._subscribers.values():
+            while callback in callbacks:
+                callbacks.remove(callback)
+
+    def publish(self, samples):
+        """
+        Publish the samples, in order
+        """
+        subscribers = self._subscribers
+        for index, sample in enumerate(samples, 1):
+            previous = self._previous
+            if sample.health != READ_FAILED:
+                self._previous = sample
+            last = index == len(samples)
+
+            for kind in [SAMPLE] + sample_events(sample, previous):
+                if subscribers[kind]:
+                    event = Event(kind, sample, previous, last)
+                    # copied, the callbacks can unsubscribe
+                    for callback in list(subscribers[kind]):
+                        callback(event)
@@ -0,0 +1,193 @@
+"""
+Samples the DamageMeter on a background thread, so the sampling period is
+not affected by how busy the Tk event loop is.
+"""
+from collections import deque, namedtuple
+from tickstats import TickStats
+import threading
+import time
+import sys
+
+if sys.platform == 'win32':
+    from ctypes import windll
+    # time.clock is the QueryPerformanceCounter on windows, it's monotonic
+    # and has a sub microsecond resolution
+    clock = time.clock
+else:
+    windll = None
+    clock = getattr(time, 'monotonic', time.time)
+
+# target is the address of the selected target's health, None if there is
+# no target. health is -1 without a target, and READ_FAILED if it couldn't
+# be read (the target isn't dead, the damage is in the next sample)
+# watched is a tuple of (addr, health, max health) of the targets watched by
+# the meter (see DamageMeter.watch), selected or not
+READ_FAILED = -2
+Sample = namedtuple('Sample', ['time', 'dmg', 'health', 'max_health',
+                               'incombat', 'instant', 'sustained', 'target',
+                               'watched'])
+Sample.__new__.__defaults__ = ((),)
+
+
+class SampleQueue(object):
+    """
+    Bounded single producer/single consumer queue. When the queue is full the
+    oldest sample is dropped.
+    deque.append and deque.popleft are atomic, so no locking is needed
+    """
+    def __init__(self, size=64):
+        self._queue = deque(maxlen=size)
+        self.dropped = 0
+
+    def __len__(self):
+        return len(self._queue)
+
+    def put(self, sample):
+        """
+        Called by the producer
+        """
+        if len(self._queue) == self._queue.maxlen:
+            self.dropped += 1
+        self._queue.append(sample)
+
+    def drain(self):
+        """
+        Called by the consumer. Returns a list of all the samples in the queue
+        """
+        samples = []
+        popleft = self._queue.popleft
+        while True:
+            try:
+                samples.append(popleft())
+            except IndexError:
+                return samples
+
+
+class FixedSchedule(object):
+    """
+    Samples every ms milliseconds
+    """
+    def __init__(self, ms=250):
+        self.fastest = self.period = ms/1000.0
+
+    def next_period(self, sample):
+        return self.period
+
+
+class AdaptiveSchedule(object):
+    """
+    Samples every fast_ms while in combat with a target, and backs off
+    progressively otherwise: the period is multiplied by backoff after every
+    sample, up to slow_ms while in combat or with a target, up to idle_ms
+    with neither (i.e. afk in a city).
+
+    The dps is calculated using the time of the samples, so changing the
+    period doesn't affect the dps windows, as long as the DPSEngine is big
+    enough for the longest window at the fastest rate (see fastest).
+    """
+    def __init__(self, fast_ms=50, slow_ms=250, idle_ms=1000, backoff=1.5):
+        self.fastest = fast_ms/1000.0
+        self._slow = slow_ms/1000.0
+        self._idle = idle_ms/1000.0
+        self._backoff = backoff
+        self.period = self.fastest
+
+    def next_period(self, sample):
+        """
+        Returns the time in seconds until the sample after this one
+        """
+        target = sample.health > 0
+        if sample.incombat and target:
+            self.period = self.fastest
+        else:
+            longest = self._slow if sample.incombat or target else self._idle
+            self.period = min(self.period * self._backoff, longest)
+        return self.period
+
+
+class Sampler(threading.Thread):
+    """
+    Thread that samples the damage meter every ms milliseconds and puts the
+    samples in the queue.
+
+    The next sample is scheduled from the time the previous one was scheduled
+    (not from when it finished), so the period does not drift.
+
+    stats is a TickStats of the sampling loop, the read and compute phases
+    are recorded by the sampler, the render phase by the consumer
+
+    last is the last sample taken, for the readers that only need the
+    current values (see metrics.py)
+
+    schedule - decides the period after each sample (see AdaptiveSchedule),
+               by default a FixedSchedule of ms
+    """
+    def __init__(self, meter, ms=250, queue_size=64, schedule=None):
+        threading.Thread.__init__(self, name='gw2dps sampler')
+        self.daemon = True
+
+        self.queue = SampleQueue(queue_size)
+        self._meter = meter
+        self._ms = ms
+        self.schedule = schedule or FixedSchedule(ms)
+        self._running = True
+        self._incombat = False
+        self.stats = TickStats(self.schedule.fastest)
+        self.last = None
+
+    def sample(self):
+        """
+        Takes one sample of the damage meter
+        """
+        started = clock()
+        dmg, health, max_health, stamp = self._meter.target_health_values()
+        incombat = self._meter.incombat()
+        watched = self._meter.watched()
+        read = clock()
+
+        inst, sustained = self._meter.calculate_dps(dmg, stamp, (1, 5))
+        if incombat and not self._incombat:
+            self._meter.start_encounter()
+        self._incombat = incombat
+
+        self.stats.record('read', read - started)
+        self.stats.record('compute', clock() - read)
+        return Sample(stamp, dmg, health, max_health,
+                      incombat, inst, sustained, self._meter.target,
+                      watched)
+
+    def run(self):
+        period = self.schedule.period
+
+        # sleep() is only accurate to ~15ms on windows unless the timer
+        # resolution is increased
+        if windll:
+            windll.winmm.timeBeginPeriod(1)
+
+        try:
+            deadline = clock()
+            while self._running:
+                now = clock()
+                self.stats.tick(deadline, now)
+                if now - deadline > period:
+                    # a whole period late, don't try to catch up with a
+                    # burst of samples
+                    deadline = now
+
+                sample = self.last = self.sample()
+                self.queue.put(sample)
+
+                period = self.schedule.next_period(sample)
+                deadline += period
+                delay = deadline - clock()
+                if delay > 0:
+                    time.sleep(delay)
+        finally:
+            if windll:
+                windll.winmm.timeEndPeriod(1)
+
+    def stop(self):
+        """
+        Stops the sampler after the current sample
+        """
+        self._running = False
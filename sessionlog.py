@@ -0,0 +1,315 @@
+"""
+Binary session log format.
+
+The file is made of:
+    header  - HEADER struct
+    records - one RECORD struct per sample
+    index   - written when the session is closed. INDEX_HEADER followed by
+              an ENCOUNTER_ENTRY for every encounter and then a (record
+              number, time) INDEX_ENTRY for every INDEX_EVERY records
+    footer  - FOOTER struct with the offset of the index
+
+Everything is little endian. If the session was not closed properly there
+is no index, the reader then rebuilds it by scanning the records.
+
+Usage:
+    python sessionlog.py info session.gwlog
+    python sessionlog.py convert dps.txt session.gwlog
+"""
+from collections import namedtuple
+from bisect import bisect_right
+import struct
+import mmap
+import time
+import sys
+
+MAGIC = 'GW2DPSB\0'
+INDEX_MAGIC = 'GW2DPSI\0'
+FOOTER_MAGIC = 'GW2DPSE\0'
+VERSION = 1
+
+# magic, version, record size, reserved, wall time and clock at the start
+HEADER = struct.Struct('<8sHHIdd')
+# time, health, max health, dmg, flags
+RECORD = struct.Struct('<dfffB3x')
+# magic, number of encounters, number of time entries
+INDEX_HEADER = struct.Struct('<8sII')
+# first record, record after the last, time of the first record
+ENCOUNTER_ENTRY = struct.Struct('<IId')
+# record number, time
+INDEX_ENTRY = struct.Struct('<Id')
+# index offset, magic
+FOOTER = struct.Struct('<Q8s')
+
+FLAG_INCOMBAT = 0x1
+FLAG_ENCOUNTER = 0x2
+
+# a time index entry is added every INDEX_EVERY records
+INDEX_EVERY = 256
+
+LogRecord = namedtuple('LogRecord', ['time', 'dmg', 'health', 'max_health',
+                                     'incombat'])
+
+
+class BinaryLogFormat(object):
+    """
+    Format used by the CombatLogWriter to write binary session logs. An
+    encounter starts with the first record of each in combat streak.
+    """
+    extension = '.gwlog'
+    mode = 'wb'
+
+    def __init__(self):
+        self._count = 0
+        self._incombat = False
+        self._encounters = []
+        self._times = []
+
+    def header(self, sample=None):
+        clock = sample.time if sample else 0.0
+        return HEADER.pack(MAGIC, VERSION, RECORD.size, 0, time.time(), clock)
+
+    def records(self, samples):
+        packed = []
+        pack = RECORD.pack
+        for sample in samples:
+            flags = 0
+            if sample.incombat:
+                flags = FLAG_INCOMBAT
+                if not self._incombat:
+                    flags |= FLAG_ENCOUNTER
+                    self._encounters.append([self._count, None, sample.time])
+            elif self._incombat:
+                self._encounters[-1][1] = self._count
+            self._incombat = sample.incombat
+
+            if not self._count % INDEX_EVERY:
+                self._times.append((self._count, sample.time))
+
+            packed.append(pack(sample.time, sample.health, sample.max_health,
+                               sample.dmg, flags))
+            self._count += 1
+        return ''.join(packed)
+
+    def footer(self):
+        index = [INDEX_HEADER.pack(INDEX_MAGIC, len(self._encounters),
+                                   len(self._times))]
+        index.extend([ENCOUNTER_ENTRY.pack(start, self._count if stop is None
+                                                  else stop, stamp)
+                      for start, stop, stamp in self._encounters])
+        index.extend([INDEX_ENTRY.pack(*entry) for entry in self._times])
+        offset = HEADER.size + self._count * RECORD.size
+        index.append(FOOTER.pack(offset, FOOTER_MAGIC))
+        return ''.join(index)
+
+
+class SessionLog(object):
+    """
+    Reader of the binary session logs. The file is memory mapped, any record
+    or encounter is read without reading the ones before it.
+    """
+    def __init__(self, fname):
+        self._file = open(fname, 'rb')
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        (magic, version, record_size, _,
+         self.started, self.clock) = HEADER.unpack_from(self._map)
+        if magic != MAGIC or record_size != RECORD.size:
+            raise ValueError('%s is not a gw2dps session log' % fname)
+
+        if not self._read_index():
+            self._build_index()
+
+    def _read_index(self):
+        """
+        Reads the index at the end of the file. Returns False if there is
+        no index
+        """
+        if len(self._map) < HEADER.size + FOOTER.size:
+            return False
+        offset, magic = FOOTER.unpack_from(self._map,
+                                           len(self._map) - FOOTER.size)
+        if magic != FOOTER_MAGIC:
+            return False
+
+        magic, nencounters, ntimes = INDEX_HEADER.unpack_from(self._map, offset)
+        pos = offset + INDEX_HEADER.size
+        self._encounters = []
+        for _ in xrange(nencounters):
+            start, stop, _ = ENCOUNTER_ENTRY.unpack_from(self._map, pos)
+            self._encounters.append((start, stop))
+            pos += ENCOUNTER_ENTRY.size
+
+        self._index_recno, self._index_time = [], []
+        for _ in xrange(ntimes):
+            recno, stamp = INDEX_ENTRY.unpack_from(self._map, pos)
+            self._index_recno.append(recno)
+            self._index_time.append(stamp)
+            pos += INDEX_ENTRY.size
+
+        self._count = (offset - HEADER.size) // RECORD.size
+        return True
+
+    def _build_index(self):
+        """
+        Scans the records to build the index, for sessions that weren't
+        closed
+        """
+        self._count = (len(self._map) - HEADER.size) // RECORD.size
+        self._encounters, self._index_recno, self._index_time = [], [], []
+
+        start = None
+        for recno in xrange(self._count):
+            stamp, _, _, _, flags = RECORD.unpack_from(self._map,
+                                                 HEADER.size +
+                                                 recno * RECORD.size)
+            if start is not None and not flags & FLAG_INCOMBAT:
+                self._encounters.append((start, recno))
+                start = None
+            if flags & FLAG_ENCOUNTER:
+                start = recno
+            if not recno % INDEX_EVERY:
+                self._index_recno.append(recno)
+                self._index_time.append(stamp)
+
+        if start is not None:
+            self._encounters.append((start, self._count))
+
+    def __len__(self):
+        return self._count
+
+    def record(self, recno):
+        """
+        Returns the LogRecord recno
+        """
+        if not 0 <= recno < self._count:
+            raise IndexError('record %s out of range' % recno)
+        stamp, health, max_health, dmg, flags = \
+                RECORD.unpack_from(self._map, HEADER.size + recno * RECORD.size)
+        return LogRecord(stamp, dmg, health, max_health,
+                         bool(flags & FLAG_INCOMBAT))
+
+    def records(self, start=0, stop=None):
+        """
+        Iterates over the records from start to stop
+        """
+        stop = self._count if stop is None else min(stop, self._count)
+        unpack_from = RECORD.unpack_from
+        for pos in xrange(HEADER.size + start * RECORD.size,
+                          HEADER.size + stop * RECORD.size,
+                          RECORD.size):
+            stamp, health, max_health, dmg, flags = unpack_from(self._map, pos)
+            yield LogRecord(stamp, dmg, health, max_health,
+                            bool(flags & FLAG_INCOMBAT))
+
+    def record_buffer(self, start=0, stop=None):
+        """
+        Returns a read only buffer of the packed records from start to stop,
+        sharing the memory of the map. It must not be used once the log is
+        closed
+        """
+        stop = self._count if stop is None else min(stop, self._count)
+        start = min(start, stop)
+        return buffer(self._map, HEADER.size + start * RECORD.size,
+                      (stop - start) * RECORD.size)
+
+    def encounters(self):
+        """
+        Returns a list of (start, stop) record numbers of the encounters
+        """
+        return list(self._encounters)
+
+    def encounter(self, number):
+        """
+        Iterates over the records of encounter number
+        """
+        return self.records(*self._encounters[number])
+
+    def find_time(self, stamp):
+        """
+        Returns the number of the first record at or after stamp
+        """
+        pos = bisect_right(self._index_time, stamp) - 1
+        recno = self._index_recno[pos] if pos >= 0 else 0
+        while recno < self._count and self.record(recno).time < stamp:
+            recno += 1
+        return recno
+
+    def close(self):
+        self._map.close()
+        self._file.close()
+
+
+def read_text_log(src):
+    """
+    Iterates over the LogRecords of a text log.
+
+    Both the sample logs (time health max_health dmg incombat) and the old
+    dps.txt logs, which only have the instant dps of every second in combat,
+    are supported.
+    """
+    count = 0
+    with open(src, 'r') as fobj:
+        for line in fobj:
+            values = line.split()
+            if not values or line.startswith('#'):
+                continue
+            if len(values) == 5:
+                stamp, health, max_health, dmg = [float(v) for v in values[:4]]
+                incombat = bool(int(values[4]))
+            else:
+                # old log, one instant dps value a second
+                stamp, health, max_health = float(count), 0.0, 0.0
+                dmg, incombat = float(values[0]), True
+            count += 1
+            yield LogRecord(stamp, dmg, health, max_health, incombat)
+
+
+def read_log(fname):
+    """
+    Iterates over the LogRecords of a binary or text log
+    """
+    with open(fname, 'rb') as fobj:
+        binary = fobj.read(len(MAGIC)) == MAGIC
+
+    if binary:
+        log = SessionLog(fname)
+        try:
+            for record in log.records():
+                yield record
+        finally:
+            log.close()
+    else:
+        for record in read_text_log(fname):
+            yield record
+
+
+def convert_text_log(src, dst):
+    """
+    Converts a text log to a binary session log. Returns the number of
+    records written.
+    """
+    logformat = BinaryLogFormat()
+    samples = list(read_text_log(src))
+
+    with open(dst, 'wb') as fobj:
+        fobj.write(logformat.header(samples[0] if samples else None))
+        fobj.write(logformat.records(samples))
+        fobj.write(logformat.footer())
+
+    return len(samples)
+
+
+if __name__ == '__main__':
+    if len(sys.argv) == 4 and sys.argv[1] == 'convert':
+        print '%s records written' % convert_text_log(sys.argv[2], sys.argv[3])
+    elif len(sys.argv) == 3 and sys.argv[1] == 'info':
+        log = SessionLog(sys.argv[2])
+        print '%s records, started %s' % (len(log), time.ctime(log.started))
+        for number, (start, stop) in enumerate(log.encounters()):
+            print 'encounter %s: records %s-%s, %.1fs' % (
+                number, start, stop,
+                log.record(stop - 1).time - log.record(start).time)
+        log.close()
+    else:
+        print __doc__
@@ -0,0 +1,234 @@
+"""
+Finds addresses in the game's image from byte signatures (array of bytes
+patterns), so the static addresses don't have to be updated by hand after
+every patch.
+
+A signature is the bytes of code that uses the address, with ?? for the bytes
+that change between builds (i.e. the address itself):
+
+    Signature('8B 0D ?? ?? ?? ?? 85 C9', offset=2, resolve='abs')
+
+offset is where the address is stored, from the start of the match, and
+resolve how it's stored: 'abs' an absolute 32 bit address, 'rip' a 32 bit
+displacement relative to the end of it (x64 rip relative addressing), None
+the address of the match itself.
+
+The image is read in big chunks, and each signature is searched with
+str.find for its longest run of literal bytes, only the candidates found are
+checked against the whole pattern.
+
+    found = scan(proc, {'TARGET_HEALTH_BASE': signature})
+
+fingerprint identifies the build of the game, so the addresses found can be
+cached between launches.
+"""
+from ctypes import create_string_buffer, c_ulong, byref
+import hashlib
+import struct
+import re
+
+CHUNK_SIZE = 0x400000
+PAGE_SIZE = 0x1000
+
+RESOLVE = (None, 'abs', 'rip')
+
+# IMAGE_SECTION_HEADER.Characteristics of code sections
+IMAGE_SCN_MEM_EXECUTE = 0x20000000
+
+
+class Signature(object):
+    """
+    A compiled byte pattern. Raises ValueError if the pattern is invalid or
+    has no literal bytes
+    """
+    def __init__(self, pattern, offset=0, resolve=None):
+        if resolve not in RESOLVE:
+            raise ValueError('resolve must be one of %s' % (RESOLVE,))
+
+        self.pattern = pattern
+        self.offset = offset
+        self.resolve = resolve
+
+        values = []
+        for token in pattern.split():
+            if token in ('?', '??'):
+                values.append(None)
+            else:
+                value = int(token, 16)
+                if not 0 <= value <= 0xFF or len(token) != 2:
+                    raise ValueError('invalid byte %r in %r' % (token, pattern))
+                values.append(value)
+        if not values:
+            raise ValueError('empty signature')
+        self.size = len(values)
+
+        # longest run of literal bytes, searched for first
+        runs, start = [], None
+        for index, value in enumerate(values + [None]):
+            if value is not None and start is None:
+                start = index
+            elif value is None and start is not None:
+                runs.append((index - start, start))
+                start = None
+        if not runs:
+            raise ValueError('signature %r has no literal bytes' % pattern)
+        length, start = max(runs)
+        self._anchor = ''.join([chr(value) for value
+                                in values[start:start + length]])
+        self._anchor_offset = start
+        self._regex = re.compile(''.join(['.' if value is None
+                                          else re.escape(chr(value))
+                                          for value in values]), re.DOTALL)
+
+    def __repr__(self):
+        return 'Signature(%r, %s, %r)' % (self.pattern, self.offset,
+                                          self.resolve)
+
+    def search(self, data, start=0, end=None):
+        """
+        Returns the index of the first match in data starting in
+        [start, end), -1 if not found
+        """
+        end = len(data) if end is None else end
+        find, match = data.find, self._regex.match
+        index = find(self._anchor, start + self._anchor_offset)
+        while index != -1:
+            position = index - self._anchor_offset
+            if position >= end:
+                break
+            if match(data, position):
+                return position
+            index = find(self._anchor, index + 1)
+        return -1
+
+    def address(self, proc, match):
+        """
+        Returns the address the signature refers to, from the address of the
+        match. None if it can't be read
+        """
+        if self.resolve is None:
+            return match + self.offset
+
+        where = match + self.offset
+        value = proc.read_memory(where, 'int')
+        if value is False:
+            return None
+        if self.resolve == 'abs':
+            return value & 0xFFFFFFFF
+        return where + 4 + value
+
+
+def chunks(proc, base, size, chunk_size=CHUNK_SIZE, overlap=0):
+    """
+    Yields (address, data) of the image in chunks of chunk_size bytes, each
+    followed by overlap bytes of the next one. The pages that can't be read
+    are returned as zeros
+    """
+    buf = create_string_buffer(chunk_size + overlap)
+    count = c_ulong()
+    end = base + size
+    for address in xrange(base, end, chunk_size):
+        length = min(chunk_size + overlap, end - address)
+        if proc.read_raw(address, buf, length, byref(count)):
+            yield address, buf.raw[:length]
+            continue
+
+        # part of the chunk isn't readable, read it page by page
+        pages = []
+        for page in xrange(address, address + length, PAGE_SIZE):
+            page_length = min(PAGE_SIZE, address + length - page)
+            if proc.read_raw(page, buf, page_length, byref(count)):
+                pages.append(buf.raw[:page_length])
+            else:
+                pages.append('\0' * page_length)
+        yield address, ''.join(pages)
+
+
+def scan(proc, signatures, base=None, size=None, chunk_size=CHUNK_SIZE):
+    """
+    Searches the image for the dict of name: Signature. By default the image
+    is the one of the process' module.
+
+    Returns a dict of name: address of the signatures found, the first
+    match of a signature is used.
+    """
+    if base is None:
+        base = proc.base_addr
+    if size is None:
+        size = proc.get_image_size(base)
+
+    left = dict(signatures)
+    found = {}
+    overlap = max([signature.size for signature in left.values()] or [1]) - 1
+    for address, data in chunks(proc, base, size, chunk_size, overlap):
+        for name, signature in left.items():
+            position = signature.search(data, 0, chunk_size)
+            if position != -1:
+                found[name] = signature.address(proc, address + position)
+                del left[name]
+        if not left:
+            break
+
+    return dict((name, address) for name, address in found.items()
+                if address is not None)
+
+
+def _read_page(proc, address, length=PAGE_SIZE):
+    buf = create_string_buffer(length)
+    if proc.read_raw(address, buf, length, byref(c_ulong())):
+        return buf.raw
+    return None
+
+
+def code_sections(header):
+    """
+    Returns the list of (rva, size) of the executable sections from the PE
+    header page, an empty list if header isn't a PE header
+    """
+    if header is None or header[:2] != 'MZ':
+        return []
+    nt = struct.unpack_from('<I', header, 0x3C)[0]
+    if nt + 0x18 > len(header) or header[nt:nt + 4] != 'PE\0\0':
+        return []
+
+    count, = struct.unpack_from('<H', header, nt + 6)
+    optional_size, = struct.unpack_from('<H', header, nt + 0x14)
+    sections = []
+    for offset in xrange(nt + 0x18 + optional_size,
+                         min(nt + 0x18 + optional_size + count * 40,
+                             len(header) - 39), 40):
+        size, rva = struct.unpack_from('<II', header, offset + 8)
+        characteristics, = struct.unpack_from('<I', header, offset + 36)
+        if characteristics & IMAGE_SCN_MEM_EXECUTE:
+            sections.append((rva, size))
+    return sections
+
+
+def fingerprint(proc, base=None, samples=8):
+    """
+    Returns a hash identifying the build of the game: the image name and
+    size, the PE header and samples pages of code spread over the code
+    sections. Only pages that don't change while the game runs are used.
+    Images without a PE header are sampled all over.
+    """
+    if base is None:
+        base = proc.base_addr
+    size = proc.get_image_size(base)
+    header = _read_page(proc, base)
+
+    sections = code_sections(header) or [(0, size)]
+    total = sum([length for _, length in sections])
+    pages = []
+    for sample in xrange(samples):
+        # the sample-th page of the concatenated sections
+        position = total * sample // samples
+        for rva, length in sections:
+            if position < length:
+                pages.append(base + rva + position - position % PAGE_SIZE)
+                break
+            position -= length
+
+    digest = hashlib.sha1('%s:%s:' % (proc.get_image_name().lower(), size))
+    for address in [base] + pages:
+        digest.update(_read_page(proc, address) or '')
+    return digest.hexdigest()
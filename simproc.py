@@ -0,0 +1,315 @@
+"""
+A simulated Guild Wars 2 process, so the memory reading and the dps
+calculations can be run (and benchmarked) without the game, or windows.
+
+The memory is laid out like the game's: the target health pointer trails
+(TARGET_HEALTH_*) lead to the health of the selected target, and the
+in combat flags are at INCOMBAT_ADDR1/2. The values are taken from gw2dps
+when the process is created, so the memory.txt overrides are used.
+
+    sim = SimulatedProcess()
+    meter = DamageMeter(ms=250, backend=sim, clock=sim.clock)
+    fight = Scenario(sim, [(0, 'target', 'wboss', 1000000),
+                           (0, 'combat', True),
+                           (0, 'drain', 5000),
+                           (60, 'combat', False)])
+    while fight.advance(0.25):
+        meter.target_health_values()
+"""
+from ctypes import memmove
+from aproc import MemoryBackend
+import struct
+import gw2dps
+
+PAGE_SIZE = 0x1000
+IMAGE_NAME = 'Gw2.exe'
+IMAGE_BASE = 0x00400000
+HEAP_BASE = 0x20000000
+
+# target kinds, in the order of DamageMeter._possible_targets
+TARGET_KINDS = ('normal', 'wboss', 'obj')
+
+
+class SimulatedProcess(MemoryBackend):
+    """
+    MemoryBackend over a synthetic memory image.
+
+    The memory is made of mapped ranges, pages are only allocated when they
+    are written, reading a mapped page that was never written returns
+    zeros. Reading outside of the mapped ranges fails, like reading unmapped
+    memory of a real process.
+    """
+    def __init__(self, image_size=None):
+        self.time = 0.0
+        self._pages = {}
+        self._ranges = []
+        self._protected = set()
+        self._heap = HEAP_BASE
+
+        self.chains = dict(zip(TARGET_KINDS,
+            [(gw2dps.TARGET_HEALTH_BASE, gw2dps.TARGET_HEALTH_OFFSET),
+             (gw2dps.TARGET_HEALTH_WBOSS_BASE, gw2dps.TARGET_HEALTH_WBOSS_OFFSET),
+             (gw2dps.TARGET_HEALTH_OBJ_BASE, gw2dps.TARGET_HEALTH_OBJ_OFFSET)]))
+        self._incombat_addrs = (gw2dps.INCOMBAT_ADDR1, gw2dps.INCOMBAT_ADDR2)
+        self._incombat_value = gw2dps.INCOMBAT_VALUE
+
+        if image_size is None:
+            image_size = max([base for base, _ in self.chains.values()]) + \
+                         PAGE_SIZE
+        self.image_size = image_size
+        self.map(IMAGE_BASE, image_size)
+        for addr in self._incombat_addrs:
+            self.map(addr, 4)
+
+        # build the trails up to the last link, which is set to the
+        # selected target
+        self._last_links = {}
+        for kind, (base, offsets) in self.chains.items():
+            pointer = IMAGE_BASE + base
+            for offset in offsets[:-1]:
+                obj = self.read_int(pointer)
+                if not obj:
+                    obj = self.alloc(PAGE_SIZE)
+                    self.write_int(pointer, obj)
+                pointer = obj + offset
+            self._last_links[kind] = pointer
+
+        self.target = None
+        self.set_combat(False)
+
+    def clock(self):
+        """
+        Simulated time, in seconds
+        """
+        return self.time
+
+    # memory
+    def map(self, address, size):
+        """
+        Map the range so it can be read
+        """
+        start = address - address % PAGE_SIZE
+        end = address + size
+        self._ranges.append((start, end + (-end) % PAGE_SIZE))
+
+    def alloc(self, size):
+        """
+        Map a new block of memory and return its address
+        """
+        address = self._heap
+        size += (-size) % PAGE_SIZE
+        self._heap += size + PAGE_SIZE
+        self.map(address, size)
+        return address
+
+    def protect(self, address, protected=True):
+        """
+        Make the page at address unreadable by the meter, or readable again
+        if protected is False. The game still reads and writes it
+        """
+        if protected:
+            self._protected.add(address // PAGE_SIZE)
+        else:
+            self._protected.discard(address // PAGE_SIZE)
+
+    def _ismapped(self, address, length):
+        for start, end in self._ranges:
+            if start <= address and address + length <= end:
+                return True
+        return False
+
+    def write(self, address, data):
+        """
+        Write the data at address
+        """
+        for index, byte in enumerate(data):
+            page, offset = divmod(address + index, PAGE_SIZE)
+            if page not in self._pages:
+                self._pages[page] = bytearray(PAGE_SIZE)
+            self._pages[page][offset] = byte
+
+    def read_bytes(self, address, length):
+        """
+        Returns the bytes at address, None if the memory isn't mapped
+        """
+        if not self._ismapped(address, length):
+            return None
+
+        data = bytearray()
+        while length:
+            page, offset = divmod(address, PAGE_SIZE)
+            chunk = min(length, PAGE_SIZE - offset)
+            if page in self._pages:
+                data += self._pages[page][offset:offset + chunk]
+            else:
+                data += bytearray(chunk)
+            address += chunk
+            length -= chunk
+        return str(data)
+
+    def write_int(self, address, value):
+        self.write(address, struct.pack('<i', value))
+
+    def read_int(self, address):
+        return struct.unpack('<i', self.read_bytes(address, 4))[0]
+
+    def write_float(self, address, value):
+        self.write(address, struct.pack('<f', value))
+
+    def read_float(self, address):
+        return struct.unpack('<f', self.read_bytes(address, 4))[0]
+
+    # MemoryBackend
+    def read(self, address, buf, length, pcount):
+        pages = xrange(address // PAGE_SIZE,
+                       (address + length - 1) // PAGE_SIZE + 1)
+        if self._protected.intersection(pages):
+            return False
+        data = self.read_bytes(address, length)
+        if data is None:
+            return False
+        memmove(buf, data, length)
+        return True
+
+    def get_image_name(self):
+        return IMAGE_NAME
+
+    def find_base_addr(self, module_name):
+        if module_name.lower() in IMAGE_NAME.lower():
+            return IMAGE_BASE
+
+    def get_image_size(self, base):
+        if base == IMAGE_BASE:
+            return self.image_size
+
+    # game state
+    def spawn(self, max_health, health=None):
+        """
+        Create a new entity and return the address of its health
+        """
+        entity = self.alloc(0x100)
+        self.write_float(entity, max_health if health is None else health)
+        self.write_float(entity + 0x4, max_health)
+        return entity
+
+    def select(self, kind, entity):
+        """
+        Select the entity as a target of kind (one of TARGET_KINDS)
+        """
+        self.deselect()
+        offsets = self.chains[kind][1]
+        self.write_int(self._last_links[kind], entity - offsets[-1])
+        self.target = entity
+
+    def relink(self, kind, entity):
+        """
+        Select the entity as a target of kind through new objects in the
+        middle of the trail, like the game does when another agent is
+        selected: the root pointer stays the same, and the old objects
+        still point to the previous target
+        """
+        for other, pointer in self._last_links.items():
+            if other != kind:
+                self.write_int(pointer, 0)
+
+        base, offsets = self.chains[kind]
+        pointer = self.read_int(IMAGE_BASE + base) + offsets[0]
+        for offset in offsets[1:-1]:
+            obj = self.alloc(PAGE_SIZE)
+            self.write_int(pointer, obj)
+            pointer = obj + offset
+        self._last_links[kind] = pointer
+        self.write_int(pointer, entity - offsets[-1])
+        self.target = entity
+
+    def deselect(self):
+        """
+        No target selected
+        """
+        for pointer in self._last_links.values():
+            self.write_int(pointer, 0)
+        self.target = None
+
+    def damage(self, amount, entity=None):
+        """
+        Damage the entity, by default the selected target
+        """
+        entity = entity or self.target
+        if entity:
+            health = max(self.read_float(entity) - amount, 0.0)
+            self.write_float(entity, health)
+
+    def set_combat(self, incombat):
+        """
+        Set the in combat flags
+        """
+        self.incombat = incombat
+        self.write_int(self._incombat_addrs[0], 0 if incombat else 1)
+        self.write_int(self._incombat_addrs[1],
+                       self._incombat_value if incombat else 0)
+
+
+class Scenario(object):
+    """
+    Scripted events on a SimulatedProcess. events is a list of
+    (time, action, args...) tuples, the actions are:
+
+        'target', kind, max_health  - spawn a new target and select it
+        'relink', kind, max_health  - spawn a new target and select it
+                                      through new links in the middle of
+                                      the trail (see relink)
+        'deselect'                  - no target selected
+        'drain', dps                - damage the target at dps every second
+        'combat', incombat          - enter/leave combat
+    """
+    def __init__(self, proc, events):
+        self.proc = proc
+        self._events = sorted(events, key=lambda event: event[0])
+        self._next = 0
+        self._dps = 0
+
+    def advance(self, period):
+        """
+        Run the scenario for period seconds. Returns False when all the
+        events happened
+        """
+        proc = self.proc
+        proc.damage(self._dps * period)
+        proc.time += period
+
+        while self._next < len(self._events) and \
+              self._events[self._next][0] <= proc.time:
+            event = self._events[self._next]
+            getattr(self, '_' + event[1])(*event[2:])
+            self._next += 1
+
+        return self._next < len(self._events)
+
+    def _target(self, kind, max_health):
+        self.proc.select(kind, self.proc.spawn(max_health))
+
+    def _relink(self, kind, max_health):
+        self.proc.relink(kind, self.proc.spawn(max_health))
+
+    def _deselect(self):
+        self.proc.deselect()
+
+    def _drain(self, dps):
+        self._dps = dps
+
+    def _combat(self, incombat):
+        self.proc.set_combat(incombat)
+
+
+def fight(duration, dps=5000, max_health=None, kind='wboss', idle=5):
+    """
+    Returns the events of a simple fight: a target is selected, damaged at
+    dps for duration seconds in combat, then idle seconds out of combat
+    """
+    max_health = max_health or dps * duration * 2
+    return [(0, 'target', kind, max_health),
+            (0, 'combat', True),
+            (0, 'drain', dps),
+            (duration, 'drain', 0),
+            (duration, 'combat', False),
+            (duration + idle, 'deselect')]
@@ -0,0 +1,219 @@
+"""
+Tracks the health and dps of several targets at once: the targets locked
+recently and a watch list, so the damage done to the adds around the
+selected target (cleave) is seen as well, and swapping between targets
+doesn't lose their dps.
+"""
+from array import array
+
+# last locked time of the watched targets, so they are never replaced
+WATCHED = float('inf')
+
+
+class TargetTable(object):
+    """
+    The tracked targets, stored as a struct of arrays: each column (address,
+    health, max health, ...) is a preallocated array indexed by slot.
+
+    All the targets share one timeline of samples. For every sample the
+    running totals of the damage done to each slot are stored in a ring
+    buffer (row = sample, column = slot), along with the total for all the
+    slots, so the dps of a target over a window is the difference of two
+    totals divided by the time between the samples, like the DPSEngine.
+
+    The health and max health of all the targets are read with one
+    aproc.ReadBatch per sample, rebuilt only when the targets change.
+
+    proc - aproc.Proc to read the health with
+
+    ms - expected sample period in milliseconds, used to size the buffer
+
+    windows - window sizes in seconds
+
+    slots - number of targets tracked. When they are all used, the least
+            recently locked target is replaced, watched targets never are
+
+    capacity - number of samples kept, by default enough for the longest
+               window at twice the expected sample rate
+    """
+    def __init__(self, proc, ms=250, windows=(1, 5), slots=16,
+                 capacity=None):
+        self._proc = proc
+        self.windows = tuple(windows)
+        self.slots = slots
+        self._size = capacity or int(max(self.windows) * 1000/ms * 2) + 2
+
+        # columns, an address of 0 is a free slot
+        self.addrs = array('L', [0]) * slots
+        self.health = array('d', [0.0]) * slots
+        self.max_health = array('d', [0.0]) * slots
+        self.locked = array('d', [0.0]) * slots
+        self.failures = array('l', [0]) * slots
+        # sample the slot was assigned at, its dps starts from there
+        self._since = array('l', [0]) * slots
+        self._damage = array('d', [0.0]) * slots
+
+        # shared timeline
+        self._times = array('d', [0.0]) * self._size
+        self._totals = array('d', [0.0]) * (self._size * slots)
+        self._aggregate = array('d', [0.0]) * self._size
+        self._total = 0.0
+        self._count = 0
+        self._starts = {}
+
+        self._slot = {}
+        self._batch = None
+        self._batch_slots = ()
+
+    def __len__(self):
+        return len(self._slot)
+
+    def __contains__(self, addr):
+        return addr in self._slot
+
+    def _assign(self, addr, locked):
+        """
+        Returns the slot of addr, assigning it one if needed. None if all
+        the slots are watched
+        """
+        slot = self._slot.get(addr)
+        if slot is None:
+            slot = min(xrange(self.slots), key=self.locked.__getitem__)
+            if self.locked[slot] == WATCHED:
+                return None
+            if self.addrs[slot]:
+                del self._slot[self.addrs[slot]]
+
+            self._slot[addr] = slot
+            self.addrs[slot] = addr
+            # the first read only sets the health
+            self.max_health[slot] = -1.0
+            self.health[slot] = 0.0
+            self.failures[slot] = 0
+            self._since[slot] = self._count
+            self._batch = None
+
+        if self.locked[slot] != WATCHED:
+            self.locked[slot] = locked
+        return slot
+
+    def lock(self, addr, stamp):
+        """
+        Track addr, the address of the health of the selected target
+        """
+        self._assign(addr, stamp)
+
+    def watch(self, addr):
+        """
+        Track addr until unwatch is called. Returns False if all the slots
+        are watched already
+        """
+        return self._assign(addr, WATCHED) is not None
+
+    def unwatch(self, addr, stamp=0.0):
+        """
+        Stop watching addr, it's replaced like any other locked target
+        """
+        slot = self._slot.get(addr)
+        if slot is not None:
+            self.locked[slot] = stamp
+
+    def watched(self):
+        """
+        Returns a tuple of (addr, health, max health) of the watched targets
+        whose health was read by the last update
+        """
+        return tuple((self.addrs[slot], self.health[slot],
+                      self.max_health[slot])
+                     for slot in self._slot.values()
+                     if self.locked[slot] == WATCHED and
+                     not self.failures[slot] and self.max_health[slot] >= 0)
+
+    def update(self, stamp):
+        """
+        Read the health of all the targets and add the damage done since the
+        previous update
+        """
+        if self._batch is None:
+            self._batch_slots = tuple(self._slot.values())
+            requests = []
+            for slot in self._batch_slots:
+                requests += [(self.addrs[slot], 'float'),
+                             (self.addrs[slot] + 0x4, 'float')]
+            self._batch = self._proc.batch(requests)
+
+        values = self._batch.read()
+        health, max_health = self.health, self.max_health
+        damage, failures = self._damage, self.failures
+        for index, slot in enumerate(self._batch_slots):
+            current, maximum = values[2*index], values[2*index + 1]
+            if current is False or maximum is False:
+                failures[slot] += 1
+                continue
+            failures[slot] = 0
+
+            if maximum == max_health[slot]:
+                dmg = health[slot] - current
+                if dmg > 0:
+                    damage[slot] += dmg
+                    self._total += dmg
+            else:
+                # first read, or a new entity at the same address
+                max_health[slot] = maximum
+            health[slot] = current
+
+        self._count += 1
+        index = self._count % self._size
+        self._times[index] = stamp
+        self._aggregate[index] = self._total
+        self._totals[index * self.slots:(index + 1) * self.slots] = damage
+
+    def _start(self, window):
+        """
+        Returns the sample the window starts at
+        """
+        count, size = self._count, self._size
+        start = max(self._starts.get(window, 1), count - size + 1, 1)
+        times = self._times
+        now = times[count % size]
+        while start < count and now - times[(start + 1) % size] >= window:
+            start += 1
+        self._starts[window] = start
+        return start
+
+    def dps(self, window=1, addr=None):
+        """
+        Returns the dps done to addr averaged over the last window seconds,
+        to all the targets if addr is None. When the target was tracked for
+        less than window seconds, the dps is averaged over the time it was
+        tracked.
+        """
+        count, size = self._count, self._size
+        if count < 2:
+            return 0
+
+        start = self._start(window)
+        if addr is None:
+            totals, column, stride = self._aggregate, 0, 1
+        else:
+            slot = self._slot.get(addr)
+            if slot is None:
+                return 0
+            start = max(start, self._since[slot] + 1)
+            totals, column, stride = self._totals, slot, self.slots
+
+        elapsed = self._times[count % size] - self._times[start % size]
+        if elapsed <= 0:
+            return 0
+        return int((totals[(count % size) * stride + column] -
+                    totals[(start % size) * stride + column]) / elapsed)
+
+    def report(self, window=5):
+        """
+        Returns a list of (addr, health, max health, dps) of the tracked
+        targets, highest dps first
+        """
+        rows = [(self.addrs[slot], self.health[slot], self.max_health[slot],
+                 self.dps(window, self.addrs[slot]))
+                for slot in self._slot.values()]
+        return sorted(rows, key=lambda row: row[3], reverse=True)
@@ -0,0 +1,139 @@
+"""
+Tests of the statistics of an encounter, with and without NumPy
+"""
+from sessionlog import LogRecord, BinaryLogFormat
+import analytics
+import tempfile
+import random
+import shutil
+import os
+import unittest
+
+
+def records(period=0.25, jitter=0.0, seed=1):
+    """
+    Returns the records of a fight: 4000 dps for 10s, nothing for 2s in
+    combat, then 8000 dps for 4s until the target dies at 16s, and 2s out
+    of combat
+    """
+    rand = random.Random(seed)
+    rows = []
+    now, health, max_health = 0.0, 72000.0, 72000.0
+    while now < 18:
+        step = period + rand.uniform(-jitter, jitter)
+        dps = 4000 if now < 10 else 0 if now < 12 else 8000
+        dmg = min(dps * step, health) if now < 16 else 0.0
+        health -= dmg
+        now += step
+        rows.append(LogRecord(now, dmg, health, max_health, now <= 16))
+    return [LogRecord(0.0, 0.0, max_health, max_health, True)] + rows
+
+
+class EncounterTest(unittest.TestCase):
+    def setUp(self):
+        self.encounter = analytics.Encounter(records())
+
+    def test_statistics(self):
+        encounter = self.encounter
+        self.assertEqual(encounter.damage, 72000)
+        self.assertEqual(encounter.dps(), 4000)
+        self.assertEqual(encounter.best_burst(4), (12.0, 8000))
+        self.assertEqual(encounter.best_burst(30), None)
+        self.assertEqual(encounter.time_to_kill(), 16.0)
+        self.assertEqual(encounter.downtime(), (2.0, 642))
+        self.assertEqual(encounter.percentiles(1, (50, 99)), [4000, 8000])
+        rolling = encounter.rolling_dps(1)
+        self.assertEqual((rolling[20], rolling[60]), (4000, 8000))
+
+    def test_window_not_positive(self):
+        for window in (0, -1):
+            self.assertRaises(ValueError, self.encounter.rolling_dps, window)
+            self.assertRaises(ValueError, self.encounter.best_burst, window)
+            self.assertRaises(ValueError, self.encounter.summary, (window,))
+
+    def test_empty(self):
+        encounter = analytics.Encounter([])
+        self.assertEqual(list(encounter.rolling_dps(1)), [])
+        self.assertEqual(encounter.best_burst(5), None)
+        self.assertEqual(encounter.percentiles(1), [0, 0, 0])
+        self.assertEqual(encounter.time_to_kill(), None)
+        self.assertEqual(encounter.downtime(), (0.0, 0))
+
+
+class PurePythonTest(EncounterTest):
+    """
+    The same statistics without NumPy
+    """
+    def setUp(self):
+        self._numpy, analytics.numpy = analytics.numpy, None
+        EncounterTest.setUp(self)
+
+    def tearDown(self):
+        analytics.numpy = self._numpy
+
+
+@unittest.skipIf(analytics.numpy is None, 'NumPy is not installed')
+class NumPyMatchesPythonTest(unittest.TestCase):
+    def test_jittered(self):
+        encounter = analytics.Encounter(records(0.05, 0.02))
+        vectorized = encounter.summary()
+        vectorized_rolling = list(encounter.rolling_dps(5))
+
+        numpy, analytics.numpy = analytics.numpy, None
+        try:
+            python = encounter.summary()
+            python_rolling = list(encounter.rolling_dps(5))
+        finally:
+            analytics.numpy = numpy
+
+        self.assertEqual(vectorized_rolling, python_rolling)
+        # summed in another order
+        self.assertAlmostEqual(vectorized.pop('downtime'),
+                               python.pop('downtime'))
+        self.assertEqual(vectorized, python)
+
+
+class FromLogTest(unittest.TestCase):
+    """
+    The columns loaded from a binary log, with and without NumPy
+    """
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.fname = os.path.join(self.dir, 'session.gwlog')
+        idle = [LogRecord(-2.0, 0.0, 0.0, 0.0, False)]
+        logformat = BinaryLogFormat()
+        with open(self.fname, 'wb') as fobj:
+            fobj.write(logformat.header())
+            fobj.write(logformat.records(idle + records(0.05, 0.02)))
+            fobj.write(logformat.footer())
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def load(self, number, use_numpy):
+        numpy = analytics.numpy
+        if not use_numpy:
+            analytics.numpy = None
+        try:
+            encounter = analytics.Encounter.from_log(self.fname, number)
+        finally:
+            analytics.numpy = numpy
+        return [getattr(encounter, name) for name in
+                ('times', 'dmg', 'health', 'max_health', 'incombat',
+                 'totals')]
+
+    def test_pure_python(self):
+        times, dmg, _, _, incombat, totals = self.load(0, False)
+        self.assertEqual(times[0], 0.0)
+        self.assertEqual(incombat[0], 1)
+        self.assertEqual(totals[-1], sum(dmg))
+
+    @unittest.skipIf(analytics.numpy is None, 'NumPy is not installed')
+    def test_numpy_matches_python(self):
+        for number in (0, None):
+            self.assertEqual(self.load(number, True),
+                             self.load(number, False))
+
+
+if __name__ == '__main__':
+    unittest.main()
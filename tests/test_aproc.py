@@ -0,0 +1,72 @@
+"""
+Tests of the pointer trails, on a simulated game
+"""
+from simproc import SimulatedProcess, Scenario, IMAGE_BASE
+from gw2dps import DamageMeter
+import aproc
+import unittest
+
+
+class PointerTrailTest(unittest.TestCase):
+    def setUp(self):
+        self.sim = SimulatedProcess()
+        self.proc = aproc.Proc(backend=self.sim)
+        base, self.offsets = self.sim.chains['wboss']
+        self.base = IMAGE_BASE + base
+
+    def resolve(self):
+        return self.proc.pointer_trail(self.base, self.offsets,
+                                       rtntype=None).addr
+
+    def test_reads(self):
+        # one read per link, every time
+        reads = []
+        read = self.sim.read
+        self.sim.read = lambda *args: reads.append(args[0]) or read(*args)
+        target = self.sim.spawn(1000)
+        self.sim.select('wboss', target)
+        for _ in xrange(4):
+            self.assertEqual(self.resolve(), target)
+        self.assertEqual(len(reads), 4 * len(self.offsets))
+
+    def test_last_link_changed(self):
+        self.sim.select('wboss', self.sim.spawn(1000))
+        self.resolve()
+        target = self.sim.spawn(2000)
+        self.sim.select('wboss', target)
+        self.assertEqual(self.resolve(), target)
+
+    def test_middle_link_changed(self):
+        self.sim.select('wboss', self.sim.spawn(1000))
+        self.resolve()
+        self.resolve()
+        target = self.sim.spawn(2000)
+        self.sim.relink('wboss', target)
+        self.assertEqual(self.resolve(), target)
+
+    def test_null_trail(self):
+        self.sim.deselect()
+        self.assertEqual(self.resolve(), None)
+        target = self.sim.spawn(1000)
+        self.sim.select('wboss', target)
+        self.assertEqual(self.resolve(), target)
+
+
+class RelinkScenarioTest(unittest.TestCase):
+    def test_meter_follows_relinked_target(self):
+        sim = SimulatedProcess()
+        meter = DamageMeter(ms=250, backend=sim, clock=sim.clock)
+        scenario = Scenario(sim, [(0, 'target', 'wboss', 50000),
+                                  (1, 'relink', 'wboss', 80000),
+                                  (2, 'deselect')])
+        while sim.time < 1.5:
+            scenario.advance(0.25)
+            dmg, health, max_health, stamp = meter.target_health_values()
+            if sim.time >= 1:
+                self.assertEqual(max_health, 80000)
+            else:
+                self.assertEqual(max_health, 50000)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,35 @@
+"""
+Tests of the session log files
+"""
+from combatlog import session_filename
+import combatlog
+import tempfile
+import shutil
+import os
+import unittest
+
+
+class SessionFilenameTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_same_second(self):
+        strftime, combatlog.time.strftime = combatlog.time.strftime, \
+                                             lambda fmt: '20140101-120000'
+        try:
+            names = []
+            for _ in xrange(3):
+                names.append(session_filename(self.dir))
+                open(names[-1], 'w').close()
+        finally:
+            combatlog.time.strftime = strftime
+        self.assertEqual([os.path.basename(name) for name in names],
+                         ['dps-20140101-120000.txt',
+                          'dps-20140101-120000-2.txt',
+                          'dps-20140101-120000-3.txt'])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,160 @@
+"""
+Tests of the dps calculations when the samples aren't evenly spaced
+"""
+from simproc import SimulatedProcess, Scenario
+from gw2dps import DamageMeter
+from sampler import Sampler
+from dps import DPSEngine, CombatTracker, StreamStats, P2Quantile
+import dps
+import random
+import unittest
+
+DPS = 5000
+
+
+def jittered(period, jitter, count, seed=1):
+    """
+    Returns count increasing sample times, period apart plus or minus
+    jitter seconds, with a few stalls of several periods
+    """
+    rand = random.Random(seed)
+    times, now = [], 0.0
+    for index in xrange(count):
+        step = period + rand.uniform(-jitter, jitter)
+        if index % 37 == 0:
+            # the UI thread was busy
+            step += period * rand.randint(1, 4)
+        now += step
+        times.append(now)
+    return times
+
+
+class DPSEngineJitterTest(unittest.TestCase):
+    def check(self, period, jitter):
+        engine = DPSEngine(ms=period * 1000, windows=(1, 5))
+        times = jittered(period, jitter, 400)
+        previous = 0.0
+        for stamp in times:
+            # constant dps, the damage depends on the real elapsed time
+            engine.add_sample(DPS * (stamp - previous), stamp)
+            previous = stamp
+            # once the samples span the longest window
+            if stamp - times[0] > 5:
+                self.assertAlmostEqual(engine.dps(1), DPS, delta=1)
+                self.assertAlmostEqual(engine.dps(5), DPS, delta=1)
+
+    def test_jitter(self):
+        self.check(0.25, 0.04)
+
+    def test_heavy_jitter(self):
+        self.check(0.25, 0.2)
+
+    def test_fast_rate(self):
+        self.check(0.05, 0.02)
+
+    def test_window_not_full(self):
+        engine = DPSEngine(ms=250, windows=(5,))
+        engine.add_sample(0, 0.0)
+        engine.add_sample(DPS * 0.3, 0.3)
+        self.assertEqual(engine.dps(5), 0)
+
+
+class SamplerJitterTest(unittest.TestCase):
+    def test_sampled_dps(self):
+        sim = SimulatedProcess()
+        meter = DamageMeter(ms=250, backend=sim, clock=sim.clock)
+        sampler = Sampler(meter, ms=250)
+        scenario = Scenario(sim, [(0, 'target', 'wboss', 10**6),
+                                  (0, 'combat', True),
+                                  (0, 'drain', DPS),
+                                  (1000, 'deselect')])
+
+        previous = 0.0
+        checked = 0
+        for stamp in jittered(0.25, 0.06, 200, seed=7):
+            scenario.advance(stamp - previous)
+            previous = stamp
+            sample = sampler.sample()
+            if stamp > 6:
+                # the health is a float, allow for its rounding
+                self.assertAlmostEqual(sample.instant, DPS, delta=DPS * 0.002)
+                self.assertAlmostEqual(sample.sustained, DPS,
+                                       delta=DPS * 0.002)
+                checked += 1
+        self.assertTrue(checked > 100)
+
+
+class CombatTrackerTest(unittest.TestCase):
+    def test_rate_change(self):
+        # 10s at 1000 dps sampled every 50ms, then 10s at 3000 dps sampled
+        # every 250ms: the time average is 2000
+        tracker = CombatTracker()
+        stamp = 0.0
+        tracker.add(0, False, stamp)
+        for period, dps in [(0.05, 1000), (0.25, 3000)]:
+            for _ in xrange(int(round(10 / period))):
+                stamp += period
+                tracker.add(dps, True, stamp)
+        tracker.add(0, False, stamp + 0.25)
+
+        self.assertEqual(tracker.prev_incombat_avg, 2000)
+        stats = tracker.prev_incombat
+        self.assertAlmostEqual(stats.weight, 20.0)
+        self.assertAlmostEqual(stats.total, 40000.0, places=3)
+        self.assertAlmostEqual(stats.stdev, 1000.0, places=3)
+        # half the time at each dps, unweighted the p95 would be below 3000
+        # and the average 1333
+        median, p95, p99 = stats.quantiles()
+        self.assertTrue(1000 < median < 3000)
+        self.assertAlmostEqual(p95, 3000, delta=1)
+
+    def test_trailing_zeros(self):
+        tracker = CombatTracker()
+        for stamp, dps in enumerate([0, 100, 0, 300, 0, 0, 0]):
+            tracker.add(dps, True, stamp)
+        tracker.add(0, False, 7)
+        # the zeros before 300 count, the ones at the end don't
+        self.assertEqual(tracker.prev_incombat_avg, 133)
+        self.assertEqual(tracker.prev_incombat.count, 4)
+
+    def test_long_zero_streak(self):
+        # 10 minutes at 0 dps (i.e. a boss phase), then the next non zero
+        # value feeds each quantile once, whatever the weight of the zeros
+        calls = []
+        add = dps.P2Quantile.add
+        dps.P2Quantile.add = lambda self, value, weight=1.0: \
+            calls.append(weight) or add(self, value, weight)
+        try:
+            tracker = CombatTracker()
+            stamp = 0.0
+            for index in xrange(2400 + 40):
+                stamp += 0.25
+                tracker.add(3000 if index < 40 else 0, True, stamp)
+            del calls[:]
+            tracker.add(3000, True, stamp + 0.25)
+        finally:
+            dps.P2Quantile.add = add
+        self.assertEqual(len(calls), 2 * len(StreamStats.QUANTILES))
+        self.assertAlmostEqual(max(calls), 600 / 0.05)
+
+    def test_weighted_quantile(self):
+        # a value of weight w is w values of weight 1
+        weighted, repeated = P2Quantile(0.9), P2Quantile(0.9)
+        for index in xrange(200):
+            value, weight = index % 7 * 100, index % 3 + 1
+            weighted.add(value, weight)
+            for _ in xrange(weight):
+                repeated.add(value)
+        self.assertAlmostEqual(weighted.value(), repeated.value(), delta=50)
+
+    def test_unweighted(self):
+        stats = StreamStats(trim_zeros=False)
+        for value in [1, 2, 3, 4]:
+            stats.add(value)
+        self.assertEqual(stats.count, 4)
+        self.assertAlmostEqual(stats.mean, 2.5)
+        self.assertAlmostEqual(stats.variance, 1.25)
+
+
+if __name__ == '__main__':
+    unittest.main()
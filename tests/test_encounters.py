@@ -0,0 +1,211 @@
+"""
+Tests of the encounters split from the samples and their storage
+"""
+from simproc import SimulatedProcess, Scenario, fight
+from gw2dps import DamageMeter
+from sampler import Sampler, READ_FAILED
+from samplebus import SampleBus, TARGET_DIED
+from sessionlog import BinaryLogFormat
+from encounters import Segmenter, EncounterStore, import_log, add_batches, \
+                       DEATH, COMBAT
+import tempfile
+import shutil
+import os
+import unittest
+
+
+def samples(seconds, dps=5000, period=0.25, max_health=None):
+    """
+    Returns the Samples of a fight of the simulated meter
+    """
+    sim = SimulatedProcess()
+    meter = DamageMeter(ms=period*1000, backend=sim, clock=sim.clock)
+    sampler = Sampler(meter, ms=period*1000)
+    scenario = Scenario(sim, fight(seconds, dps, max_health))
+    result = []
+    while sim.time < seconds + 3:
+        scenario.advance(period)
+        result.append(sampler.sample())
+    return result
+
+
+def damage(fought):
+    """
+    Damage of the samples in combat, the first one is the reference
+    """
+    return sum([sample.dmg for sample in fought if sample.incombat][1:])
+
+
+class SegmenterTest(unittest.TestCase):
+    def setUp(self):
+        self.batches = []
+        self.segmenter = Segmenter(lambda *batch: self.batches.append(batch),
+                                   batch_size=16)
+
+    def test_batches(self):
+        fought = samples(60)
+        for sample in fought:
+            self.segmenter.add(sample)
+            # never more than a batch of samples kept
+            self.assertTrue(len(self.segmenter._samples) < 16)
+        self.segmenter.flush()
+
+        self.assertTrue(len(self.batches) > 10)
+        self.assertEqual(set([batch[0] for batch in self.batches]), set([1]))
+        number, last, summary, ended = self.batches[-1]
+        self.assertEqual(ended, COMBAT)
+        self.assertEqual(summary.damage, damage(fought))
+        self.assertEqual(summary.count, sum([len(batch[1])
+                                             for batch in self.batches]))
+
+    def test_death(self):
+        for sample in samples(20, max_health=50000):
+            self.segmenter.add(sample)
+        summary, ended = self.batches[-1][2:]
+        self.assertEqual(ended, DEATH)
+        self.assertEqual(summary.damage, 50000)
+
+    def test_read_failed(self):
+        fought = samples(20, max_health=200000)
+        for index, sample in enumerate(fought):
+            if index == 30:
+                self.segmenter.add(sample._replace(health=READ_FAILED,
+                                                   dmg=0))
+            self.segmenter.add(sample)
+        self.segmenter.flush()
+        ended = [batch[3] for batch in self.batches if batch[2]]
+        self.assertEqual(ended, [COMBAT])
+
+
+class MeterReadFailedTest(unittest.TestCase):
+    def test_not_a_death(self):
+        sim = SimulatedProcess()
+        meter = DamageMeter(ms=250, backend=sim, clock=sim.clock)
+        sampler = Sampler(meter, ms=250)
+        bus = SampleBus()
+        died = []
+        bus.subscribe(TARGET_DIED, died.append)
+
+        scenario = Scenario(sim, fight(10, max_health=100000))
+        taken = []
+        while sim.time < 6:
+            scenario.advance(0.25)
+            if sim.time == 3:
+                sim.protect(sim.target)
+            elif sim.time == 4:
+                sim.protect(sim.target, False)
+            taken.append(sampler.sample())
+            bus.publish(taken[-1:])
+
+        failed = [sample for sample in taken if sample.health == READ_FAILED]
+        self.assertEqual(len(failed), 4)
+        self.assertEqual(sum([sample.dmg for sample in failed]), 0)
+        self.assertEqual(died, [])
+        # the damage done while it couldn't be read is in the next sample,
+        # only the damage before the first sample is missing
+        self.assertEqual(sum([sample.dmg for sample in taken]), 30000 - 1250)
+
+
+class EncounterStoreTest(unittest.TestCase):
+    def setUp(self):
+        self.store = EncounterStore(':memory:')
+        self.batches = []
+        self.segmenter = Segmenter(lambda *batch: self.batches.append(batch),
+                                   batch_size=16)
+
+    def tearDown(self):
+        self.store.close()
+
+    def test_recorded_in_chunks(self):
+        fought = samples(60)
+        for index, sample in enumerate(fought):
+            self.segmenter.add(sample)
+            if index == 100:
+                add_batches(self.store, self.batches, 1000.0)
+                # still being recorded
+                self.assertEqual(self.store.encounters(), [])
+        self.segmenter.flush()
+        self.assertEqual(add_batches(self.store, self.batches, 1000.0), 1)
+
+        encounter, = self.store.encounters()
+        self.assertEqual(encounter['damage'], damage(fought))
+        self.assertEqual(encounter['max_instant'], 5000)
+        self.assertEqual(encounter['ended'], COMBAT)
+        records = self.store.samples(encounter['id'])
+        self.assertEqual(len(records), encounter['samples'])
+        self.assertEqual(encounter['started'], 1000.0 + records[0].time)
+        self.assertEqual(sum([record.dmg for record in records[1:]]),
+                         damage(fought))
+
+    def test_no_damage_dropped(self):
+        for sample in samples(30, dps=0):
+            self.segmenter.add(sample)
+            if len(self.batches) == 2:
+                add_batches(self.store, self.batches, 0.0)
+        self.segmenter.flush()
+        self.assertEqual(add_batches(self.store, self.batches, 0.0), 0)
+        self.assertEqual(self.store._db.execute(
+                         'SELECT COUNT(*) FROM samples').fetchone()[0], 0)
+        self.assertEqual(self.store._db.execute(
+                         'SELECT COUNT(*) FROM encounters').fetchone()[0], 0)
+
+
+class InterruptedRecordingTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_deleted_on_open(self):
+        fname = os.path.join(self.dir, 'encounters.db')
+        batches = []
+        segmenter = Segmenter(lambda *batch: batches.append(batch),
+                              batch_size=16)
+        store = EncounterStore(fname)
+        for sample in samples(20):
+            segmenter.add(sample)
+            if len(batches) == 3:
+                break
+        add_batches(store, batches, 0.0)
+        # killed while recording, the encounter never ended
+        store.close()
+
+        store = EncounterStore(fname)
+        try:
+            for table in ('encounters', 'samples'):
+                self.assertEqual(store._db.execute(
+                                 'SELECT COUNT(*) FROM %s' % table
+                                 ).fetchone()[0], 0)
+        finally:
+            store.close()
+
+
+class ImportLogTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_max_instant(self):
+        fname = os.path.join(self.dir, 'session.gwlog')
+        fought = samples(30, max_health=100000)
+        logformat = BinaryLogFormat()
+        with open(fname, 'wb') as fobj:
+            fobj.write(logformat.header(fought[0]))
+            fobj.write(logformat.records(fought))
+            fobj.write(logformat.footer())
+
+        store = EncounterStore(':memory:')
+        try:
+            self.assertEqual(import_log(fname, store, batch_size=2), 1)
+            encounter, = store.encounters()
+        finally:
+            store.close()
+        self.assertEqual(encounter['ended'], DEATH)
+        self.assertEqual(encounter['max_instant'], 5000)
+
+
+if __name__ == '__main__':
+    unittest.main()
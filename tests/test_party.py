@@ -0,0 +1,82 @@
+"""
+Tests of the party totals and server, with meters whose clocks disagree
+"""
+from party import PartyTotals, PartyServer, PartyClient, Frame
+from sampler import Sample
+import time
+import unittest
+
+BOSS = 50000.0
+
+
+def frame(meter, seq, stamp, dmg):
+    return Frame(meter, seq, stamp, dmg, BOSS, BOSS, True, 0, 0, BOSS)
+
+
+class PartyTotalsTest(unittest.TestCase):
+    def setUp(self):
+        self.totals = PartyTotals(windows=(1, 5))
+
+    def test_skewed_meters(self):
+        self.assertTrue(self.totals.add(frame('a', 1, 100.0, 0)))
+        # b's clock is 8s behind, older than the longest window
+        self.assertTrue(self.totals.add(frame('b', 1, 92.0, 1000)))
+        self.assertTrue(self.totals.add(frame('a', 2, 100.5, 1000)))
+        self.assertTrue(self.totals.add(frame('b', 2, 92.5, 1000)))
+        self.assertTrue(self.totals.add(frame('a', 3, 101.0, 1000)))
+        self.assertEqual(self.totals.target_dps(BOSS, 5),
+                         (2000, {'a': 2000}))
+
+    def test_late_within_window(self):
+        self.totals.add(frame('a', 1, 100.0, 1000))
+        self.totals.add(frame('a', 2, 101.0, 1000))
+        self.totals.add(frame('b', 1, 97.0, 1000))
+        # the damage is spread over 97-101s
+        self.assertEqual(self.totals.target_dps(BOSS, 5),
+                         (750, {'a': 500, 'b': 250}))
+
+
+class PartyServerTest(unittest.TestCase):
+    def setUp(self):
+        self.server = PartyServer('127.0.0.1', 0, report_port=0,
+                                  poll_secs=0.05)
+        self.server.start()
+
+    def tearDown(self):
+        self.server.close()
+
+    def test_skewed_meters(self):
+        now = time.time()
+        # b's clock is 8s ahead, its frames are 8s behind
+        clients = [PartyClient(self.server.address, 'b', 'tcp',
+                               clock=lambda: time.time() + 8),
+                   PartyClient(self.server.address, 'a', 'tcp',
+                               clock=time.time)]
+        for client in clients:
+            # not the meter's name
+            self.assertEqual(client.name, 'gw2dps party')
+        self.assertEqual(clients[0].meter_name, 'b')
+
+        for tick in xrange(20):
+            for client in clients:
+                client.send([Sample(now + tick * 0.25, 250 if tick else 0,
+                                    BOSS, BOSS, True, 1000, 1000, 0x1000)])
+
+        deadline = time.time() + 5
+        while self.server.report()['frames'] < 40 and \
+              time.time() < deadline:
+            time.sleep(0.05)
+        for client in clients:
+            client.close()
+
+        self.assertTrue(self.server.is_alive())
+        report = self.server.report()
+        self.assertEqual(report['frames'], 40)
+        self.assertEqual(sorted(report['meters']), ['a', 'b'])
+        # b's frames are older than the windows of a's
+        self.assertEqual(report['targets']['%d' % BOSS]['meters'].keys(),
+                         ['a'])
+
+
+if __name__ == '__main__':
+    unittest.main()
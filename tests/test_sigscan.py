@@ -0,0 +1,195 @@
+"""
+Tests of the signature scanner, on synthetic images written in a simulated
+process
+"""
+from simproc import SimulatedProcess, IMAGE_BASE, PAGE_SIZE
+from sigscan import Signature, scan, code_sections
+import gw2dps
+import aproc
+import struct
+import tempfile
+import unittest
+import shutil
+import os
+
+# the images scanned are at the start of the simulated process' image,
+# which is zeros where nothing was written
+SIZE = 0x40000
+
+
+class SignatureTest(unittest.TestCase):
+    def test_wildcards(self):
+        signature = Signature('8B 0D ?? ?? ?? ?? 85 C9')
+        data = '\x90' * 10 + '\x8B\x0D\x01\x02\x03\x04\x85\xC9' + '\x90'
+        self.assertEqual(signature.search(data), 10)
+
+    def test_miss(self):
+        signature = Signature('8B 0D ?? ?? ?? ?? 85 C9')
+        # the anchor is found, but not the rest of the pattern
+        data = '\x8B\x0D\x01\x02\x03\x04\x85\xC8' + '\x85\xC9'
+        self.assertEqual(signature.search(data), -1)
+
+    def test_first_of_several(self):
+        signature = Signature('AA ?? CC')
+        data = '\x00\xAA\x01\xCC\xAA\x02\xCC'
+        self.assertEqual(signature.search(data), 1)
+        self.assertEqual(signature.search(data, 2), 4)
+        self.assertEqual(signature.search(data, 0, 1), -1)
+
+    def test_invalid(self):
+        for pattern in ['', '?? ??', 'AAA', 'GG', '100']:
+            self.assertRaises(ValueError, Signature, pattern)
+        self.assertRaises(ValueError, Signature, 'AA', 0, 'rel')
+
+
+class ScanTest(unittest.TestCase):
+    def setUp(self):
+        self.sim = SimulatedProcess()
+        self.proc = aproc.Proc(backend=self.sim)
+
+    def write(self, offset, data):
+        self.sim.write(IMAGE_BASE + offset, bytearray(data))
+
+    def scan(self, signatures, chunk_size=0x10000):
+        return scan(self.proc, signatures, IMAGE_BASE, SIZE, chunk_size)
+
+    def test_offsets(self):
+        self.write(0x1234, '\x8B\x0D' + struct.pack('<I', 0x01ABCDEF) +
+                           '\x85\xC9')
+        # rip relative: displacement from the end of the 4 bytes
+        self.write(0x3000, '\x48\x8B\x05' + struct.pack('<i', -0x100) +
+                           '\xC3')
+        self.write(0x5000, '\xDE\xAD\xBE\xEF')
+        found = self.scan({
+            'abs': Signature('8B 0D ?? ?? ?? ?? 85 C9', 2, 'abs'),
+            'rip': Signature('48 8B 05 ?? ?? ?? ?? C3', 3, 'rip'),
+            'match': Signature('DE AD ?? EF', 1),
+            'missing': Signature('12 34 56 78 9A')})
+        self.assertEqual(found, {
+            'abs': 0x01ABCDEF,
+            'rip': IMAGE_BASE + 0x3000 + 3 + 4 - 0x100,
+            'match': IMAGE_BASE + 0x5000 + 1})
+
+    def test_first_match(self):
+        for offset in [0x20000, 0x800, 0x30000]:
+            self.write(offset, '\xCA\xFE\x00\xBA\xBE')
+        found = self.scan({'sig': Signature('CA FE ?? BA BE')})
+        self.assertEqual(found, {'sig': IMAGE_BASE + 0x800})
+
+    def test_across_chunks(self):
+        # the match starts 2 bytes before the end of a chunk
+        self.write(0x10000 - 2, '\x11\x22\x33\x44\x55\x66')
+        found = self.scan({'sig': Signature('11 22 ?? 44 55 66')})
+        self.assertEqual(found, {'sig': IMAGE_BASE + 0x10000 - 2})
+
+    def test_unreadable_pages(self):
+        # the image ends in the middle of a chunk, the pages after it can't
+        # be read and are scanned as zeros
+        size = self.sim.image_size
+        self.write(size - 0x10, '\xAB\xCD\xEF')
+        found = scan(self.proc, {'sig': Signature('AB CD EF'),
+                                 'zeros': Signature('00 00 AB')},
+                     IMAGE_BASE + size - 0x8000, 0x10000, 0x10000)
+        self.assertEqual(found['sig'], IMAGE_BASE + size - 0x10)
+        self.assertEqual(found['zeros'], IMAGE_BASE + size - 0x12)
+
+    def test_unresolved_address(self):
+        # the address of an 'abs' signature is read after the match, it
+        # fails past the end of the mapped memory (whole pages)
+        size = self.sim.image_size + (-self.sim.image_size) % PAGE_SIZE
+        self.write(size - 2, '\xF0\x0D')
+        found = scan(self.proc, {'sig': Signature('F0 0D', 2, 'abs')},
+                     IMAGE_BASE + size - PAGE_SIZE, PAGE_SIZE)
+        self.assertEqual(found, {})
+
+
+class CodeSectionsTest(unittest.TestCase):
+    def test_pe_header(self):
+        header = bytearray(PAGE_SIZE)
+        header[0:2] = 'MZ'
+        struct.pack_into('<I', header, 0x3C, 0x80)
+        header[0x80:0x84] = 'PE\0\0'
+        struct.pack_into('<H', header, 0x86, 2)
+        struct.pack_into('<H', header, 0x94, 0xE0)
+        sections = 0x80 + 0x18 + 0xE0
+        # .text, executable, then .data
+        struct.pack_into('<II', header, sections + 8, 0x5000, 0x1000)
+        struct.pack_into('<I', header, sections + 36, 0x60000020)
+        struct.pack_into('<II', header, sections + 48, 0x2000, 0x6000)
+        struct.pack_into('<I', header, sections + 76, 0xC0000040)
+        self.assertEqual(code_sections(str(header)), [(0x1000, 0x5000)])
+        self.assertEqual(code_sections('\0' * PAGE_SIZE), [])
+
+
+class LocateAddressesTest(unittest.TestCase):
+    """
+    The code using the addresses is written in the image, the addresses are
+    found, cached by fingerprint, and used from the cache next time
+    """
+    def setUp(self):
+        self._saved = dict((name, getattr(gw2dps, name))
+                           for name in gw2dps.SIGNATURE_NAMES)
+        self._signatures = dict(gw2dps.SIGNATURES)
+        self.dir = tempfile.mkdtemp()
+        self.fname = os.path.join(self.dir, 'offsets.pkl')
+
+        self.sim = SimulatedProcess()
+        self.proc = aproc.Proc(backend=self.sim)
+        self.wboss = gw2dps.TARGET_HEALTH_WBOSS_BASE
+        self.incombat = gw2dps.INCOMBAT_ADDR1
+        self.sim.write(IMAGE_BASE + 0x1000, bytearray(
+                       '\xA1' + struct.pack('<I', IMAGE_BASE + self.wboss) +
+                       '\x8B\x48\x34'))
+        self.sim.write(IMAGE_BASE + 0x2000, bytearray(
+                       '\x83\x3D' + struct.pack('<I', self.incombat) +
+                       '\x00\x74'))
+        gw2dps.SIGNATURES.clear()
+        gw2dps.SIGNATURES.update({
+            'TARGET_HEALTH_WBOSS_BASE': Signature('A1 ?? ?? ?? ?? 8B 48 34',
+                                                  1, 'abs'),
+            'INCOMBAT_ADDR1': Signature('83 3D ?? ?? ?? ?? 00 74', 2, 'abs')})
+        # the defaults are wrong, as after a patch
+        gw2dps.TARGET_HEALTH_WBOSS_BASE = 0
+        gw2dps.INCOMBAT_ADDR1 = 0
+
+    def tearDown(self):
+        for name, value in self._saved.items():
+            setattr(gw2dps, name, value)
+        gw2dps.SIGNATURES.clear()
+        gw2dps.SIGNATURES.update(self._signatures)
+        shutil.rmtree(self.dir)
+
+    def test_scan_then_cache(self):
+        self.assertFalse(gw2dps.locate_addresses(self.proc, self.fname))
+        self.assertEqual(gw2dps.TARGET_HEALTH_WBOSS_BASE, self.wboss)
+        self.assertEqual(gw2dps.INCOMBAT_ADDR1, self.incombat)
+
+        gw2dps.TARGET_HEALTH_WBOSS_BASE = gw2dps.INCOMBAT_ADDR1 = 0
+        self.assertTrue(gw2dps.locate_addresses(self.proc, self.fname))
+        self.assertEqual(gw2dps.TARGET_HEALTH_WBOSS_BASE, self.wboss)
+        self.assertEqual(gw2dps.INCOMBAT_ADDR1, self.incombat)
+
+    def test_not_found_is_not_cached(self):
+        gw2dps.SIGNATURES['INCOMBAT_ADDR2'] = Signature('0F 1E ?? 2D 3C')
+        self.assertFalse(gw2dps.locate_addresses(self.proc, self.fname))
+        self.assertEqual(gw2dps.INCOMBAT_ADDR2,
+                         self._saved['INCOMBAT_ADDR2'])
+
+        # scanned again, and found once the code is there
+        gw2dps.INCOMBAT_ADDR2 = 0
+        self.sim.write(IMAGE_BASE + 0x3000, bytearray('\x0F\x1E\x00\x2D\x3C'))
+        self.assertFalse(gw2dps.locate_addresses(self.proc, self.fname))
+        self.assertEqual(gw2dps.INCOMBAT_ADDR2, IMAGE_BASE + 0x3000)
+        self.assertTrue(gw2dps.locate_addresses(self.proc, self.fname))
+
+    def test_signatures_changed(self):
+        gw2dps.locate_addresses(self.proc, self.fname)
+        # i.e. memory.txt was fixed, the cache of the old ones isn't used
+        gw2dps.SIGNATURES['INCOMBAT_ADDR1'] = Signature(
+                '83 3D ?? ?? ?? ?? 00', 2, 'abs')
+        self.assertFalse(gw2dps.locate_addresses(self.proc, self.fname))
+        self.assertTrue(gw2dps.locate_addresses(self.proc, self.fname))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,62 @@
+"""
+Tests of the targets tracked by the meter
+"""
+from simproc import SimulatedProcess
+from gw2dps import DamageMeter
+from sampler import Sampler
+import unittest
+
+
+class TrackTargetsTest(unittest.TestCase):
+    def setUp(self):
+        self.sim = SimulatedProcess()
+        self.meter = DamageMeter(ms=250, backend=self.sim,
+                                 clock=self.sim.clock)
+        self.boss = self.sim.spawn(100000)
+        self.add = self.sim.spawn(20000)
+        self.sim.select('wboss', self.boss)
+
+    def sample(self, seconds):
+        for _ in xrange(int(seconds / 0.25)):
+            self.sim.time += 0.25
+            self.sim.damage(1000)
+            self.sim.damage(500, self.add)
+            self.meter.target_health_values()
+
+    def test_not_read_until_used(self):
+        self.sample(2)
+        self.assertTrue(self.meter.targets is None)
+
+    def test_report(self):
+        self.meter.target_report()
+        self.meter.watch(self.add)
+        self.sample(6)
+        total, rows = self.meter.target_report(5)
+        self.assertEqual(total, 6000)
+        self.assertEqual([(addr, dps) for addr, _, _, dps in rows],
+                         [(self.boss, 4000), (self.add, 2000)])
+
+    def test_watched_unselected(self):
+        sampler = Sampler(self.meter, ms=250)
+        self.assertEqual(sampler.sample().watched, ())
+
+        self.meter.watch(self.add)
+        self.sim.select('wboss', self.boss)
+        healths = []
+        for _ in xrange(48):
+            self.sim.time += 0.25
+            self.sim.damage(500, self.add)
+            sample = sampler.sample()
+            self.assertEqual(sample.target, self.boss)
+            healths.append(dict((addr, health) for addr, health, _
+                                in sample.watched)[self.add])
+        # the add is followed until it dies, without being selected
+        self.assertEqual(healths[:2], [19500, 19000])
+        self.assertEqual(healths[38:], [500] + [0] * 9)
+
+        self.meter.unwatch(self.add)
+        self.assertEqual(sampler.sample().watched, ())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,128 @@
+"""
+Latency histograms for the sampling and display loops, to find out whether
+the memory reads, the dps calculations or the Tk updates make the meter lag.
+"""
+from bisect import bisect_left
+
+# upper bounds of the histogram buckets, in seconds. The last bucket holds
+# everything slower
+BOUNDS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01,
+          0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+
+
+class LatencyHistogram(object):
+    """
+    Histogram of latencies with fixed buckets. Recording a value is O(1) and
+    the memory used is constant.
+    """
+    def __init__(self, bounds=BOUNDS):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def record(self, seconds):
+        self.counts[bisect_left(self.bounds, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def percentile(self, percent):
+        """
+        Returns the upper bound of the bucket the percentile falls in (the
+        max for the last bucket), 0 if nothing was recorded
+        """
+        if not self.count:
+            return 0.0
+
+        rank = self.count * percent / 100.0
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank and count:
+                return self.bounds[index] if index < len(self.bounds) \
+                       else self.max
+        return self.max
+
+    def mean(self):
+        return self.total / self.count if self.count else 0.0
+
+    def snapshot(self):
+        """
+        Returns the histogram as a dict
+        """
+        return {'count': self.count,
+                'mean': self.mean(),
+                'max': self.max,
+                'p50': self.percentile(50),
+                'p99': self.percentile(99),
+                'buckets': zip(list(self.bounds) + [None], self.counts)}
+
+
+class TickStats(object):
+    """
+    Statistics of a periodic loop: a latency histogram for each phase of a
+    tick, histograms of the interval between ticks and of how late each tick
+    started compared to when it was scheduled, and the number of missed
+    deadlines (ticks that started more than tolerance seconds late).
+
+    Each histogram should only be recorded from one thread.
+    """
+    PHASES = ('read', 'compute', 'render')
+
+    def __init__(self, period, tolerance=None, phases=PHASES):
+        self.period = period
+        self.tolerance = period/2.0 if tolerance is None else tolerance
+        self.phases = dict((phase, LatencyHistogram()) for phase in phases)
+        self.intervals = LatencyHistogram()
+        self.lateness = LatencyHistogram()
+        self.missed = 0
+        self.ticks = 0
+        self._prev = None
+
+    def tick(self, scheduled, actual):
+        """
+        Record the start of a tick. scheduled is when it was supposed to
+        start, actual when it did
+        """
+        self.ticks += 1
+        late = actual - scheduled
+        self.lateness.record(max(late, 0.0))
+        if late > self.tolerance:
+            self.missed += 1
+
+        if self._prev is not None:
+            self.intervals.record(actual - self._prev)
+        self._prev = actual
+
+    def record(self, phase, seconds):
+        """
+        Record the time a phase of the tick took
+        """
+        self.phases[phase].record(seconds)
+
+    def snapshot(self):
+        """
+        Returns all the statistics as a dict
+        """
+        return {'period': self.period,
+                'ticks': self.ticks,
+                'missed': self.missed,
+                'intervals': self.intervals.snapshot(),
+                'lateness': self.lateness.snapshot(),
+                'phases': dict((phase, histogram.snapshot())
+                               for phase, histogram in self.phases.items())}
+
+    def summary(self):
+        """
+        Returns a one line summary, times in milliseconds
+        """
+        phases = ' '.join(['%s %.1f/%.1f' % (phase,
+                                             self.phases[phase].percentile(50)
+                                             * 1000,
+                                             self.phases[phase].percentile(99)
+                                             * 1000)
+                           for phase in self.PHASES if phase in self.phases])
+        return '%s  late %s/%s' % (phases, self.missed, self.ticks)
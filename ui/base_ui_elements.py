@@ -2,6 +2,22 @@
 UI base elements
 """
 import Tkinter as tk
+from sampler import clock
+
+
+def render(widget, **options):
+    """
+    Configure the widget with the options that changed since the last time
+    it was rendered, unchanged widgets aren't touched. Returns True if the
+    widget was configured
+    """
+    rendered = widget.__dict__.setdefault('_rendered', {})
+    changed = dict([(option, value) for option, value in options.iteritems()
+                    if option not in rendered or rendered[option] != value])
+    if changed:
+        widget.config(**changed)
+        rendered.update(changed)
+    return bool(changed)
 
 
 class FloatingWindow(tk.Toplevel):
@@ -57,7 +73,8 @@ class Display(tk.Frame):
         self._label.grid(row=0, column=0)
 
         self._ms = refresh_ms
-        self._max_display_ticks = 0
+        # time until which the display is frozen
+        self._frozen_until = 0
         self._display_info = {'value' : 0,
                               'font'  : defdisplay.get('font',
                                                        ('times', 15, 'bold')),
@@ -68,7 +85,7 @@ class Display(tk.Frame):
         """
         Freeze the display to display the value for the speficied period (secs)
         """
-        self._max_display_ticks = int(period*1000/self._ms)
+        self._frozen_until = clock() + period
         kwargs['overwrite'] = True
         self._set_display(value, **kwargs)
 
@@ -97,14 +114,10 @@ class Display(tk.Frame):
     def _isfrozen(self):
         """
         Return True if the display is set as frozen, False other wise.
-        A display can only be frozen for the _max_display_ticks. When
-        _max_display_ticks is 0, the display is "defrosed"
+        The display is frozen for a period of time, not a number of samples,
+        so it doesn't depend on how often the samples are taken
         """
-        rtn = False
-        if self._max_display_ticks > 0:
-            rtn = True
-            self._max_display_ticks -= 1
-        return rtn
+        return clock() < self._frozen_until
 
     def _set_background(self, bg):
         for widget in [self, self._label]:
@@ -112,9 +125,9 @@ class Display(tk.Frame):
 
     def update_display(self):
         """
-        Updates the display
+        Updates the display, if it changed since the last update
         """
         value = self._display_info['value']
         font = self._display_info['font']
         fg = self._display_info['colour']
-        self._label.config(text = '%s' % value, fg=fg, anchor=tk.W, font=font)
\ No newline at end of file
+        render(self._label, text='%s' % value, fg=fg, anchor=tk.W, font=font)
\ No newline at end of file
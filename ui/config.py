@@ -1,11 +1,26 @@
 """
 UI Configuration file parser
 """
-from ConfigParser import SafeConfigParser
-
-def config(fname, section, additional_dct=None):
+import os
+
+# parsed files by name, with the modification time they were parsed at
+_PARSERS = {}
+
+def _parser(fname):
+    """
+    Returns the parsed file. Each file is only parsed once for all the
+    windows, and again if it was modified since
+    """
+    mtime = os.path.getmtime(fname) if os.path.exists(fname) else None
+    if fname not in _PARSERS or _PARSERS[fname][0] != mtime:
+        from ConfigParser import SafeConfigParser
         parser = SafeConfigParser()
         parser.read(fname)
+        _PARSERS[fname] = (mtime, parser)
+    return _PARSERS[fname][1]
+
+def config(fname, section, additional_dct=None):
+        parser = _parser(fname)
 
         items = ['font',
                  'size',
@@ -2,9 +2,12 @@
 UI Elements for the DPS Display
 """
 import Tkinter as tk
-from base_ui_elements import FloatingWindow, Display
+from base_ui_elements import FloatingWindow, Display, render
 from config import config
-import re, time
+from dps import CombatTracker
+from samplebus import SAMPLE, TARGET_DIED
+from sampler import READ_FAILED
+import re, time, os
 
 
 def getconfig(name, kwargs, additional=None):
@@ -43,17 +46,26 @@ def ifobject(func):
             return func(self, *args, **kwargs)
     return ifobject_dec
 
-def last_nonzero_value_index(lst):
+class SubscribedWindow(FloatingWindow):
     """
-    Return index of the last non-zeron value. If no zeros found, return None
+    FloatingWindow receiving the samples of a samplebus.SampleBus, its
+    subscriptions end when the window is destroyed
     """
-    for index, value in enumerate(reversed(lst)):
-        if value != 0:
-            return len(lst) - 1 - index
-    return None
+    def subscribe(self, bus, kind, callback):
+        """
+        Subscribe callback to the events of kind, if there's a bus
+        """
+        if bus is None:
+            return
+        bus.subscribe(kind, callback)
+        self.__dict__.setdefault('_subscriptions', []).append((bus, callback))
 
+    def destroy(self):
+        for bus, callback in self.__dict__.pop('_subscriptions', []):
+            bus.unsubscribe(callback)
+        FloatingWindow.destroy(self)
 
-class DPSDisplay(FloatingWindow):
+class DPSDisplay(SubscribedWindow):
     """
     FloatingWindow of the DPS Display
     """
@@ -70,6 +82,8 @@ class DPSDisplay(FloatingWindow):
         FloatingWindow.__init__(self,  *args, bg=conf.get('bg'))
 
         self._ms = kwargs.get('ms', 250)
+        # callable returning a dict of name: TickStats for the debug tab
+        self._stats = kwargs.get('stats')
 
         # lists for storing the dmg samples
         self._sustained_dps = []
@@ -87,12 +101,18 @@ class DPSDisplay(FloatingWindow):
         self._pop_up_frame2 = SummaryTab(self, text=sustained, **sumconf)
         self.sustained.grid(row=3, column=1)
 
+        self._debug_tab = DebugTab(self, bg=sumconf['bg'],
+                                   fg=sumconf.get('fg'))
+
+        self.subscribe(kwargs.get('bus'), SAMPLE, self.on_sample)
+
         self.attributes('-alpha', alpha)
         self.bind('<Double-Button-1>', self.toggle_summary)
 
     def set_background(self, bg):
         for display in [self.instant, self.sustained,
-                        self._pop_up_frame1, self._pop_up_frame2]:
+                        self._pop_up_frame1, self._pop_up_frame2,
+                        self._debug_tab]:
             display.set_background(bg)
         self.config(bg=bg)
 
@@ -104,24 +124,52 @@ class DPSDisplay(FloatingWindow):
         if self._sum:
             self._pop_up_frame1.grid(row=5, column=1)
             self._pop_up_frame2.grid(row=6, column=1)
+            if self._stats:
+                self._debug_tab.grid(row=7, column=1)
         else:
             self._pop_up_frame1.grid_forget()
             self._pop_up_frame2.grid_forget()
+            self._debug_tab.grid_forget()
 
-    def update_data(self, instant_dps, sustained_dps, incombat_indicator):
-        self.instant.display_dps(instant_dps, incombat_indicator)
-        self.sustained.display_dps(sustained_dps, incombat_indicator)
+    def update_data(self, instant_dps, sustained_dps, incombat_indicator,
+                    draw=True, stamp=None):
+        """
+        draw - render the displays. When several samples are processed at
+               once only the last one needs to be drawn
+
+        stamp - time of the sample, the in combat averages are weighted by
+                the time between the samples
+        """
+        self.instant.display_dps(instant_dps, incombat_indicator, draw, stamp)
+        self.sustained.display_dps(sustained_dps, incombat_indicator, draw,
+                                   stamp)
+        if not draw:
+            return
 
         self._pop_up_frame1.setvalues(self.instant.max,
-                                      self.instant.prev_incombat_avg)
+                                      self.instant.prev_incombat_avg,
+                                      self.instant.prev_incombat)
         self._pop_up_frame2.setvalues(self.sustained.max,
-                                      self.sustained.prev_incombat_avg)
+                                      self.sustained.prev_incombat_avg,
+                                      self.sustained.prev_incombat)
+
+        if self._sum and self._stats:
+            self._debug_tab.setstats(self._stats())
+
+    def on_sample(self, event):
+        sample = event.sample
+        self.update_data(sample.instant, sample.sustained, sample.incombat,
+                         draw=event.last, stamp=sample.time)
 
 
-class Timer(FloatingWindow):
-    def __init__(self, dmg_object, *args, **kwargs):
+class Timer(SubscribedWindow):
+    def __init__(self, *args, **kwargs):
         """
         Timer to record the time it took for the locked target to die.
+
+        The locked target is watched by the meter (see DamageMeter.watch),
+        so it's timed from the health the sampler reads even when another
+        target is selected.
         """
         conf, alpha = getconfig("Timer", kwargs)
 
@@ -135,15 +183,21 @@ class Timer(FloatingWindow):
                               anchor=tk.CENTER, **conf)
         self.label.grid(row=0, column=1)
 
-        self._dmg = dmg_object
-        self._target_lock = False
         self.bind('<Double-Button-1>', self.transition)
 
-        self._target = (None, None, -1)
-        self._time, self._ptime = 0, 0
-        self._stop = False
+        self._meter = kwargs.get('meter')
+        # (health address, health) of the locked target
+        self._target = (None, None)
+        # last sample published, the target selected
+        self._sample = None
+        # time of the sample before the locked target took damage
+        self._started = None
         self._cstate = 0
 
+        bus = kwargs.get('bus')
+        self.subscribe(bus, SAMPLE, self.on_sample)
+        self.subscribe(bus, TARGET_DIED, self.on_target_died)
+
         self.attributes('-alpha', alpha)
 
     def set_background(self, bg):
@@ -157,53 +211,98 @@ class Timer(FloatingWindow):
         """
         State transition
         """
-        self._target = self._dmg.selected_target()
+        self._unlock()
+        sample = self._sample
+        if sample is not None and sample.target:
+            self._target = (sample.target, sample.health)
+        else:
+            self._target = (None, None)
+
         if self._target[1] and self._cstate != 2:
+            if self._meter is not None:
+                self._meter.watch(self._target[0])
             self.label.config(text='Target Locked')
-            if self._cstate != 1:
-                self.run()
             self._cstate = 1
         elif self._cstate == 2:
             self._cstate = 0
-            self._stop   = True
             self._timereset()
         else:
             self._cstate = 0
             self.label.config(text='Lock Target')
 
-    def run(self):
+    def _health(self, sample):
         """
-        Timer running
+        Returns the health of the locked target read with sample, None if
+        it wasn't read
         """
-        if not self._target[0]:
-            return None
+        addr = self._target[0]
+        for watched, health, _ in sample.watched:
+            if watched == addr:
+                return health
+        # not watched, i.e. all the meter's slots are watched already
+        if sample.target == addr and sample.health != READ_FAILED:
+            return sample.health
+        return None
 
-        ch, chmax = self._dmg.get_health_value_pairs(self._target[0])
+    def on_sample(self, event):
+        """
+        Start the timer when the locked target takes damage, stop it when
+        it dies, and show the time while it runs
+        """
+        sample = event.sample
+        if sample.health != READ_FAILED:
+            self._sample = sample
+        if not self._cstate:
+            return
 
-        if ch != self._target[1]:
+        health = self._health(sample)
+        if self._cstate == 1 and health is not None and \
+           health != self._target[1]:
             self._cstate = 2
-            if self._ptime:
-                self._time += round(time.time() - self._ptime, 2)
-                self.label.config(text='%.2fs'% self._time )
+            self._started = event.previous.time if event.previous \
+                            else sample.time
 
-        self._ptime = time.time()
+        if self._cstate == 2 and health == 0:
+            self._stop(sample.time)
+        elif self._cstate == 2 and event.last:
+            render(self.label, text='%.2fs' % (sample.time - self._started))
 
-        if self._stop:
-            self._stop = False
-        elif ch != 0:
-            self.after(100, self.run)
-        else:
-            self._cstate = 0
-            self._timereset()
+    def on_target_died(self, event):
+        """
+        Stop the timer when the locked target dies while selected
+        """
+        # the meter drops the target when it dies
+        if self._cstate == 2 and event.previous.target == self._target[0]:
+            self._stop(event.sample.time)
+
+    def _stop(self, stamp):
+        """
+        Show the final time and unlock the target
+        """
+        render(self.label, text='%.2fs' % (stamp - self._started))
+        self._cstate = 0
+        self._timereset()
+        self._unlock()
+
+    def _unlock(self):
+        """
+        Stop watching the locked target
+        """
+        if self._meter is not None and self._target[0]:
+            self._meter.unwatch(self._target[0])
+        self._target = (None, None)
 
     def _timereset(self):
         """
         Reset the time values
         """
-        self._time = 0
-        self._ptime = 0
+        self._started = None
 
-class HealthBar(FloatingWindow):
+    def destroy(self):
+        self._unlock()
+        SubscribedWindow.destroy(self)
+
+class HealthBar(SubscribedWindow):
     """
     FloatingWindow Displaying the target health
     """
@@ -232,6 +331,8 @@ class HealthBar(FloatingWindow):
                                        anchor=tk.CENTER, **conf)
 
         self._percent_view = False
+        self.subscribe(kwargs.get('bus'), SAMPLE, self.on_sample)
+
         self.attributes('-alpha', alpha)
         self.bind('<Double-Button-1>', self.change_view)
 
@@ -261,19 +362,27 @@ class HealthBar(FloatingWindow):
                        self, self._other]:
             widget.config(bg=bg)
 
-    def update_data(self, current_health, max_health):
+    def update_data(self, current_health, max_health, draw=True):
         """
         Update the health display
         """
+        if not draw:
+            return
+
         current_health = current_health if current_health >= 0 else 0
         max_health = max_health if max_health >= 0 else 0
         percent = 0
         if max_health:
             percent = current_health/max_health*100
 
-        self._percent_health.config(text='%s'% int(percent) + '%')
-        self._target_health.config(text='{:,}'.format(int(current_health)))
-        self._target_max_health.config(text='{:,}'.format(int(max_health)))
+        render(self._percent_health, text='%s'% int(percent) + '%')
+        render(self._target_health, text='{:,}'.format(int(current_health)))
+        render(self._target_max_health, text='{:,}'.format(int(max_health)))
+
+    def on_sample(self, event):
+        if event.sample.health != READ_FAILED:
+            self.update_data(event.sample.health, event.sample.max_health,
+                             draw=event.last)
 
 
 class SummaryTab(tk.Frame):
@@ -310,29 +419,73 @@ class SummaryTab(tk.Frame):
                                      fg=avg_colour,width=6,
                                      bg=kwargs.get('bg'), anchor=tk.W)
 
+        # statistics of the last combat
+        self._statslabel = tk.Label(self, text='', font=("Helvetica", 7),
+                                    fg=avg_colour, bg=kwargs.get('bg'),
+                                    anchor=tk.W)
+
         self._value1label.grid(row=0, column=1)
         self._value2label.grid(row=0, column=2)
+        self._statslabel.grid(row=1, column=0, columnspan=3)
         # inital values
         self.value1, self.value2 = None, None
 
-    def setvalues(self, value1, value2):
+    def setvalues(self, value1, value2, stats=None):
         """
         Set the values in the labels only if they are different
+
+        stats - dps.StreamStats of the last combat, its deviation and
+                percentiles are displayed under the values
         """
-        if value1 != self.value1:
-            self._value1label.config(text='%s' % value1)
-            self.value1 = value1
+        self.value1, self.value2 = value1, value2
+        render(self._value1label, text='%s' % value1)
+        render(self._value2label, text='%s' % value2)
 
-        if value2 != self.value2:
-            self._value2label.config(text='%s' % value2)
-            self.value2 = value2
+        text = ''
+        if stats is not None and stats.count:
+            text = 'sd %d  p50 %d  p95 %d  p99 %d' % (
+                   (stats.stdev,) + tuple(stats.quantiles()))
+        render(self._statslabel, text=text)
 
     def set_background(self, bg):
         """
         Actively set the background
         """
-        for widget in [self, self._value1label,
-                       self._value2label, self._name_label]:
+        for widget in [self, self._value1label, self._value2label,
+                       self._statslabel, self._name_label]:
+            widget.config(bg=bg)
+
+
+class DebugTab(tk.Frame):
+    """
+    Frame in the summary pop up showing the latencies of the sampling and
+    display loops. The text is refreshed at most once a second
+    """
+    def __init__(self, *args, **kwargs):
+        tk.Frame.__init__(self, *args, bg=kwargs.get('bg'))
+        self._label = tk.Label(self, text='', font=("Helvetica", 7),
+                               bg=kwargs.get('bg'), fg=kwargs.get('fg'),
+                               justify=tk.LEFT, anchor=tk.W)
+        self._label.grid(row=0, column=0)
+        self._updated = 0
+
+    def setstats(self, stats):
+        """
+        stats is a dict of name: TickStats
+        """
+        if time.time() - self._updated < 1:
+            return
+        self._updated = time.time()
+
+        text = '\n'.join(['%s: %s' % (name, stats[name].summary())
+                          for name in sorted(stats)])
+        render(self._label, text=text)
+
+    def set_background(self, bg):
+        """
+        Actively set the background
+        """
+        for widget in [self, self._label]:
             widget.config(bg=bg)
 
 
@@ -356,13 +509,22 @@ class DamageDisplay(Display):
         self._label.grid(row=0, column=1)
 
         self._ms = refresh_ms
-        self._max_display_ticks = 0
         self._max_colour = optiondct.get('max_color', 'red')
 
-        self._incombat_samples = []
-        self.prev_incombat_avg = 0
+        self._tracker = CombatTracker()
         self._avg_colour = optiondct.get('avg_color', 'orange')
-        self.max = 0
+
+    @property
+    def max(self):
+        return self._tracker.max
+
+    @property
+    def prev_incombat_avg(self):
+        return self._tracker.prev_incombat_avg
+
+    @property
+    def prev_incombat(self):
+        return self._tracker.prev_incombat
 
     def _display_max(self, period=3):
         """
@@ -376,7 +538,7 @@ class DamageDisplay(Display):
         """
         Ability to reset the max and prev incombat avg
         """
-        self.max, self.prev_incombat_avg = 0, 0
+        self._tracker.reset()
         self._set_display(0, overwrite=True)
 
     def set_background(self, bg):
@@ -387,7 +549,7 @@ class DamageDisplay(Display):
             widget.config(bg=bg)
         self._set_background(bg)
 
-    def display_dps(self, dps, incombat_indicator):
+    def display_dps(self, dps, incombat_indicator, draw=True, stamp=None):
         """
         Display the dps.
 
@@ -395,28 +557,25 @@ class DamageDisplay(Display):
 
         incomabt_indicator - Used to calculate the incombat averages.
                     This needs to be True if in combat false otherwises
+
+        draw - update the label, otherwise only the max, averages and the
+               frozen displays are updated
+
+        stamp - time of the sample (see CombatTracker.add)
         """
-        if self.max < dps:
-            self.max = dps
+        newmax, newavg = self._tracker.add(dps, incombat_indicator, stamp)
+
+        if newmax:
             self._display_max()
 
-        if incombat_indicator:
-            self._incombat_samples.append(dps)
-        else:
-            # out of combat, calculate and display the averages
-            if self._incombat_samples:
-                nzero = last_nonzero_value_index(self._incombat_samples)
-                if nzero:
-                    nzero += 1
-                new_lst = self._incombat_samples[:nzero]
-                if new_lst:
-                    self.prev_incombat_avg = sum(new_lst)/len(new_lst)
-                    self.freeze_display(self.prev_incombat_avg, 5,
-                                        colour=self._avg_colour)
-                self._incombat_samples = []
+        if newavg:
+            # out of combat, display the averages
+            self.freeze_display(self.prev_incombat_avg, 5,
+                                colour=self._avg_colour)
 
         self._set_display(dps)
-        self.update_display()
+        if draw:
+            self.update_display()
 
 
 class Settings(tk.Toplevel):
@@ -452,24 +611,55 @@ class Checkbox(tk.Frame):
 
 class Logger(Checkbox):
     """
+    Checkbox that logs the samples to file while it is checked. Every time
+    it is checked a new session file is created in log_dir
+
+    binary - write binary session logs (see sessionlog) instead of text
+
+    bus - samplebus.SampleBus the samples are logged from
     """
-    def __init__(self, parent, name, fname, *args, **kwargs):
+    def __init__(self, parent, name, log_dir, binary=False, bus=None,
+                 *args, **kwargs):
         Checkbox.__init__(self, parent, name)
         self.attach_callback(self.checkbox_callback)
-        self._fname = fname
-        self._logging = False
+        self._log_dir = log_dir
+        self._binary = binary
+        self._writer = None
+        if bus is not None:
+            bus.subscribe(SAMPLE, self.on_sample)
 
     def checkbox_callback(self):
         if self.checkbox_value:
-            # clear file
-            self._filename = self._fname
-            open(self._filename, 'w').close()
-        self._logging = not self._logging
-
-    def log(self, value):
-        if self._logging:
-            with open(self._filename, 'a') as f:
-                f.write('%s\n' % value)
+            from combatlog import CombatLogWriter, TextLogFormat, \
+                                  session_filename
+            if not os.path.isdir(self._log_dir):
+                os.makedirs(self._log_dir)
+            if self._binary:
+                from sessionlog import BinaryLogFormat
+                logformat = BinaryLogFormat()
+            else:
+                logformat = TextLogFormat()
+            self._writer = CombatLogWriter(session_filename(self._log_dir,
+                                                            logformat),
+                                           logformat)
+            self._writer.start()
+        else:
+            self.close()
+
+    def log(self, sample):
+        if self._writer:
+            self._writer.log(sample)
+
+    def on_sample(self, event):
+        self.log(event.sample)
+
+    def close(self):
+        """
+        Ends the logging session
+        """
+        if self._writer:
+            self._writer.close()
+            self._writer = None
 
 
 class DisplayEnableCheckbox: